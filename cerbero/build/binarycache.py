@@ -0,0 +1,286 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import hashlib
+import tarfile
+import tempfile
+
+from cerbero.config import Platform
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+# Bump it when the contents of the archives or the keys change
+CACHE_VERSION = 3
+
+# Configuration that changes the binaries built by a recipe
+CONFIG_KEYS = ['target_platform', 'target_arch', 'target_distro',
+               'target_distro_version', 'prefix', 'lib_suffix', 'py_prefix',
+               'toolchain_prefix', 'toolchain_version', 'min_osx_sdk_version',
+               'osx_target_sdk_version', 'ios_platform', 'sysroot',
+               'target_arch_flags', 'universal_archs']
+
+# Variables of the build environment, set by cerbero and its configuration
+# files, that change the binaries built by a recipe. The rest, like HOME,
+# USER or the variables of the CI jobs, depend on who runs cerbero and where,
+# and would prevent sharing the cache between builders.
+BUILD_ENV = ['CC', 'CXX', 'CPP', 'CXXPP', 'OBJC', 'AS', 'GAS', 'LD', 'AR',
+             'NM', 'NMEDIT', 'RANLIB', 'STRIP', 'OBJCOPY', 'DLLTOOL', 'RC',
+             'WINDRES', 'CFLAGS', 'CPPFLAGS', 'CXXFLAGS', 'CCASFLAGS',
+             'OBJCFLAGS', 'LDFLAGS', 'OBJLDFLAGS', 'DIRECTX_CFLAGS',
+             'DIRECTX_LDFLAGS', 'DIRECTSOUND_CFLAGS', 'DIRECSOUND_LDFLAGS',
+             'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'LIBRARY_PATH',
+             'LD_LIBRARY_PATH', 'PKG_CONFIG', 'PKG_CONFIG_PATH',
+             'PKG_CONFIG_LIBDIR', 'ACLOCAL', 'ACLOCAL_FLAGS', 'PYTHON',
+             'PYTHON_INCLUDES', 'PYTHON_LIBS', 'PYTHONPATH', 'PERL5LIB']
+# Autoconf cache variables set by the configuration files
+BUILD_ENV_PREFIXES = ['ac_cv_']
+
+
+class BinaryCache(object):
+    '''
+    Content-addressed cache of the files installed by the recipes.
+
+    The archive of a recipe is stored under a key that hashes the recipe
+    file, the custom.py of its repository, its patches, its built version,
+    the configuration, the configuration files, the variables of the build
+    environment in L{BUILD_ENV} and the keys of its dependencies, so a
+    recipe is only restored when it would be built exactly in the same way.
+    The cache is a plain directory that can be shared between machines, the
+    least recently used archives are removed by L{evict} when it grows over
+    its maximum size.
+
+    @ivar path: directory of the cache
+    @type path: str
+    @ivar max_size: maximum size of the cache in bytes
+    @type max_size: int
+    '''
+
+    EXT = '.tar.gz'
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def recipe_key(self, recipe, config, deps_keys, custom=None):
+        '''
+        Computes the key of a recipe
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param config: configuration used to build the recipe
+        @type config: L{cerbero.config.Config}
+        @param deps_keys: keys of the direct dependencies of the recipe
+        @type deps_keys: list
+        @param custom: path of the custom.py of the recipes repository,
+                       which the recipe can subclass
+        @type custom: str
+        @return: the key
+        @rtype: str
+        '''
+        h = hashlib.sha256()
+        h.update('%s\0%s\0' % (CACHE_VERSION, recipe.name))
+        self._update_file(h, recipe.__file__)
+        self._update_file(h, custom)
+        for patch in getattr(recipe, 'patches', []):
+            if not os.path.isabs(patch):
+                patch = recipe.relative_path(patch)
+            self._update_file(h, patch)
+        h.update('%s\0' % recipe.built_version())
+        for key in CONFIG_KEYS:
+            h.update('%s=%r\0' % (key, getattr(config, key, None)))
+        h.update('%r\0' % sorted(config.variants.__dict__.items()))
+        # The config files and the environment can set CFLAGS, CC, the
+        # autoconf cache variables...
+        files = set(config.config_files)
+        for c in getattr(config, 'arch_config', {}).values():
+            files.update(c.config_files)
+        for filepath in sorted(files):
+            h.update('%s\0' % filepath)
+            self._update_file(h, filepath)
+        env = config.get_build_env()
+        for var in sorted(env.keys()):
+            if var in BUILD_ENV or \
+                    [x for x in BUILD_ENV_PREFIXES if var.startswith(x)]:
+                h.update('%s=%s\0' % (var, env[var]))
+        h.update('PATH=%r\0' % self._build_paths(config, env))
+        for key in sorted(deps_keys):
+            h.update('%s\0' % key)
+        return h.hexdigest()
+
+    def _build_paths(self, config, env):
+        '''
+        Gets the entries of the PATH of the build environment in the prefix,
+        the build tools prefix and the toolchain, which provide the tools
+        used by the build
+        '''
+        dirs = [getattr(config, x, None) for x in
+                ['prefix', 'build_tools_prefix', 'toolchain_prefix']]
+        dirs = [x.rstrip(os.sep) for x in dirs if x]
+        sep = config.platform == Platform.WINDOWS and ';' or ':'
+        paths = []
+        for path in env.get('PATH', '').split(sep):
+            if [x for x in dirs if path == x or path.startswith(x + os.sep)]:
+                paths.append(path)
+        return paths
+
+    def lookup(self, key):
+        '''
+        Checks if there is an archive for a key
+
+        @param key: key of the recipe
+        @type key: str
+        @return: whether the archive is in the cache
+        @rtype: bool
+        '''
+        return os.path.exists(self._archive_path(key))
+
+    def restore(self, key, prefix):
+        '''
+        Extracts the archive of a key in the prefix
+
+        @param key: key of the recipe
+        @type key: str
+        @param prefix: prefix where the files are extracted
+        @type prefix: str
+        @return: the restored files relative to the prefix, or None if the
+                 archive could not be restored
+        @rtype: list
+        '''
+        path = self._archive_path(key)
+        try:
+            tar = tarfile.open(path, 'r:gz')
+            try:
+                members = tar.getmembers()
+                # The cache can be shared, never write outside the prefix
+                for member in members:
+                    _check_member(member, prefix)
+                files = [x.name for x in members]
+                tar.extractall(prefix, members)
+            finally:
+                tar.close()
+            # Refresh it for the LRU eviction
+            os.utime(path, None)
+        except (IOError, OSError, tarfile.TarError), ex:
+            m.warning(_("Could not restore %s from the binary cache: %s") %
+                      (path, ex))
+            return None
+        return files
+
+    def store(self, key, prefix, files):
+        '''
+        Archives the files installed by a recipe
+
+        @param key: key of the recipe
+        @type key: str
+        @param prefix: prefix where the files are installed
+        @type prefix: str
+        @param files: files relative to the prefix
+        @type files: list
+        '''
+        path = self._archive_path(key)
+        tmp = None
+        try:
+            dirname = os.path.dirname(path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            # Write it to a temporary file renamed atomically, other
+            # machines sharing the cache could be reading it
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                tar = tarfile.open(fileobj=f, mode='w:gz')
+                for filename in files:
+                    tar.add(os.path.join(prefix, filename), filename,
+                            recursive=False)
+                tar.close()
+            os.rename(tmp, path)
+            tmp = None
+        except (IOError, OSError, tarfile.TarError), ex:
+            m.warning(_("Could not store %s in the binary cache: %s") %
+                      (path, ex))
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        '''
+        Removes the least recently used archives until the cache is smaller
+        than its maximum size. It walks the whole cache, which can be on a
+        shared volume, so it's meant to be called once per build.
+        '''
+        archives = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for f in filenames:
+                if not f.endswith(self.EXT):
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                archives.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        archives.sort()
+        while archives and total > self.max_size:
+            mtime, size, path = archives.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _archive_path(self, key):
+        return os.path.join(self.path, key[:2], key + self.EXT)
+
+    def _update_file(self, h, filepath):
+        if filepath is None or not os.path.exists(filepath):
+            h.update('\0')
+            return
+        with open(filepath, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).hexdigest())
+        h.update('\0')
+
+
+def _check_member(member, prefix):
+    '''
+    Checks that a member of an archive is extracted inside the prefix
+
+    @raise tarfile.TarError: if it's not
+    '''
+    prefix = os.path.realpath(prefix)
+
+    def inside(path):
+        path = os.path.normpath(os.path.join(prefix, path))
+        return path == prefix or path.startswith(prefix + os.sep)
+
+    if os.path.isabs(member.name) or not inside(member.name):
+        raise tarfile.TarError(_("%s is outside the prefix") % member.name)
+    if member.issym():
+        target = os.path.join(os.path.dirname(member.name), member.linkname)
+        if not inside(target):
+            raise tarfile.TarError(_("%s links outside the prefix") %
+                                   member.name)
+    elif member.islnk():
+        if os.path.isabs(member.linkname) or not inside(member.linkname):
+            raise tarfile.TarError(_("%s links outside the prefix") %
+                                   member.name)
+    elif not (member.isfile() or member.isdir()):
+        raise tarfile.TarError(_("%s is not a regular file") % member.name)
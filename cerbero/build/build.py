@@ -19,7 +19,7 @@
 import os
 
 from cerbero.config import Platform, Architecture, Distro
-from cerbero.utils import shell, to_unixpath, add_system_libs
+from cerbero.utils import shell, jobserver, to_unixpath, add_system_libs
 from cerbero.utils import messages as m
 import shutil
 import re
@@ -33,9 +33,16 @@ class Build (object):
     @type recipe: L{cerbero.recipe.Recipe}
     @ivar config: cerbero's configuration
     @type config: L{cerbero.config.Config}
+    @cvar supports_destdir: whether the install step can install the files
+                            in the staging directory set in destdir
+    @type supports_destdir: bool
+    @ivar destdir: staging directory used as DESTDIR by the install step
+    @type destdir: str
     '''
 
     _properties_keys = []
+    supports_destdir = False
+    destdir = None
 
     def configure(self):
         '''
@@ -75,17 +82,20 @@ class CustomBuild(Build):
 
 
 def modify_environment(func):
-    ''' Decorator to modify the build environment '''
+    '''
+    Decorator to set in L{MakefilesBase.env} the build environment used by
+    the commands of a build step
+    '''
     def call(*args):
         self = args[0]
-        append_env = self.append_env
-        new_env = self.new_env.copy()
-        if self.use_system_libs and self.config.allow_system_libs:
-            self._add_system_libs(new_env)
-        old_env = self._modify_env(append_env, new_env)
-        res = func(*args)
-        self._restore_env(old_env)
-        return res
+        if self.env is not None:
+            # Nested call, the environment is already set
+            return func(*args)
+        self.env = self._get_build_env()
+        try:
+            return func(*args)
+        finally:
+            self.env = None
 
     call.func_name = func.func_name
     return call
@@ -108,7 +118,9 @@ class MakefilesBase (Build):
     srcdir = '.'
     append_env = None
     new_env = None
+    env = None
     requires_non_src_build = False
+    supports_destdir = True
 
     def __init__(self):
         Build.__init__(self)
@@ -122,10 +134,13 @@ class MakefilesBase (Build):
             self.make_dir = os.path.join (self.config_src_dir, "cerbero-build-dir")
         else:
             self.make_dir = self.config_src_dir
+        self._use_jobserver = False
         if self.config.allow_parallel_build and self.allow_parallel_build \
                 and self.config.num_of_cpus > 1:
-            self.make += ' -j%d' % self.config.num_of_cpus
-        self._old_env = None
+            if self.config.make_jobserver:
+                self._use_jobserver = True
+            else:
+                self.make += ' -j%d' % self.config.num_of_cpus
 
     @modify_environment
     def configure(self):
@@ -141,67 +156,51 @@ class MakefilesBase (Build):
             'target': self.config.target,
             'build': self.config.build,
             'options': self.configure_options},
-            self.make_dir)
+            self.make_dir, env=self.env)
 
     @modify_environment
     def compile(self):
-        shell.call(self.make, self.make_dir)
+        shell.call(self.make, self.make_dir, env=self._make_env())
 
     @modify_environment
     def install(self):
-        shell.call(self.make_install, self.make_dir)
+        # Many install targets are not safe to run in parallel
+        env = self.env
+        if self.destdir is not None:
+            env = env.derive(new_env={'DESTDIR': self.destdir})
+        shell.call(self.make_install, self.make_dir, env=env)
 
     @modify_environment
     def clean(self):
-        shell.call(self.make_clean, self.make_dir)
+        shell.call(self.make_clean, self.make_dir, env=self.env)
 
     @modify_environment
     def check(self):
         if self.make_check:
-            shell.call(self.make_check, self.build_dir)
+            shell.call(self.make_check, self.build_dir, env=self.env)
 
-    def _modify_env(self, append_env, new_env):
+    def _make_env(self):
         '''
-        Modifies the build environment appending the values in
-        append_env or replacing the values in new_env
+        Gets the environment for make, which shares the host-wide
+        jobserver slots when it's enabled, keeping the MAKEFLAGS already set
         '''
-        if self._old_env is not None:
-            return None
-
-        self._old_env = {}
-        for var in append_env.keys() + new_env.keys():
-            self._old_env[var] = os.environ.get(var, None)
-
-        for var, val in append_env.iteritems():
-            os.environ[var] = '%s %s' % (os.environ.get(var, ''), val)
-
-        for var, val in new_env.iteritems():
-            if val is None:
-                if var in os.environ:
-                    del os.environ[var]
-            else:
-                os.environ[var] = val
-        return self._old_env
-
-    def _restore_env(self, old_env):
-        ''' Restores the old environment '''
-        if old_env is None:
-            return
-
-        for var, val in old_env.iteritems():
-            if val is None:
-                if var in os.environ:
-                    del os.environ[var]
-            else:
-                os.environ[var] = val
-        self._old_env = None
-
-    def _add_system_libs(self, new_env):
+        if not self._use_jobserver:
+            return self.env
+        makeflags = jobserver.makeflags(self.config.num_of_cpus)
+        if self.env.get('MAKEFLAGS'):
+            makeflags = '%s %s' % (self.env['MAKEFLAGS'], makeflags)
+        return self.env.derive(new_env={'MAKEFLAGS': makeflags})
+
+    def _get_build_env(self):
         '''
-        Add /usr/lib/pkgconfig to PKG_CONFIG_PATH so the system's .pc file
-        can be found.
+        Gets the environment of the configuration with the values in
+        append_env appended and the values in new_env replaced
         '''
-        add_system_libs(self.config, new_env)
+        env = self.config.get_build_env()
+        new_env = self.new_env.copy()
+        if self.use_system_libs and self.config.allow_system_libs:
+            add_system_libs(self.config, new_env, env)
+        return env.derive(self.append_env, new_env)
 
 
 class Autotools (MakefilesBase):
@@ -297,10 +296,10 @@ class CMake (MakefilesBase):
 
     @modify_environment
     def configure(self):
-        cc = os.environ.get('CC', 'gcc')
-        cxx = os.environ.get('CXX', 'g++')
-        cflags = os.environ.get('CFLAGS', '')
-        cxxflags = os.environ.get('CXXFLAGS', '')
+        cc = self.env.get('CC', 'gcc')
+        cxx = self.env.get('CXX', 'g++')
+        cflags = self.env.get('CFLAGS', '')
+        cxxflags = self.env.get('CXXFLAGS', '')
         # FIXME: CMake doesn't support passing "ccache $CC"
         if self.config.use_ccache:
             cc = cc.replace('ccache', '').strip()
@@ -18,16 +18,21 @@
 
 from collections import defaultdict
 import os
-import pickle
+import sys
 import time
+import hashlib
+import sqlite3
 import imp
 
 from cerbero.config import CONFIG_DIR, Platform, Architecture, Distro,\
     DistroVersion, License
 from cerbero.build.build import BuildType
 from cerbero.build.source import SourceType
-from cerbero.errors import FatalError, RecipeNotFoundError, InvalidRecipeError
-from cerbero.utils import _, shell, parse_file
+from cerbero.build.statusstore import StatusStore
+from cerbero.build.recipeindex import RecipeIndex, RecipeMetadata
+from cerbero.errors import FatalError, RecipeNotFoundError, \
+    InvalidRecipeError, CerberoException
+from cerbero.utils import _, shell, parse_file, remove_list_duplicates
 from cerbero.utils import messages as m
 from cerbero.build import recipe as crecipe
 
@@ -54,43 +59,234 @@ class RecipeStatus (object):
     @type built_version: str
     @ivar file_hash: hash of the file with the recipe description
     @type file_hash: int
+    @ivar timings: history of the resources used by each step, with dicts
+                   containing the 'time' the step finished, the 'wall',
+                   'user' and 'sys' times in seconds and the peak 'maxrss'
+                   of its commands in KB
+    @type timings: dict
+    @ivar last_failure: time of the last build failure
+    @type last_failure: float
+    @ivar last_change: time of the last modification of the recipe file
+    @type last_change: float
+    @ivar fingerprint: hash of the last build, that changes when the recipe
+                       is built with a different version, recipe file or
+                       dependencies
+    @type fingerprint: str
+    @ivar deps_fingerprints: fingerprints of the direct dependencies used in
+                             the last build
+    @type deps_fingerprints: dict
     '''
 
+    # Number of runs kept in the timings history of each step
+    TIMINGS_HISTORY = 10
+    # Attributes kept when the status of a recipe is reset
+    HISTORY_ATTRS = ['timings', 'last_failure', 'last_change', 'fingerprint']
+
     def __init__(self, filepath, steps=[], needs_build=True,
-                 mtime=time.time(), built_version=None, file_hash=0):
+                 mtime=time.time(), built_version=None, file_hash=0,
+                 timings=None, last_failure=0, last_change=0,
+                 fingerprint=None, deps_fingerprints=None):
         self.steps = steps
         self.needs_build = needs_build
         self.mtime = mtime
         self.filepath = filepath
         self.built_version = built_version
         self.file_hash = file_hash
+        self.timings = timings or {}
+        self.last_failure = last_failure
+        self.last_change = last_change
+        self.fingerprint = fingerprint
+        self.deps_fingerprints = deps_fingerprints
 
     def touch(self):
         ''' Touches the recipe updating its modification time '''
         self.mtime = time.time()
 
+    def add_timing(self, step, timing):
+        ''' Adds the resources used by a step to its history '''
+        # timings was added afterwards
+        if not hasattr(self, 'timings'):
+            self.timings = {}
+        history = self.timings.setdefault(step, [])
+        history.append(timing)
+        del history[:-self.TIMINGS_HISTORY]
+
     def __repr__(self):
         return "Steps: %r Needs Build: %r" % (self.steps, self.needs_build)
 
 
+class _DepsGraph (object):
+    '''
+    Dependency graph of the recipes. The direct and reverse dependencies of
+    each recipe are computed once, as well as the transitive dependencies,
+    so that dependency cycles are found when the recipes are loaded.
+
+    @ivar deps: direct build dependencies of each recipe, including the
+                runtime dependencies common to all recipes
+    @type deps: dict
+    @ivar rdeps: direct reverse dependencies of each recipe
+    @type rdeps: dict
+    @ivar order: topological order of all the recipes
+    @type order: list
+    @ivar cycles: recipes that are part of a dependency cycle
+    @type cycles: set
+    @ivar runtime_deps: runtime dependencies common to all recipes
+    @type runtime_deps: set
+    '''
+
+    def __init__(self, metadata, invalid_recipes):
+        self._invalid_recipes = invalid_recipes
+        runtime_deps = [x.name for x in metadata.values() if x.runtime_dep]
+        self.runtime_deps = set(runtime_deps)
+        self.deps = {}
+        self.rdeps = defaultdict(list)
+        for name, recipe in metadata.iteritems():
+            deps = recipe.list_deps()
+            for dep in remove_list_duplicates(deps):
+                self.rdeps[dep].append(name)
+            if not recipe.runtime_dep:
+                deps = runtime_deps + deps
+            self.deps[name] = deps
+
+        # Transitive dependencies of each recipe in build order, or the
+        # error found resolving them
+        self._closures = {}
+        self._rclosures = {}
+        self.cycles = set()
+        self.order = []
+        for name in sorted(self.deps.keys()):
+            try:
+                self._merge(self.order, set(self.order),
+                            self._closure(name, []))
+            except CerberoException:
+                pass
+        self._position = dict([(x, i) for i, x in enumerate(self.order)])
+        for rdeps in self.rdeps.values():
+            rdeps.sort(key=self._sort_key)
+
+    def closure(self, name):
+        '''
+        Gets the transitive build dependencies of a recipe in build order,
+        ending with the recipe itself
+
+        @param name: name of the recipe
+        @type name: str
+        @return: list of recipes names
+        @rtype: list
+        '''
+        closure = self._closures[name]
+        if isinstance(closure, Exception):
+            raise closure
+        return closure[:]
+
+    def reverse_closure(self, name):
+        '''
+        Gets the recipes depending directly or indirectly on a recipe, in
+        build order
+
+        @param name: name of the recipe
+        @type name: str
+        @return: list of recipes names
+        @rtype: list
+        '''
+        if name not in self._rclosures:
+            self._rclosures[name] = self.reverse_closure_all([name])
+        return self._rclosures[name][:]
+
+    def reverse_closure_all(self, names):
+        '''
+        Gets the recipes depending directly or indirectly on any recipe of a
+        list, in build order, walking the graph only once
+
+        @param names: names of the recipes
+        @type names: list
+        @return: list of recipes names, not including the ones in names
+        @rtype: list
+        '''
+        found = set()
+        pending = []
+        for name in names:
+            pending.extend(self.rdeps.get(name, []))
+        while pending:
+            rdep = pending.pop()
+            if rdep not in found:
+                found.add(rdep)
+                pending.extend(self.rdeps.get(rdep, []))
+        found.difference_update(names)
+        return sorted(found, key=self._sort_key)
+
+    def _closure(self, name, path):
+        if name in self._closures:
+            return self.closure(name)
+        if name in path:
+            self.cycles.update(path[path.index(name):])
+            raise FatalError(_("Dependency Cycle"))
+        path.append(name)
+        try:
+            ordered = []
+            seen = set()
+            for dep in self.deps[name]:
+                if dep not in self.deps:
+                    if dep in self._invalid_recipes:
+                        raise self._invalid_recipes[dep]
+                    raise FatalError(_("Recipe %s has a unknown dependency %s"
+                                     % (name, dep)))
+                self._merge(ordered, seen, self._closure(dep, path))
+            ordered.append(name)
+        except CerberoException, ex:
+            self._closures[name] = ex
+            raise
+        finally:
+            path.pop()
+        self._closures[name] = ordered
+        return ordered[:]
+
+    def _merge(self, ordered, seen, names):
+        for x in names:
+            if x not in seen:
+                seen.add(x)
+                ordered.append(x)
+
+    def _sort_key(self, name):
+        # Recipes with errors go last
+        return self._position.get(name, len(self._position))
+
+
 class CookBook (object):
     '''
     Stores a list of recipes and their build status saving it's state to a
-    cache file
+    cache database
+
+    Recipes are only loaded when they are used, the list of recipes and
+    their dependencies are resolved with their
+    L{cerbero.build.recipeindex.RecipeMetadata}.
 
-    @ivar recipes: dictionary with L{cerbero.recipe.Recipe} availables
+    @ivar recipes: dictionary with the L{cerbero.recipe.Recipe} loaded
     @type recipes: dict
     @ivar status: dictionary with the L{cerbero.cookbook.RecipeStatus}
     @type status: dict
+    @ivar metadata_only: use the L{cerbero.build.recipeindex.RecipeMetadata}
+                         of the recipes instead of loading them, for the
+                         commands that only list recipes and dependencies
+    @type metadata_only: bool
     '''
 
     RECIPE_EXT = '.recipe'
+    # Failures and changes older than this are not considered recent
+    RECENT_PERIOD = 7 * 24 * 3600
 
-    def __init__(self, config, load=True):
+    def __init__(self, config, load=True, metadata_only=False):
         self.set_config(config)
+        self.metadata_only = metadata_only
         self.recipes = {}  # recipe_name -> recipe
+        self._metadata = {}  # recipe_name -> metadata
+        self._recipes_files = {}  # recipe_name -> (filepath, custom.py)
+        self._customs = {}  # custom.py -> module
+        self._mutable_attrs = {}  # recipe class -> [(attr, value)]
         self._invalid_recipes = {} # recipe -> error
+        self._graph = None
         self._mtimes = {}
+        self._store = None
 
         if not load:
             return
@@ -134,7 +330,6 @@ class CookBook (object):
         Reloads the recipes list and updates the cookbook
         '''
         self._load_recipes()
-        self.save()
 
     def get_recipes_list(self):
         '''
@@ -143,8 +338,12 @@ class CookBook (object):
         @return: list of recipes
         @rtype: list
         '''
-        recipes = self.recipes.values()
-        recipes.sort(key=lambda x: x.name)
+        recipes = []
+        for name in sorted(self._metadata.keys()):
+            try:
+                recipes.append(self.get_recipe(name))
+            except (RecipeNotFoundError, InvalidRecipeError):
+                pass
         return recipes
 
     def add_recipe(self, recipe):
@@ -155,6 +354,8 @@ class CookBook (object):
         @type  recipe: L{cerbero.build.cookbook.Recipe}
         '''
         self.recipes[recipe.name] = recipe
+        self._metadata[recipe.name] = recipe
+        self._graph = None
 
     def get_recipe(self, name):
         '''
@@ -163,13 +364,14 @@ class CookBook (object):
         @param name: name of the recipe
         @type name: str
         '''
-        if name in self._invalid_recipes:
-            raise self._invalid_recipes[name]
+        metadata = self._get_metadata(name)
+        if self.metadata_only:
+            return metadata
         if name not in self.recipes:
-            raise RecipeNotFoundError(name)
+            self._load_recipe(name)
         return self.recipes[name]
 
-    def update_step_status(self, recipe_name, step):
+    def update_step_status(self, recipe_name, step, timing=None):
         '''
         Updates the status of a recipe's step
 
@@ -177,12 +379,16 @@ class CookBook (object):
         @type recipe: str
         @param step: name of the step
         @type step: str
+        @param timing: resources used by the step
+        @type timing: dict
         '''
         status = self._recipe_status(recipe_name)
         status.steps.append(step)
+        if timing is not None:
+            status.add_timing(step, timing)
         status.touch()
         self.status[recipe_name] = status
-        self.save()
+        self._save_status(recipe_name)
 
     def update_build_status(self, recipe_name, built_version):
         '''
@@ -196,9 +402,90 @@ class CookBook (object):
         status = self._recipe_status(recipe_name)
         status.needs_build = built_version == None
         status.built_version = built_version
+        if built_version is not None:
+            deps = self._deps_fingerprints(recipe_name)
+            status.deps_fingerprints = deps
+            status.fingerprint = hashlib.sha1('%s\0%r\0%r' %
+                (built_version, getattr(status, 'file_hash', 0),
+                 sorted(deps.items()))).hexdigest()
         status.touch()
         self.status[recipe_name] = status
-        self.save()
+        self._save_status(recipe_name)
+
+    def update_install_manifest(self, recipe_name, manifest, replace=True):
+        '''
+        Records the files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param manifest: the installed files
+        @type manifest: L{cerbero.build.manifest.Manifest}
+        @param replace: replace the files recorded previously instead of
+                        adding them to the new ones
+        @type replace: bool
+        '''
+        try:
+            self._get_store().save_manifest(recipe_name, manifest, replace)
+        except (IOError, OSError, sqlite3.Error), ex:
+            m.warning(_("Could not save the files installed by %s: %s") %
+                      (recipe_name, ex))
+
+    def get_install_manifest(self, recipe_name, shared=True):
+        '''
+        Gets the files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param shared: include the files installed by other recipes too
+        @type shared: bool
+        @return: the installed files or None if they were not recorded
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        return self._get_store().load_manifest(recipe_name, shared)
+
+    def list_file_recipes(self, path):
+        '''
+        Lists the recipes that installed a file, using the recorded
+        manifests
+
+        @param path: path of the file relative to the prefix
+        @type path: str
+        @return: names of the recipes
+        @rtype: list
+        '''
+        return self._get_store().file_recipes(os.path.normpath(path))
+
+    def update_failure_status(self, recipe_name):
+        '''
+        Records a build failure of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        '''
+        status = self._recipe_status(recipe_name)
+        status.last_failure = time.time()
+        self.status[recipe_name] = status
+        self._save_status(recipe_name)
+
+    def recipe_recent_activity(self, recipe_name):
+        '''
+        Get the time of the last failure or change of a recipe if it
+        happened recently
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the time of the last failure or change or 0
+        @rtype: float
+        '''
+        if recipe_name not in self.status:
+            return 0
+        st = self.status[recipe_name]
+        # Use getattr as these were added later
+        last = max(getattr(st, 'last_failure', 0),
+                   getattr(st, 'last_change', 0))
+        if time.time() - last > self.RECENT_PERIOD:
+            return 0
+        return last
 
     def recipe_built_version (self, recipe_name):
         '''
@@ -212,6 +499,19 @@ class CookBook (object):
         except:
             return None
 
+    def recipe_timings(self, recipe_name):
+        '''
+        Get the history of the resources used by each step of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: dictionary with the list of timings of each step
+        @rtype: dict
+        '''
+        if recipe_name not in self.status:
+            return {}
+        return getattr(self.status[recipe_name], 'timings', {})
+
     def step_done(self, recipe_name, step):
         '''
         Whether is step is done or not
@@ -231,8 +531,14 @@ class CookBook (object):
         @type recipe_name: str
         '''
         if recipe_name in self.status:
+            # Keep the timings and failures history across rebuilds
+            old_status = self.status[recipe_name]
             del self.status[recipe_name]
-            self.save()
+            status = self._recipe_status(recipe_name)
+            for attr in RecipeStatus.HISTORY_ATTRS:
+                if hasattr(old_status, attr):
+                    setattr(status, attr, getattr(old_status, attr))
+            self._save_status(recipe_name)
 
     def recipe_needs_build(self, recipe_name):
         '''
@@ -243,7 +549,27 @@ class CookBook (object):
         @return: True if the recipe needs to be build
         @rtype: bool
         '''
-        return self._recipe_status(recipe_name).needs_build
+        return self._recipe_status(recipe_name).needs_build or \
+            len(self.recipe_deps_changed(recipe_name)) != 0
+
+    def recipe_deps_changed(self, recipe_name):
+        '''
+        List the direct dependencies that were built again since the last
+        build of a recipe, which needs to be rebuilt against them
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        # deps_fingerprints was added afterwards
+        built = getattr(self._recipe_status(recipe_name), 'deps_fingerprints',
+                        None)
+        if built is None:
+            return []
+        current = self._deps_fingerprints(recipe_name)
+        return sorted([d for d in set(built) | set(current)
+                       if built.get(d) != current.get(d)])
 
     def list_recipe_deps(self, recipe_name):
         '''
@@ -255,23 +581,112 @@ class CookBook (object):
         @return: list of L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return self._find_deps(recipe, {}, [])
+        self._get_metadata(recipe_name)
+        ordered = self._get_graph().closure(recipe_name)
+        return [self.get_recipe(x) for x in ordered]
 
-    def list_recipe_reverse_deps(self, recipe_name):
+    def list_recipe_build_deps(self, recipe_name):
+        '''
+        List the direct dependencies that must be built before a recipe,
+        including the runtime dependencies common to all recipes
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        self._get_metadata(recipe_name)
+        return self._get_graph().deps[recipe_name][:]
+
+    def list_recipe_reverse_deps(self, recipe_name, recursive=False):
         '''
         List the dependencies that depends on this recipe
 
         @param recipe_name: name of the recipe
         @type recipe_name: str
+        @param recursive: also list the recipes depending on it indirectly
+        @type recursive: bool
         @return: list of reverse dependencies L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return [r for r in self.recipes.values() if recipe.name in r.deps]
+        self._get_metadata(recipe_name)
+        graph = self._get_graph()
+        if recursive:
+            rdeps = graph.reverse_closure(recipe_name)
+        else:
+            rdeps = graph.rdeps.get(recipe_name, [])
+        return [self.get_recipe(x) for x in rdeps]
+
+    def list_recipes_reverse_deps(self, recipe_names):
+        '''
+        List the recipes that depend directly or indirectly on any recipe
+        of a list
+
+        @param recipe_names: names of the recipes
+        @type recipe_names: list
+        @return: list of reverse dependencies L{cerbero.recipe.Recipe}, not
+                 including the recipes of recipe_names
+        @rtype: list
+        '''
+        for name in recipe_names:
+            self._get_metadata(name)
+        rdeps = self._get_graph().reverse_closure_all(recipe_names)
+        return [self.get_recipe(x) for x in rdeps]
+
+    def list_recipe_build_rdeps(self, recipe_name):
+        '''
+        List the recipes that must be built after a recipe, because they
+        depend on it directly or indirectly, including through the runtime
+        dependencies common to all recipes
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        self._get_metadata(recipe_name)
+        graph = self._get_graph()
+        rdeps = graph.reverse_closure(recipe_name)
+        if graph.runtime_deps.intersection(rdeps + [recipe_name]):
+            rdeps = [x for x in graph.order if x != recipe_name]
+        return rdeps
+
+    def _get_graph(self):
+        if self._graph is None:
+            self._graph = _DepsGraph(self._metadata, self._invalid_recipes)
+            if self._graph.cycles:
+                m.warning(_("Dependency cycle between the recipes: %s") %
+                          ', '.join(sorted(self._graph.cycles)))
+        return self._graph
+
+    def _deps_fingerprints(self, recipe_name):
+        fingerprints = {}
+        for dep in self.list_recipe_build_deps(recipe_name):
+            if dep in self._metadata:
+                fingerprints[dep] = getattr(self.status.get(dep),
+                                            'fingerprint', None)
+        return fingerprints
+
+    def get_recipe_custom(self, recipe_name):
+        '''
+        Gets the custom.py module of the repository of a recipe, which the
+        recipe can import and subclass
 
-    def _runtime_deps (self):
-        return [x.name for x in self.recipes.values() if x.runtime_dep]
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: path of the custom.py file, which might not exist, or None
+                 for the recipes not loaded from a repository
+        @rtype: str
+        '''
+        self._get_metadata(recipe_name)
+        return self._recipes_files.get(recipe_name, (None, None))[1]
+
+    def _get_metadata(self, name):
+        if name in self._invalid_recipes:
+            raise self._invalid_recipes[name]
+        if name not in self._metadata:
+            raise RecipeNotFoundError(name)
+        return self._metadata[name]
 
     def _cache_file(self, config):
         if config.cache_file is not None:
@@ -279,46 +694,39 @@ class CookBook (object):
         else:
             return COOKBOOK_FILE
 
+    def _get_store(self):
+        if self._store is None:
+            config = self.get_config()
+            self._store = StatusStore(
+                    StatusStore.db_path(self._cache_file(config)))
+            # Import the status saved by older versions in a pickle file
+            self._store.import_pickle(self._cache_file(config))
+        return self._store
+
     def _restore_cache(self):
         try:
-            with open(self._cache_file(self.get_config()), 'rb') as f:
-                self.status = pickle.load(f)
+            self.status = self._get_store().load()
         except Exception:
             self.status = {}
             m.warning(_("Could not recover status"))
 
     def save(self):
+        '''
+        Saves the status of all the recipes
+        '''
         try:
-            cache_file = self._cache_file(self.get_config())
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
-            with open(cache_file, 'wb') as f:
-                pickle.dump(self.status, f)
-        except IOError, ex:
+            self._get_store().save_all(self.status)
+        except (IOError, OSError, sqlite3.Error), ex:
             m.warning(_("Could not cache the CookBook: %s") % ex)
 
-    def _find_deps(self, recipe, state={}, ordered=[]):
-        if state.get(recipe, 'clean') == 'processed':
-            return
-        if state.get(recipe, 'clean') == 'in-progress':
-            raise FatalError(_("Dependency Cycle"))
-        state[recipe] = 'in-progress'
-        recipe_deps = recipe.list_deps()
-        if not recipe.runtime_dep:
-            recipe_deps = self._runtime_deps () + recipe_deps
-        for recipe_name in recipe_deps:
-            try:
-                recipedep = self.get_recipe(recipe_name)
-            except RecipeNotFoundError, e:
-                raise FatalError(_("Recipe %s has a unknown dependency %s"
-                                 % (recipe.name, recipe_name)))
-            self._find_deps(recipedep, state, ordered)
-        state[recipe] = 'processed'
-        ordered.append(recipe)
-        return ordered
+    def _save_status(self, recipe_name):
+        try:
+            self._get_store().save(recipe_name, self.status.get(recipe_name))
+        except (IOError, OSError, sqlite3.Error), ex:
+            m.warning(_("Could not cache the CookBook: %s") % ex)
 
     def _recipe_status(self, recipe_name):
-        recipe = self.get_recipe(recipe_name)
+        recipe = self._get_metadata(recipe_name)
         if recipe_name not in self.status:
             filepath = None
             if hasattr(recipe, '__file__'):
@@ -329,24 +737,42 @@ class CookBook (object):
 
     def _load_recipes(self):
         self.recipes = {}
+        self._metadata = {}
+        self._recipes_files = {}
+        self._invalid_recipes.clear()
+        self._graph = None
         recipes = defaultdict(dict)
         recipes_repos = self._config.get_recipes_repos()
+        index = RecipeIndex(RecipeIndex.index_path(
+            self._cache_file(self._config)), self._config)
         for reponame, (repodir, priority) in recipes_repos.iteritems():
-            recipes[int(priority)].update(self._load_recipes_from_dir(repodir))
+            recipes[int(priority)].update(self._load_recipes_from_dir(repodir,
+                                                                      index))
+        index.save()
         # Add recipes by asceding pripority
         for key in sorted(recipes.keys()):
-            self.recipes.update(recipes[key])
+            for name, (metadata, recipe, files) in recipes[key].iteritems():
+                self._metadata[name] = metadata
+                self._recipes_files[name] = files
+                if recipe is not None:
+                    self.recipes[name] = recipe
+                elif name in self.recipes:
+                    del self.recipes[name]
+        if self.metadata_only:
+            self.recipes = self._metadata
+        self._get_graph()
 
         # Check for updates in the recipe file to reset the status
-        for recipe in self.recipes.values():
+        for recipe in self._metadata.values():
             if recipe.name not in self.status:
                 continue
             st = self.status[recipe.name]
             # filepath attribute was added afterwards
             if not hasattr(st, 'filepath') or not getattr(st, 'filepath'):
                 st.filepath = recipe.__file__
+                self._save_status(recipe.name)
             if recipe.__file__ != st.filepath:
-                self.reset_recipe_status(recipe.name)
+                self._recipe_changed(recipe.name)
             else:
                 rmtime = os.path.getmtime(recipe.__file__)
                 if rmtime > st.mtime:
@@ -357,33 +783,76 @@ class CookBook (object):
                     if saved_hash == current_hash:
                         # Update the status with the mtime
                         st.touch()
+                        self._save_status(recipe.name)
                     else:
-                        self.reset_recipe_status(recipe.name)
+                        self._recipe_changed(recipe.name)
+
+    def _recipe_changed(self, recipe_name):
+        self.reset_recipe_status(recipe_name)
+        self._recipe_status(recipe_name).last_change = time.time()
+        self._save_status(recipe_name)
 
-    def _load_recipes_from_dir(self, repo):
+    def _load_recipes_from_dir(self, repo, index):
+        # Returns a dictionary with the metadata of each recipe, the recipe if
+        # it had to be loaded and the files needed to load it
         recipes = {}
         recipes_files = shell.find_files('*%s' % self.RECIPE_EXT, repo)
         recipes_files.extend(shell.find_files('*/*%s' % self.RECIPE_EXT, repo))
-        try:
-            custom = None
-            m_path = os.path.join(repo, 'custom.py')
-            if os.path.exists(m_path):
-                custom = imp.load_source('custom', m_path)
-        except Exception:
-            custom = None
+        m_path = os.path.join(repo, 'custom.py')
+        custom_hash = None
+        if os.path.exists(m_path):
+            custom_hash = shell.file_hash(m_path)
         for f in recipes_files:
+            f = os.path.abspath(f)
+            metadata = index.get(f, custom_hash)
+            if metadata is not None:
+                if metadata.invalid is not None:
+                    self._invalid_recipes[metadata.name] = \
+                        InvalidRecipeError(metadata.name, metadata.invalid)
+                recipes[metadata.name] = (metadata, None, (f, m_path))
+                continue
             # Try to load the custom.py module located in the recipes dir
             # which can contain private classes to extend cerbero's recipes
             # and reuse them in our private repository
             try:
-                recipe = self._load_recipe_from_file(f, custom)
+                recipe = self._load_recipe_from_file(f,
+                                                     self._load_custom(m_path))
             except RecipeNotFoundError:
                 m.warning(_("Could not found a valid recipe in %s") % f)
             if recipe is None:
                 continue
-            recipes[recipe.name] = recipe
+            # An architecture of a universal recipe can be invalid
+            invalid = self._invalid_recipes.get(recipe.name)
+            if invalid is not None:
+                invalid = invalid.reason
+            metadata = RecipeMetadata(recipe, invalid)
+            index.add(f, custom_hash, metadata)
+            recipes[recipe.name] = (metadata, recipe, (f, m_path))
         return recipes
 
+    def _load_custom(self, path):
+        if path not in self._customs:
+            custom = None
+            try:
+                if os.path.exists(path):
+                    # Use a new module for each repository
+                    sys.modules.pop('custom', None)
+                    custom = imp.load_source('custom', path)
+            except Exception:
+                pass
+            self._customs[path] = custom
+        return self._customs[path]
+
+    def _load_recipe(self, name):
+        filepath, custom = self._recipes_files[name]
+        recipe = self._load_recipe_from_file(filepath,
+                                             self._load_custom(custom))
+        if name in self._invalid_recipes:
+            raise self._invalid_recipes[name]
+        if recipe is None or recipe.name != name:
+            raise RecipeNotFoundError(name)
+        self.recipes[name] = recipe
+
     def _load_recipe_from_file(self, filepath, custom=None):
         mod_name, file_ext = os.path.splitext(os.path.split(filepath)[-1])
         if self._config.target_arch == Architecture.UNIVERSAL:
@@ -391,25 +860,32 @@ class CookBook (object):
                 recipe = crecipe.UniversalFlatRecipe(self._config)
             else:
                 recipe = crecipe.UniversalRecipe(self._config)
+        # The recipe file is executed only once, even if a recipe is created
+        # for each architecture
+        try:
+            d = {'Platform': Platform, 'Architecture': Architecture,
+                 'BuildType': BuildType, 'SourceType': SourceType,
+                 'Distro': Distro, 'DistroVersion': DistroVersion,
+                 'License': License, 'recipe': crecipe, 'os': os,
+                 'BuildSteps': crecipe.BuildSteps,
+                 'InvalidRecipeError': InvalidRecipeError,
+                 'FatalError': FatalError,
+                 'custom': custom, '_': _, 'shell': shell}
+            parse_file(filepath, d)
+        except Exception, ex:
+            m.warning("Error loading recipe in file %s %s" %
+                      (filepath, ex))
+            return None
         for c in self._config.arch_config.keys():
             try:
-                d = {'Platform': Platform, 'Architecture': Architecture,
-                     'BuildType': BuildType, 'SourceType': SourceType,
-                     'Distro': Distro, 'DistroVersion': DistroVersion,
-                     'License': License, 'recipe': crecipe, 'os': os,
-                     'BuildSteps': crecipe.BuildSteps,
-                     'InvalidRecipeError': InvalidRecipeError,
-                     'FatalError': FatalError,
-                     'custom': custom, '_': _, 'shell': shell}
-                parse_file(filepath, d)
                 conf = self._config.arch_config[c]
                 if self._config.target_arch == Architecture.UNIVERSAL:
                     if self._config.target_platform not in [Platform.IOS,
                             Platform.DARWIN]:
                         conf.prefix = os.path.join(self._config.prefix, c)
-                r = d['Recipe'](conf)
+                r = self._new_recipe(d['Recipe'], conf,
+                                     len(self._config.arch_config) > 1)
                 r.__file__ = os.path.abspath(filepath)
-                self._config.arch_config[c].do_setup_env()
                 r.prepare()
                 if self._config.target_arch == Architecture.UNIVERSAL:
                     recipe.add_recipe(r)
@@ -424,3 +900,35 @@ class CookBook (object):
             if not recipe.is_empty():
                 return recipe
         return None
+
+    def _new_recipe(self, klass, config, isolate):
+        if not isolate:
+            return klass(config)
+        # Recipes modify lists and dicts of their class, like the deps or
+        # the files, in __init__() and prepare(). Give each instance its
+        # own copy so that the recipes of each architecture can share the
+        # same class.
+        if klass not in self._mutable_attrs:
+            attrs = {}
+            for base in reversed(klass.__mro__):
+                attrs.update(base.__dict__)
+            self._mutable_attrs[klass] = [(n, v) for n, v in
+                attrs.iteritems() if not n.startswith('__') and
+                isinstance(v, (list, dict, set))]
+        r = klass.__new__(klass)
+        for name, value in self._mutable_attrs[klass]:
+            setattr(r, name, _copy_container(value))
+        r.__init__(config)
+        return r
+
+
+def _copy_container(value):
+    # Faster than copy.deepcopy() for the lists and dicts of strings used
+    # in the recipes
+    if isinstance(value, list):
+        return [_copy_container(x) for x in value]
+    if isinstance(value, dict):
+        return dict([(k, _copy_container(v)) for k, v in value.iteritems()])
+    if isinstance(value, set):
+        return set(value)
+    return value
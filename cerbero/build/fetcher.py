@@ -0,0 +1,209 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import re
+import threading
+import urlparse
+
+from cerbero.build.recipe import BuildSteps
+from cerbero.utils import shell
+
+
+class FetchState(object):
+    '''
+    Enumeration of the states of a background fetch
+    '''
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CLAIMED = 'claimed'
+
+
+class BackgroundFetcher(object):
+    '''
+    Fetches the sources of a list of recipes in background threads, in the
+    same order they are going to be built, so that downloads overlap with
+    the build of the previous recipes.
+
+    Recipes are claimed before running their fetch step: the ones not
+    fetched yet are removed from the queue and must be fetched by the
+    caller, which also takes care of fetches that failed in the background.
+
+    @ivar jobs: number of fetches running at the same time
+    @type jobs: int
+    @ivar host_jobs: number of fetches from the same host running at the
+                     same time, or None for no limit
+    @type host_jobs: int
+    @ivar versions: built version of each recipe fetched in the background,
+                    computed right after fetching it when requested
+    @type versions: dict
+    '''
+
+    def __init__(self, recipes, jobs=2, host_jobs=None, versions=False):
+        self.jobs = jobs
+        self.host_jobs = host_jobs
+        self.versions = {}
+        self._compute_versions = versions
+        self._order = [r.name for r in recipes]
+        self._recipes = dict([(r.name, r) for r in recipes])
+        self._hosts = dict([(r.name, recipe_host(r)) for r in recipes])
+        self._states = dict([(n, FetchState.PENDING) for n in self._order])
+        self._running = {}
+        # Number of fetches started and finished
+        self._started = 0
+        self._finished = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        '''
+        Starts the fetcher threads
+        '''
+        for i in range(min(self.jobs, len(self._order))):
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        '''
+        Cancels the pending fetches and waits for the running ones
+        '''
+        with self._cond:
+            for name, state in self._states.iteritems():
+                if state == FetchState.PENDING:
+                    self._states[name] = FetchState.CLAIMED
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def activity(self):
+        '''
+        Gets the number of fetches started and finished so far, to find out
+        if some fetch ran between two calls
+
+        @return: the number of fetches started and finished
+        @rtype: tuple
+        '''
+        with self._cond:
+            return (self._started, self._finished)
+
+    def claim(self, recipe_name):
+        '''
+        Claims a recipe, removing it from the queue if it wasn't fetched yet
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the fetch state after claiming it
+        @rtype: L{cerbero.build.fetcher.FetchState}
+        '''
+        with self._cond:
+            state = self._states.get(recipe_name, FetchState.CLAIMED)
+            if state == FetchState.PENDING:
+                state = self._states[recipe_name] = FetchState.CLAIMED
+            return state
+
+    def wait(self, recipe_name):
+        '''
+        Claims a recipe and waits for its background fetch to finish
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: True if the sources were fetched in the background
+        @rtype: bool
+        '''
+        with self._cond:
+            while self.claim(recipe_name) == FetchState.RUNNING:
+                # Use a timeout to keep it interruptible
+                self._cond.wait(1)
+            return self._states.get(recipe_name) == FetchState.DONE
+
+    def _next(self):
+        with self._cond:
+            while True:
+                pending = False
+                for name in self._order:
+                    if self._states[name] != FetchState.PENDING:
+                        continue
+                    pending = True
+                    host = self._hosts[name]
+                    if self.host_jobs is not None and host is not None and \
+                            self._running.get(host, 0) >= self.host_jobs:
+                        continue
+                    self._states[name] = FetchState.RUNNING
+                    self._running[host] = self._running.get(host, 0) + 1
+                    self._started += 1
+                    return self._recipes[name]
+                if not pending:
+                    return None
+                # Wait for a fetch from a busy host to finish
+                self._cond.wait(1)
+
+    def _run(self):
+        while True:
+            recipe = self._next()
+            if recipe is None:
+                return
+            state = FetchState.DONE
+            try:
+                shell.set_logfile_output("%s/%s-%s.log" %
+                        (recipe.config.logs, recipe, BuildSteps.FETCH[1]))
+                try:
+                    recipe.fetch()
+                    if self._compute_versions:
+                        version = recipe.built_version()
+                finally:
+                    shell.close_logfile_output()
+            except Exception:
+                # The fetch step will be retried by the oven, reporting the
+                # error if it fails again
+                state = FetchState.FAILED
+            with self._cond:
+                if state == FetchState.DONE and self._compute_versions:
+                    self.versions[recipe.name] = version
+                self._states[recipe.name] = state
+                host = self._hosts[recipe.name]
+                self._running[host] -= 1
+                self._finished += 1
+                self._cond.notify_all()
+
+
+def recipe_host(recipe):
+    '''
+    Gets the host the sources of a recipe are fetched from
+
+    @param recipe: the recipe
+    @type recipe: L{cerbero.build.recipe.Recipe}
+    @return: the host name, or None if it's not fetched from a remote host
+    @rtype: str
+    '''
+    url = getattr(recipe, 'url', None)
+    if url is None:
+        remotes = getattr(recipe, 'remotes', None) or {}
+        url = remotes.get('origin')
+    if not url:
+        return None
+    host = urlparse.urlparse(url).hostname
+    if host is None:
+        # scp-like syntax of git: [user@]host:path
+        match = re.match(r'^(?:[^@/]+@)?([^:/]+):', url)
+        if match is not None:
+            host = match.group(1)
+    return host
@@ -18,10 +18,27 @@
 
 import os
 import re
-import inspect
 
 from cerbero.config import Platform
-from cerbero.utils import shell
+from cerbero.build import prefixindex
+
+
+def _files_attrs(obj, names):
+    '''
+    Gets the attributes listing files of each category, as tuples with the
+    attribute name and whether it's a dict of files per platform
+    '''
+    categories = {}
+    for name in names:
+        if name.startswith('files_'):
+            cat, platform = name[len('files_'):], False
+        elif name.startswith('platform_files_'):
+            cat, platform = name[len('platform_files_'):], True
+        else:
+            continue
+        if isinstance(getattr(obj, name, None), (list, dict)):
+            categories.setdefault(cat, []).append((name, platform))
+    return categories
 
 
 class FilesProvider(object):
@@ -61,6 +78,9 @@ class FilesProvider(object):
                              self.LANG_CAT: self._search_langfiles,
                              self.TYPELIB_CAT: self._search_typelibfiles,
                              'default': self._search_files}
+        # Files found in the prefix, until files are installed in it
+        self._files_cache = {}
+        self._files_cache_generation = None
 
     def devel_files_list(self):
         '''
@@ -69,8 +89,9 @@ class FilesProvider(object):
         .la and .so from the 'libs' category
         '''
         devfiles = self.files_list_by_category(self.DEVEL_CAT)
-        devfiles.extend(self._search_girfiles())
-        devfiles.extend(self._search_devel_libraries())
+        devfiles.extend(self._cached(('girs',), self._search_girfiles))
+        devfiles.extend(self._cached(('devel_libraries',),
+                                     self._search_devel_libraries))
 
         return sorted(list(set(devfiles)))
 
@@ -117,36 +138,79 @@ class FilesProvider(object):
 
     def _files_categories(self):
         ''' Get the list of categories available '''
-        categories = []
-        for name, value in inspect.getmembers(self):
-            if (isinstance(value, list) or isinstance(value, dict)):
-                if name.startswith('files_'):
-                    categories.append(name.split('files_')[1])
-                if name.startswith('platform_files_'):
-                    categories.append(name.split('platform_files_')[1])
-        return sorted(list(set(categories)))
+        categories = set(self._class_files_attrs()[0])
+        categories.update(self._instance_files_attrs())
+        return sorted(list(categories))
 
     def _get_category_files_list(self, category):
         '''
         Get the raw list of files in a category, without pattern match nor
         extensions replacement, which should be done in the search function
         '''
+        attrs = list(self._class_files_attrs()[1].get(category, []))
+        for cat, cat_attrs in self._instance_files_attrs().iteritems():
+            if cat == category or cat.endswith('_' + category):
+                attrs.extend(cat_attrs)
         files = []
-        for attr in dir(self):
-            if attr.startswith('files_') and attr.endswith('_' + category):
-                files.extend(getattr(self, attr))
-            if attr.startswith('platform_files_') and \
-                    attr.endswith('_' + category):
+        for attr, platform in sorted(attrs):
+            if platform:
                 files.extend(getattr(self, attr).get(self.platform, []))
+            else:
+                files.extend(getattr(self, attr))
         return files
 
+    def _class_files_attrs(self):
+        '''
+        Gets the attributes listing files of the class, computed only once
+        for each class. The attributes of a category are the ones named
+        after it and after the categories ending with _$category.
+
+        @return: attributes of each category, attributes of each category
+                 suffix and names of all the attributes
+        @rtype: tuple
+        '''
+        klass = type(self)
+        if '_files_attrs' not in klass.__dict__:
+            categories = _files_attrs(klass, dir(klass))
+            by_suffix = {}
+            names = set()
+            for cat, attrs in categories.iteritems():
+                parts = cat.split('_')
+                for i in range(len(parts)):
+                    by_suffix.setdefault('_'.join(parts[i:]), []).extend(attrs)
+                names.update([x[0] for x in attrs])
+            klass._files_attrs = (categories, by_suffix, names)
+        return klass._files_attrs
+
+    def _instance_files_attrs(self):
+        # Attributes added by the recipe, for instance in prepare()
+        names = self._class_files_attrs()[2]
+        return _files_attrs(self, [x for x in self.__dict__ if
+                                   x not in names])
+
     def _list_files_by_category(self, category):
         search_category = category
         if category.startswith(self.LIBS_CAT + '_'):
             search_category = self.LIBS_CAT
         search = self._searchfuncs.get(search_category,
                                        self._searchfuncs['default'])
-        return search(self._get_category_files_list(category))
+        return self._cached(('category', category),
+                lambda: search(self._get_category_files_list(category)))
+
+    def _cached(self, key, func):
+        '''
+        Gets the files found by a search function, which are searched only
+        once until new files are installed in the prefix
+        '''
+        generation = prefixindex.generation()
+        if self._files_cache_generation != generation:
+            self._files_cache = {}
+            self._files_cache_generation = generation
+        # The prefix is changed temporarily to merge universal recipes
+        key = key + (self.config.prefix,)
+        if key not in self._files_cache:
+            self._files_cache[key] = func()
+        return self._files_cache[key][:]
 
     def _search_files(self, files):
         '''
@@ -167,7 +231,7 @@ class FilesProvider(object):
         if len(paths) != 0:
             for path in paths:
                 fs.remove(path)
-            fs.extend(shell.ls_files(paths, self.config.prefix))
+            fs.extend(self._ls_files(paths))
         return fs
 
     def _search_binaries(self, files):
@@ -209,7 +273,7 @@ class FilesProvider(object):
             self.extensions['file'] = f
             libsmatch.append(pattern % self.extensions)
 
-        return shell.ls_files(libsmatch, self.config.prefix) + dlls
+        return self._ls_files(libsmatch) + dlls
 
     def _pyfile_get_name(self, f):
         if os.path.exists(os.path.join(self.config.prefix, f)):
@@ -267,8 +331,7 @@ class FilesProvider(object):
         Search for translations in share/locale/*/LC_MESSAGES/ '
         '''
         pattern = 'share/locale/*/LC_MESSAGES/%s.mo'
-        return shell.ls_files([pattern % x for x in files],
-                              self.config.prefix)
+        return self._ls_files([pattern % x for x in files])
 
     def _search_typelibfiles(self, files):
         '''
@@ -278,14 +341,12 @@ class FilesProvider(object):
             return []
 
         pattern = 'lib/girepository-1.0/%s.typelib'
-        typelibs = shell.ls_files([pattern % x for x in files],
-                                  self.config.prefix)
+        typelibs = self._ls_files([pattern % x for x in files])
         if not typelibs:
             # Add the architecture for universal builds
             pattern = 'lib/%s/girepository-1.0/%%s.typelib' % \
                 self.config.target_arch
-            typelibs = shell.ls_files([pattern % x for x in files],
-                                      self.config.prefix)
+            typelibs = self._ls_files([pattern % x for x in files])
         return typelibs
 
     def _search_girfiles(self):
@@ -304,14 +365,12 @@ class FilesProvider(object):
 
         # Use a * for the arch in universal builds
         pattern = 'share/gir-1.0/%s.gir'
-        files = shell.ls_files([pattern % x for x in girs],
-                              self.config.prefix)
+        files = self._ls_files([pattern % x for x in girs])
         if not girs:
             # Add the architecture for universal builds
             pattern = 'share/gir-1.0/%s/%%s.gir' % \
                 self.config.target_arch
-            files = shell.ls_files([pattern % x for x in girs],
-                                      self.config.prefix)
+            files = self._ls_files([pattern % x for x in girs])
         return files
 
     def _search_devel_libraries(self):
@@ -333,9 +392,12 @@ class FilesProvider(object):
 
             libsmatch = [pattern % {'f': x, 'fnolib': x[3:]} for x in
                          self._get_category_files_list(category)]
-            devel_libs.extend(shell.ls_files(libsmatch, self.config.prefix))
+            devel_libs.extend(self._ls_files(libsmatch))
         return devel_libs
 
+    def _ls_files(self, patterns):
+        return prefixindex.get_index(self.config.prefix).ls_files(patterns)
+
     def _ls_dir(self, dirpath):
         files = []
         for root, dirnames, filenames in os.walk(dirpath):
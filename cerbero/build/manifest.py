@@ -0,0 +1,262 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import errno
+import shutil
+import hashlib
+
+from cerbero.errors import FatalError
+from cerbero.utils import _
+
+
+class Manifest(object):
+    '''
+    List of the files installed by a recipe with their sizes and hashes
+
+    @ivar files: (size, sha256, link) for each path relative to the prefix,
+                 symbolic links have a None size and hash and the target of
+                 the link
+    @type files: dict
+    @ivar exact: whether the files were recorded exactly, staging the
+                 install, instead of comparing snapshots of the prefix,
+                 which can include files installed by other recipes
+    @type exact: bool
+    '''
+
+    def __init__(self, files=None, exact=True):
+        self.files = files or {}
+        self.exact = exact
+
+    @staticmethod
+    def from_dir(root, files=None):
+        '''
+        Creates the manifest of files in a directory
+
+        @param root: the directory
+        @type root: str
+        @param files: files relative to the directory, or None to use all
+                      the files it contains. Missing files are skipped.
+        @type files: list
+        @return: the manifest
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        if files is None:
+            files = list_tree(root)
+        manifest = Manifest()
+        for f in files:
+            manifest.add(root, f)
+        return manifest
+
+    def add(self, root, path):
+        '''
+        Adds a file to the manifest
+
+        @param root: directory containing the file
+        @type root: str
+        @param path: path of the file relative to root
+        @type path: str
+        '''
+        filepath = os.path.join(root, path)
+        if os.path.islink(filepath):
+            self.files[path] = (None, None, os.readlink(filepath))
+        elif os.path.isfile(filepath):
+            self.files[path] = (os.path.getsize(filepath),
+                                _sha256(filepath), None)
+
+    def update(self, manifest):
+        '''
+        Adds the files of another manifest, replacing the ones they share
+
+        @param manifest: the other manifest
+        @type manifest: L{cerbero.build.manifest.Manifest}
+        '''
+        self.files.update(manifest.files)
+        self.exact = self.exact and manifest.exact
+
+    def prefixed(self, path):
+        '''
+        Gets a copy of the manifest with its files moved to a subdirectory
+
+        @param path: the subdirectory
+        @type path: str
+        @return: the new manifest
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        return Manifest(dict([(os.path.join(path, k), v) for k, v in
+                              self.files.iteritems()]), self.exact)
+
+    def files_list(self):
+        '''
+        Gets the sorted list of files
+
+        @return: files relative to the prefix
+        @rtype: list
+        '''
+        return sorted(self.files.keys())
+
+    def __len__(self):
+        return len(self.files)
+
+
+def list_tree(root):
+    '''
+    Lists the files and symbolic links of a directory recursively
+
+    @param root: the directory
+    @type root: str
+    @return: paths relative to the directory
+    @rtype: list
+    '''
+    return snapshot(root).keys()
+
+
+def snapshot(root, ignore=()):
+    '''
+    Takes a snapshot of the files of a directory to find out later which of
+    them were installed or modified with L{changed_files}
+
+    @param root: the directory
+    @type root: str
+    @param ignore: names of the subdirectories of the root to skip
+    @type ignore: list
+    @return: the snapshot
+    @rtype: dict
+    '''
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        if reldir == '.':
+            reldir = ''
+            dirnames[:] = [x for x in dirnames if x not in ignore]
+        # os.walk doesn't follow the links to directories
+        for name in filenames + [x for x in dirnames if
+                                 os.path.islink(os.path.join(dirpath, x))]:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            files[os.path.join(reldir, name)] = (st.st_mtime, st.st_ctime,
+                                                 st.st_size, st.st_ino)
+    return files
+
+
+def changed_files(root, before, ignore=()):
+    '''
+    Lists the files installed or modified in a directory since a snapshot
+    was taken. Unlike comparing the modification times with a stamp file,
+    it doesn't need to wait for the resolution of the file system.
+
+    @param root: the directory
+    @type root: str
+    @param before: snapshot returned by L{snapshot}
+    @type before: dict
+    @param ignore: names of the subdirectories of the root to skip
+    @type ignore: list
+    @return: paths relative to the directory
+    @rtype: list
+    '''
+    return [k for k, v in snapshot(root, ignore).iteritems() if
+            before.get(k) != v]
+
+
+def merge_tree(src, dest, files):
+    '''
+    Moves files from a directory to another one, replacing each existing
+    file atomically
+
+    @param src: source directory
+    @type src: str
+    @param dest: destination directory
+    @type dest: str
+    @param files: paths relative to the source directory
+    @type files: list
+    '''
+    for f in sorted(files):
+        srcpath = os.path.join(src, f)
+        destpath = os.path.join(dest, f)
+        dirname = os.path.dirname(destpath)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.path.isdir(destpath) and not os.path.islink(destpath):
+            raise FatalError(_("Can't install %s, %s is a directory") %
+                             (srcpath, destpath))
+        try:
+            os.rename(srcpath, destpath)
+        except OSError, ex:
+            if ex.errno != errno.EXDEV:
+                raise
+            # Copy it next to the destination and rename it there
+            tmp = destpath + '.cerbero-tmp'
+            if os.path.islink(srcpath):
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                os.symlink(os.readlink(srcpath), tmp)
+            else:
+                shutil.copy2(srcpath, tmp)
+            os.rename(tmp, destpath)
+            os.remove(srcpath)
+
+
+def remove_files(root, manifest):
+    '''
+    Removes the files of a manifest from a directory and the directories
+    left empty. The files that were modified since they were installed are
+    kept, and manifests that were not recorded exactly are refused, since
+    they can list the files of other recipes.
+
+    @param root: the directory
+    @type root: str
+    @param manifest: the files to remove
+    @type manifest: L{cerbero.build.manifest.Manifest}
+    @return: the files kept because they were modified
+    @rtype: list
+    '''
+    if not manifest.exact:
+        raise FatalError(_("Refusing to remove files that were not recorded "
+                           "exactly"))
+    modified = []
+    dirs = set()
+    for path, entry in manifest.files.iteritems():
+        if not os.path.lexists(os.path.join(root, path)):
+            continue
+        if Manifest.from_dir(root, [path]).files.get(path) != entry:
+            modified.append(path)
+            continue
+        os.remove(os.path.join(root, path))
+        dirs.add(os.path.dirname(path))
+    for d in sorted(dirs, reverse=True):
+        while d:
+            try:
+                os.rmdir(os.path.join(root, d))
+            except OSError:
+                # Not empty
+                break
+            d = os.path.dirname(d)
+    return sorted(modified)
+
+
+def _sha256(filepath):
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
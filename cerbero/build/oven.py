@@ -16,13 +16,26 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
-import tempfile
+import os
+import time
 import shutil
 import traceback
+import multiprocessing
+import Queue
+from collections import OrderedDict
+try:
+    import resource
+except ImportError:
+    resource = None
 
+from cerbero.config import Architecture, Platform
 from cerbero.errors import BuildStepError, FatalError, AbortedError
 from cerbero.build.recipe import Recipe, BuildSteps
-from cerbero.utils import _, N_, shell
+from cerbero.build.fetcher import BackgroundFetcher, FetchState
+from cerbero.build.binarycache import BinaryCache
+from cerbero.build.manifest import Manifest, remove_files
+from cerbero.build import prefixindex
+from cerbero.utils import _, N_, shell, jobserver, rusage
 from cerbero.utils import messages as m
 
 
@@ -43,6 +56,71 @@ class RecoveryActions(object):
                 RecoveryActions.ABORT]
 
 
+def _resource_usage():
+    '''
+    Gets the wall clock time and the user and system CPU times used by this
+    process, without the commands it ran
+    '''
+    if resource is None:
+        return (time.time(), None, None)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return (time.time(), own.ru_utime, own.ru_stime)
+
+
+def _step_timing(start, children, own_cpu=True):
+    '''
+    Gets the resources used by a step since it started
+
+    @param start: resource usage of this process when the step started
+    @type start: tuple
+    @param children: resources used by the commands run by the step, as
+                     recorded by L{cerbero.utils.rusage}
+    @type children: dict
+    @param own_cpu: whether the CPU times of this process can be charged to
+                    the step, which is not the case when background fetches
+                    ran in the same process during the step
+    @type own_cpu: bool
+    '''
+    end = _resource_usage()
+    timing = {'time': end[0], 'wall': end[0] - start[0], 'user': None,
+              'sys': None, 'maxrss': None}
+    if children is not None:
+        timing['user'] = children['user']
+        timing['sys'] = children['sys']
+        timing['maxrss'] = children['maxrss']
+        if own_cpu and start[1] is not None:
+            timing['user'] += end[1] - start[1]
+            timing['sys'] += end[2] - start[2]
+    return timing
+
+
+class _WorkerCookBook(object):
+    '''
+    Wraps the cookbook in the build workers. Queries are answered by the
+    cookbook copy inherited from the parent process and status updates are
+    sent back to the parent, which is the only one saving the cookbook.
+    '''
+
+    def __init__(self, cookbook, queue):
+        self._cookbook = cookbook
+        self._queue = queue
+
+    def update_step_status(self, recipe_name, step, timing=None):
+        self._queue.put(('step', recipe_name, step, timing))
+
+    def update_build_status(self, recipe_name, built_version):
+        self._queue.put(('built', recipe_name, built_version))
+
+    def reset_recipe_status(self, recipe_name):
+        self._queue.put(('reset', recipe_name))
+
+    def update_install_manifest(self, recipe_name, manifest, replace=True):
+        self._queue.put(('manifest', recipe_name, manifest, replace))
+
+    def __getattr__(self, name):
+        return getattr(self._cookbook, name)
+
+
 class Oven (object):
     '''
     This oven cooks recipes with all their ingredients
@@ -57,12 +135,26 @@ class Oven (object):
     @type: bool
     @ivar missing_files: check for files missing in the recipe
     @type missing_files: bool
+    @ivar jobs: number of recipes built at the same time
+    @type jobs: int
+    @ivar fetch_jobs: number of recipes fetched in the background
+    @type fetch_jobs: int
+    @ivar keep_going: keep building the recipes that don't depend on a
+                      failed one
+    @type keep_going: bool
+    @ivar clean_install: remove the files installed by the previous build
+                         of a recipe before installing it again
+    @type clean_install: bool
     '''
 
     STEP_TPL = '[(%s/%s) %s -> %s ]'
+    # Steps installing files in the prefix
+    RECORDED_STEPS = [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1],
+                      BuildSteps.GEN_LIBFILES[1], BuildSteps.MERGE[1]]
 
     def __init__(self, recipes, cookbook, force=False, no_deps=False,
-                 missing_files=False, dry_run=False):
+                 missing_files=False, dry_run=False, jobs=1, fetch_jobs=2,
+                 keep_going=False, clean_install=False):
         if isinstance(recipes, Recipe):
             recipes = [recipes]
         self.recipes = recipes
@@ -72,6 +164,39 @@ class Oven (object):
         self.missing_files = missing_files
         self.config = cookbook.get_config()
         self.interactive = self.config.interactive
+        # Recipes are built in forked worker processes, which are not
+        # available on Windows
+        if not hasattr(os, 'fork'):
+            jobs = 1
+        # Looking for the files installed by a recipe, and moving the ones
+        # of each architecture in universal flat builds, compares snapshots
+        # of the prefix, which would include the files of other workers
+        if jobs > 1 and (missing_files or self._flat_universal()):
+            m.warning(_("Building the recipes one by one, the files they "
+                        "install can't be told apart in parallel"))
+            jobs = 1
+        self.jobs = max(jobs, 1)
+        self.fetch_jobs = fetch_jobs
+        if dry_run:
+            self.fetch_jobs = 0
+        self.keep_going = keep_going
+        self.clean_install = clean_install and not dry_run
+        self._fetcher = None
+        self._fetched = set()
+        # Failed recipes and the recipes blocked by each one of them
+        self._failed = OrderedDict()
+        self._blocked = OrderedDict()
+        self._binary_cache = None
+        if self.config.binary_cache and not dry_run:
+            self._binary_cache = BinaryCache(self.config.binary_cache,
+                    self.config.binary_cache_size * 1024 * 1024)
+        self._cache_keys = {}
+        # Record the files installed by the recipes, exactly when they are
+        # staged, and comparing the prefix to look for missing files
+        self._record_install = not dry_run
+        # Files installed by the previous build of the recipes built in the
+        # workers, which don't use the status database
+        self._previous_installs = {}
         shell.DRY_RUN = dry_run
 
     def start_cooking(self):
@@ -88,45 +213,342 @@ class Oven (object):
                 # remove recipes already scheduled to be built
                 recipes = [x for x in recipes if x not in ordered_recipes]
                 ordered_recipes.extend(recipes)
+            ordered_recipes = self._fail_fast_order(ordered_recipes)
         m.message(_("Building the following recipes: %s") %
                   ' '.join([x.name for x in ordered_recipes]))
 
+        if self.config.make_jobserver:
+            jobserver.start(self.config.jobserver_fifo,
+                            self.config.jobserver_slots)
+        self._start_fetcher(ordered_recipes)
+        try:
+            if self.jobs > 1:
+                self._cook_parallel(ordered_recipes)
+            else:
+                self._cook_serial(ordered_recipes)
+            if self._failed:
+                self._print_failures_summary()
+                # Report the first error
+                raise self._failed.values()[0]
+        finally:
+            if self._fetcher is not None:
+                self._fetcher.stop()
+                self._fetcher = None
+            jobserver.stop()
+            if self._binary_cache is not None:
+                self._binary_cache.evict()
+
+    def _fail_fast_order(self, ordered_recipes):
+        '''
+        Reorders the recipes so that the ones that failed or changed
+        recently are built first, together with the dependencies they need,
+        to find out as soon as possible if they still fail. The result is
+        still a valid build order with the same recipes.
+        '''
+        urgent = []
+        for recipe in ordered_recipes:
+            if not self.force and \
+                    not self.cookbook.recipe_needs_build(recipe.name):
+                continue
+            last = self.cookbook.recipe_recent_activity(recipe.name)
+            if last:
+                urgent.append((last, recipe.name))
+        if not urgent:
+            return ordered_recipes
+        # Most recent first
+        urgent.sort(key=lambda x: x[0], reverse=True)
+        m.message(_("Building first the recipes that failed or changed "
+                    "recently: %s") % ' '.join([x[1] for x in urgent]))
+
+        recipes = dict([(r.name, r) for r in ordered_recipes])
+        result = []
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for dep in self.cookbook.list_recipe_build_deps(name):
+                if dep in recipes:
+                    visit(dep)
+            result.append(recipes[name])
+
+        for last, name in urgent:
+            visit(name)
+        for recipe in ordered_recipes:
+            visit(recipe.name)
+        return result
+
+    def _start_fetcher(self, ordered_recipes):
+        '''
+        Starts fetching in the background the sources of the recipes that
+        will need to run the fetch step
+        '''
+        fetch = BuildSteps.FETCH
+        recipes = [r for r in ordered_recipes if fetch in r.steps and
+                   (self.force or (self.cookbook.recipe_needs_build(r.name)
+                    and not self.cookbook.step_done(r.name, fetch[1])
+                    and not self._in_binary_cache(r)))]
+        if self.fetch_jobs < 1 or not recipes:
+            return
+        self._fetcher = BackgroundFetcher(recipes, self.fetch_jobs)
+        self._fetcher.start()
+
+    def _fetch_activity(self):
+        if self._fetcher is None:
+            return None
+        return self._fetcher.activity()
+
+    def _claim_fetch(self, recipe_name, block):
+        '''
+        Claims the background fetch of a recipe before building it
+
+        @return: False if it's still being fetched and block is False
+        @rtype: bool
+        '''
+        if self._fetcher is None:
+            return True
+        if block:
+            fetched = self._fetcher.wait(recipe_name)
+        else:
+            state = self._fetcher.claim(recipe_name)
+            if state == FetchState.RUNNING:
+                return False
+            fetched = state == FetchState.DONE
+        if fetched:
+            self._fetched.add(recipe_name)
+        return True
+
+    def _cook_serial(self, ordered_recipes):
         i = 1
         for recipe in ordered_recipes:
+            deps = self.cookbook.list_recipe_build_deps(recipe.name)
+            if self._check_blocked(recipe.name, deps, i,
+                                   len(ordered_recipes)):
+                i += 1
+                continue
             try:
+                self._reset_if_deps_changed(recipe)
                 self._cook_recipe(recipe, i, len(ordered_recipes))
             except BuildStepError, be:
-                if not self.interactive:
-                    raise be
-                msg = be.msg
-                msg += _("Select an action to proceed:")
-                action = shell.prompt_multiple(msg, RecoveryActions())
-                if action == RecoveryActions.SHELL:
-                    shell.enter_build_environment(self.config.target_platform,
-                            self.config.target_arch, recipe.build_dir)
-                    break
-                elif action == RecoveryActions.RETRY_ALL:
-                    shutil.rmtree(recipe.build_dir)
-                    self.cookbook.reset_recipe_status(recipe.name)
-                    self._cook_recipe(recipe, i, len(ordered_recipes))
-                elif action == RecoveryActions.RETRY_STEP:
-                    self._cook_recipe(recipe, i, len(ordered_recipes))
-                elif action == RecoveryActions.SKIP:
-                    continue
-                elif action == RecoveryActions.ABORT:
-                    raise AbortedError()
+                if self.keep_going:
+                    self._recipe_failed(recipe, be)
+                else:
+                    action = self._recover(recipe, be, i,
+                                           len(ordered_recipes))
+                    if action == RecoveryActions.SHELL:
+                        break
+                    elif action == RecoveryActions.SKIP:
+                        continue
             i += 1
 
+    def _recover(self, recipe, be, count, total):
+        '''
+        Asks the user how to proceed after a failed build step, re-raising
+        the error in non-interactive mode
+
+        @return: the action selected by the user
+        @rtype: L{cerbero.build.oven.RecoveryActions}
+        '''
+        self.cookbook.update_failure_status(recipe.name)
+        if not self.interactive:
+            raise be
+        msg = be.msg
+        msg += _("Select an action to proceed:")
+        action = shell.prompt_multiple(msg, RecoveryActions())
+        if action == RecoveryActions.SHELL:
+            shell.enter_build_environment(self.config.target_platform,
+                    self.config.target_arch, recipe.build_dir)
+        elif action == RecoveryActions.RETRY_ALL:
+            shutil.rmtree(recipe.build_dir)
+            self.cookbook.reset_recipe_status(recipe.name)
+            self._cook_recipe(recipe, count, total)
+        elif action == RecoveryActions.RETRY_STEP:
+            self._cook_recipe(recipe, count, total)
+        elif action == RecoveryActions.ABORT:
+            raise AbortedError()
+        return action
+
+    def _cook_parallel(self, ordered_recipes):
+        '''
+        Cooks the recipes in up to L{jobs} worker processes, starting each
+        recipe as soon as all the dependencies it has in the build set are
+        built. Ready recipes are started following the order of the list.
+        '''
+        total = len(ordered_recipes)
+        names = [r.name for r in ordered_recipes]
+        pending = {}
+        for recipe in ordered_recipes:
+            deps = self.cookbook.list_recipe_build_deps(recipe.name)
+            pending[recipe.name] = set(deps) & set(names)
+        counts = dict([(n, i + 1) for i, n in enumerate(names)])
+        recipes = dict([(r.name, r) for r in ordered_recipes])
+        queue = multiprocessing.Queue()
+        running = {}
+        failed = []
+
+        try:
+            while pending or running:
+                if failed and self.keep_going:
+                    for name, step, msg in failed:
+                        be = BuildStepError(recipes[name], step)
+                        be.msg = msg
+                        self._recipe_failed(recipes[name], be)
+                    del failed[:]
+                    # Drop the recipes that can't be built anymore
+                    for name in names:
+                        if name in pending and self._check_blocked(name,
+                                pending[name], counts[name], total):
+                            del pending[name]
+                if not failed:
+                    ready = [n for n in names if n in pending and
+                             not pending[n]]
+                    for name in ready:
+                        if len(running) >= self.jobs:
+                            break
+                        # Only wait for background fetches with idle workers
+                        if not self._claim_fetch(name, not running):
+                            continue
+                        del pending[name]
+                        # Reset it here, the status of the workers is a
+                        # copy of the parent's one
+                        self._reset_if_deps_changed(recipes[name])
+                        running[name] = self._start_worker(recipes[name],
+                                counts[name], total, queue)
+                if not running:
+                    if failed:
+                        name, step, msg = failed.pop(0)
+                        be = BuildStepError(recipes[name], step)
+                        be.msg = msg
+                        action = self._recover(recipes[name], be,
+                                               counts[name], total)
+                        if action == RecoveryActions.SHELL:
+                            return
+                        self._recipe_cooked(name, pending)
+                        continue
+                    if pending:
+                        raise FatalError(_("Dependency Cycle"))
+                    break
+                self._process_worker_messages(queue, running, pending,
+                                              failed)
+        finally:
+            for process in running.values():
+                process.terminate()
+                process.join()
+
+    def _reset_if_deps_changed(self, recipe):
+        '''
+        Resets the status of a recipe when some of its dependencies were
+        rebuilt since it was built, so that it's built again against them
+        '''
+        changed = self.cookbook.recipe_deps_changed(recipe.name)
+        if changed:
+            m.message(_("%s will be rebuilt, these dependencies changed: %s")
+                      % (recipe.name, ' '.join(changed)))
+            self.cookbook.reset_recipe_status(recipe.name)
+
+    def _recipe_failed(self, recipe, be):
+        '''
+        Records a failed recipe in keep-going mode
+        '''
+        self.cookbook.update_failure_status(recipe.name)
+        m.error(be.msg)
+        self._failed[recipe.name] = be
+
+    def _check_blocked(self, recipe_name, deps, count, total):
+        '''
+        Checks if a recipe depends on a failed or blocked recipe, marking it
+        as blocked in that case
+
+        @return: whether the recipe is blocked
+        @rtype: bool
+        '''
+        for dep in deps:
+            failed = dep if dep in self._failed else self._blocked.get(dep)
+            if failed is not None:
+                self._blocked[recipe_name] = failed
+                m.build_step(count, total, recipe_name,
+                             _("blocked by %s") % failed)
+                return True
+        return False
+
+    def _print_failures_summary(self):
+        m.error(_("The following recipes failed to build:"))
+        for name, be in self._failed.iteritems():
+            m.error("  %s (%s)" % (name, be.step))
+        if self._blocked:
+            m.error(_("The following recipes were not built because they "
+                      "depend on a failed recipe:"))
+            for name, failed in self._blocked.iteritems():
+                m.error("  %s (%s)" % (name, failed))
+
+    def _start_worker(self, recipe, count, total, queue):
+        if self.clean_install:
+            self._previous_installs[recipe.name] = \
+                self.cookbook.get_install_manifest(recipe.name, shared=False)
+        process = multiprocessing.Process(target=self._worker,
+                args=(recipe, count, total, queue))
+        process.start()
+        return process
+
+    def _worker(self, recipe, count, total, queue):
+        self.cookbook = _WorkerCookBook(self.cookbook, queue)
+        # The fetcher threads only live in the parent process
+        self._fetcher = None
+        try:
+            self._cook_recipe(recipe, count, total)
+        except BuildStepError, be:
+            queue.put(('failed', recipe.name, be.step, be.msg))
+        except Exception:
+            queue.put(('failed', recipe.name, None, traceback.format_exc()))
+        else:
+            queue.put(('done', recipe.name))
+
+    def _process_worker_messages(self, queue, running, pending, failed):
+        try:
+            msg = queue.get(timeout=1)
+        except Queue.Empty:
+            # Check for workers that died without reporting their status
+            for name, process in running.items():
+                if not process.is_alive():
+                    process.join()
+                    del running[name]
+                    failed.append((name, None,
+                        _("Worker building '%s' died unexpectedly") % name))
+            return
+
+        action, name = msg[0], msg[1]
+        # The worker might have installed files in the prefix
+        prefixindex.invalidate()
+        if action == 'step':
+            self.cookbook.update_step_status(name, msg[2], msg[3])
+        elif action == 'built':
+            self.cookbook.update_build_status(name, msg[2])
+        elif action == 'reset':
+            self.cookbook.reset_recipe_status(name)
+        elif action == 'manifest':
+            self.cookbook.update_install_manifest(name, msg[2], msg[3])
+        elif action in ['done', 'failed']:
+            running.pop(name).join()
+            if action == 'done':
+                self._recipe_cooked(name, pending)
+            else:
+                failed.append((name, msg[2], msg[3]))
+
+    def _recipe_cooked(self, name, pending):
+        self._invalidate_cache_key(name)
+        for deps in pending.values():
+            deps.discard(name)
+
     def _cook_recipe(self, recipe, count, total):
         if not self.cookbook.recipe_needs_build(recipe.name) and \
                 not self.force:
             m.build_step(count, total, recipe.name, _("already built"))
             return
+        if not self.force and self._restore_from_cache(recipe, count, total):
+            return
 
-        if self.missing_files:
-            # create a temp file that will be used to find newer files
-            tmp = tempfile.NamedTemporaryFile()
-
+        installed = Manifest()
         recipe.force = self.force
         for desc, step in recipe.steps:
             m.build_step(count, total, recipe.name, step)
@@ -134,15 +556,37 @@ class Oven (object):
             if self.cookbook.step_done(recipe.name, step) and not self.force:
                 m.action(_("Step done"))
                 continue
+            if step == BuildSteps.FETCH[1] and self._prefetched(recipe):
+                m.action(_("Fetched in the background"))
+                self.cookbook.update_step_status(recipe.name, step)
+                continue
             try:
                 # call step function
                 stepfunc = getattr(recipe, step)
                 if not stepfunc:
                     raise FatalError(_('Step %s not found') % step)
+                if step == BuildSteps.INSTALL[1] and self.clean_install:
+                    self._remove_previous_install(recipe)
                 shell.set_logfile_output("%s/%s-%s.log" % (recipe.config.logs, recipe, step))
-                stepfunc()
+                fetches = self._fetch_activity()
+                start = _resource_usage()
+                rusage.start_recording()
+                try:
+                    if self._record_install and \
+                            step in self.RECORDED_STEPS:
+                        installed.update(self._run_recorded_step(recipe,
+                                                                 step))
+                    else:
+                        stepfunc()
+                finally:
+                    children = rusage.stop_recording()
+                    prefixindex.invalidate()
+                # The background fetches would be charged to this step
+                own_cpu = fetches is None or (fetches[0] == fetches[1] and
+                        self._fetch_activity()[0] == fetches[0])
                 # update status successfully
-                self.cookbook.update_step_status(recipe.name, step)
+                self.cookbook.update_step_status(recipe.name, step,
+                        _step_timing(start, children, own_cpu))
                 shell.close_logfile_output()
             except FatalError:
                 shell.close_logfile_output(dump=True)
@@ -151,10 +595,127 @@ class Oven (object):
                 shell.close_logfile_output(dump=True)
                 raise BuildStepError(recipe, step, traceback.format_exc())
         self.cookbook.update_build_status(recipe.name, recipe.built_version())
+        self._store_in_cache(recipe)
 
         if self.missing_files:
-            self._print_missing_files(recipe, tmp)
-            tmp.close()
+            self._print_missing_files(recipe, installed.files_list())
+
+    def _remove_previous_install(self, recipe):
+        '''
+        Removes the files installed by the previous build of a recipe that
+        were not installed by other recipes too
+        '''
+        if recipe.name in self._previous_installs:
+            manifest = self._previous_installs[recipe.name]
+        else:
+            manifest = self.cookbook.get_install_manifest(recipe.name,
+                                                          shared=False)
+        # Only once, the binary cache restore might fall back to a build
+        self._previous_installs[recipe.name] = None
+        if not manifest:
+            return
+        if not manifest.exact:
+            m.warning(_("The files installed previously by %s were not "
+                        "recorded exactly, they will not be removed") %
+                      recipe.name)
+            return
+        m.action(_("Removing the files installed previously"))
+        modified = remove_files(self.config.prefix, manifest)
+        prefixindex.invalidate()
+        if modified:
+            m.warning(_("These files were modified after being installed "
+                        "and were not removed: %s") % ' '.join(modified))
+
+    def _run_recorded_step(self, recipe, step):
+        manifest = recipe.run_recorded_step(step,
+                snapshot=self.missing_files)
+        if manifest.exact:
+            self.cookbook.update_install_manifest(recipe.name, manifest,
+                    replace=step == BuildSteps.INSTALL[1])
+        elif step == BuildSteps.INSTALL[1]:
+            # The files recorded for the previous build are stale now
+            self.cookbook.update_install_manifest(recipe.name, Manifest())
+        return manifest
+
+    def _flat_universal(self):
+        return self.config.target_arch == Architecture.UNIVERSAL and \
+            self.config.target_platform in [Platform.IOS, Platform.DARWIN]
+
+    def _cache_key(self, recipe_name):
+        '''
+        Gets the key of a recipe in the binary cache, which is None when the
+        recipe or one of its dependencies can't be identified, for instance
+        when the git repository of the sources has not been fetched yet
+        '''
+        if recipe_name not in self._cache_keys:
+            key = None
+            try:
+                recipe = self.cookbook.get_recipe(recipe_name)
+                deps = [self._cache_key(x) for x in
+                        self.cookbook.list_recipe_build_deps(recipe_name)]
+                if None not in deps:
+                    key = self._binary_cache.recipe_key(recipe, self.config,
+                            deps, self.cookbook.get_recipe_custom(recipe_name))
+            except (FatalError, IOError, OSError):
+                pass
+            self._cache_keys[recipe_name] = key
+        return self._cache_keys[recipe_name]
+
+    def _invalidate_cache_key(self, recipe_name):
+        # The keys of the recipe and the ones depending on it can change
+        # after building it, eg: with a new git commit
+        self._cache_keys.pop(recipe_name, None)
+        if not self._cache_keys:
+            return
+        for name in self.cookbook.list_recipe_build_rdeps(recipe_name):
+            self._cache_keys.pop(name, None)
+
+    def _in_binary_cache(self, recipe):
+        if self._binary_cache is None:
+            return False
+        key = self._cache_key(recipe.name)
+        return key is not None and self._binary_cache.lookup(key)
+
+    def _restore_from_cache(self, recipe, count, total):
+        if not self._in_binary_cache(recipe):
+            return False
+        m.build_step(count, total, recipe.name,
+                     _("restoring from the binary cache"))
+        if self.clean_install:
+            self._remove_previous_install(recipe)
+        restored = self._binary_cache.restore(self._cache_key(recipe.name),
+                                              self.config.prefix)
+        prefixindex.invalidate()
+        if restored is None:
+            return False
+        if self._record_install:
+            self.cookbook.update_install_manifest(recipe.name,
+                    Manifest.from_dir(self.config.prefix, restored))
+        for desc, step in recipe.steps:
+            self.cookbook.update_step_status(recipe.name, step)
+        self.cookbook.update_build_status(recipe.name, recipe.built_version())
+        return True
+
+    def _store_in_cache(self, recipe):
+        if self._binary_cache is None:
+            return
+        self._invalidate_cache_key(recipe.name)
+        key = self._cache_key(recipe.name)
+        if key is None:
+            return
+        prefix = self.config.prefix
+        files = [f for f in recipe.files_list() if
+                 os.path.lexists(os.path.join(prefix, f))]
+        # Recipes that don't list their files can't be restored
+        if files:
+            self._binary_cache.store(key, prefix, files)
+
+    def _prefetched(self, recipe):
+        if recipe.name in self._fetched:
+            self._fetched.discard(recipe.name)
+            return True
+        return self._fetcher is not None and \
+            self._fetcher.wait(recipe.name)
 
     def _handle_build_step_error(self, recipe, step):
         if step in [BuildSteps.FETCH, BuildSteps.EXTRACT]:
@@ -164,10 +725,9 @@ class Oven (object):
             self.cookbook.reset_recipe_status(recipe.name)
         raise BuildStepError(recipe, step)
 
-    def _print_missing_files(self, recipe, tmp):
+    def _print_missing_files(self, recipe, installed_files):
         recipe_files = set(recipe.files_list())
-        installed_files = set(shell.find_newer_files(recipe.config.prefix,
-                                                     tmp.name))
+        installed_files = set(installed_files)
         not_in_recipe = list(installed_files - recipe_files)
         not_installed = list(recipe_files - installed_files)
 
@@ -0,0 +1,154 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import glob
+import time
+import fnmatch
+
+
+_indexes = {}
+# Bumped each time files might have been installed in a prefix
+_generation = 0
+
+
+def get_index(prefix):
+    '''
+    Gets the index of a prefix, shared by all the users of the prefix
+
+    @param prefix: path of the prefix
+    @type prefix: str
+    @return: the index
+    @rtype: L{cerbero.build.prefixindex.PrefixIndex}
+    '''
+    prefix = os.path.normpath(prefix)
+    if prefix not in _indexes:
+        _indexes[prefix] = PrefixIndex(prefix)
+    return _indexes[prefix]
+
+
+def invalidate():
+    '''
+    Marks the contents of all the indexes as outdated, to be called after
+    installing or removing files in a prefix. Only the directories that
+    were modified will be listed again.
+    '''
+    global _generation
+    _generation += 1
+
+
+def generation():
+    '''
+    Gets the current generation of the prefixes contents, which changes
+    each time they are invalidated
+
+    @return: the generation
+    @rtype: int
+    '''
+    return _generation
+
+
+class PrefixIndex(object):
+    '''
+    Lists the files of a prefix matching shell patterns without running any
+    command. The directories are listed when they are first used and their
+    contents are kept until they are modified.
+
+    @ivar prefix: path of the prefix
+    @type prefix: str
+    '''
+
+    # Directories modified this close to the moment they were listed could
+    # be modified again without changing their mtime
+    MTIME_SLACK = 2
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        # relative dir -> [{name: is_dir}, mtime, listing time, generation]
+        self._dirs = {}
+
+    def ls_files(self, patterns):
+        '''
+        Lists the files matching a list of patterns, like running
+        'ls patterns' from the prefix
+
+        @param patterns: shell patterns relative to the prefix, several
+                         patterns can be separated with spaces
+        @type patterns: list
+        @return: list of files relative to the prefix
+        @rtype: list
+        '''
+        files = set()
+        for pattern in patterns:
+            for p in pattern.split():
+                files.update(self._match(p))
+        return list(files)
+
+    def _match(self, pattern):
+        parts = [x for x in pattern.split('/') if x not in ['', '.']]
+        if not parts:
+            return []
+        paths = ['']
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            matches = []
+            for path in paths:
+                entries = self._entries(path)
+                if entries is None:
+                    continue
+                if glob.has_magic(part):
+                    names = fnmatch.filter(entries.keys(), part)
+                    # Like the shell, don't match hidden files with *
+                    if not part.startswith('.'):
+                        names = [x for x in names if not x.startswith('.')]
+                elif part in entries:
+                    names = [part]
+                else:
+                    continue
+                for name in names:
+                    # Only the last component is a file, directories are
+                    # not listed like 'ls' does
+                    if entries[name] != last:
+                        matches.append(path and '%s/%s' % (path, name) or
+                                       name)
+            paths = matches
+        return paths
+
+    def _entries(self, path):
+        entry = self._dirs.get(path)
+        if entry is not None and entry[3] == _generation:
+            return entry[0]
+        dirpath = os.path.join(self.prefix, path)
+        try:
+            mtime = os.stat(dirpath).st_mtime
+        except OSError:
+            self._dirs.pop(path, None)
+            return None
+        if entry is not None and entry[1] == mtime and \
+                entry[2] - mtime > self.MTIME_SLACK:
+            entry[3] = _generation
+            return entry[0]
+        try:
+            names = os.listdir(dirpath)
+        except OSError:
+            self._dirs.pop(path, None)
+            return None
+        entries = dict([(x, os.path.isdir(os.path.join(dirpath, x)))
+                        for x in names])
+        self._dirs[path] = [entries, mtime, time.time(), _generation]
+        return entries
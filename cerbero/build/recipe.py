@@ -20,16 +20,15 @@ import os
 import logging
 import shutil
 import tempfile
-import time
 
-from cerbero.build import build, source
+from cerbero.build import build, source, manifest
 from cerbero.build.filesprovider import FilesProvider
+from cerbero.build.manifest import Manifest
 from cerbero.config import Platform
 from cerbero.errors import FatalError
 from cerbero.ide.vs.genlib import GenLib
 from cerbero.tools.osxuniversalgenerator import OSXUniversalGenerator
-from cerbero.utils import N_, _
-from cerbero.utils import shell
+from cerbero.utils import N_, _, shell
 from cerbero.utils import messages as m
 
 
@@ -246,6 +245,51 @@ class Recipe(FilesProvider):
         '''
         return os.path.abspath(os.path.join(self.recipe_dir(), path))
 
+    def run_recorded_step(self, step, dest=None, ignore=(), snapshot=False):
+        '''
+        Runs a step that installs files in the prefix, recording the files
+        it installs. Unless the 'staged_install' option is disabled, the
+        install step of the build systems supporting it installs the files
+        in a staging directory with DESTDIR and they are merged later in the
+        prefix, which records them exactly. Otherwise, they are only
+        recorded if requested, comparing the prefix before and after running
+        the step, which also finds the files installed at the same time by
+        other processes.
+
+        @param step: name of the step
+        @type step: str
+        @param dest: directory where the files are moved, instead of
+                     leaving them in the prefix, which requires comparing
+                     the prefix
+        @type dest: str
+        @param ignore: subdirectories of the prefix that are not recorded
+        @type ignore: list
+        @param snapshot: compare the prefix if the files can't be staged
+        @type snapshot: bool
+        @return: the installed files, relative to dest
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        prefix = self.config.prefix
+        if dest is None:
+            dest = prefix
+        if step == BuildSteps.INSTALL[1] and self.config.staged_install \
+                and self._can_stage_install():
+            return self._staged_install(dest)
+        if step == BuildSteps.POST_INSTALL[1] and \
+                type(self).post_install.im_func is Recipe.post_install.im_func:
+            return Manifest()
+        if dest == prefix and not snapshot:
+            getattr(self, step)()
+            return Manifest(exact=False)
+        before = manifest.snapshot(prefix, ignore)
+        getattr(self, step)()
+        files = manifest.changed_files(prefix, before, ignore)
+        if dest != prefix:
+            manifest.merge_tree(prefix, dest, files)
+        result = Manifest.from_dir(dest, files)
+        result.exact = False
+        return result
+
     @property
     def steps(self):
         return self._steps
@@ -253,6 +297,54 @@ class Recipe(FilesProvider):
     def _remove_steps(self, steps):
         self._steps = [x for x in self._steps if x not in steps]
 
+    def _can_stage_install(self):
+        if not getattr(self, 'supports_destdir', False):
+            return False
+        # DESTDIR can't be prepended to paths with a drive letter
+        if self.config.platform == Platform.WINDOWS:
+            return False
+        # Recipes installing files themselves or with their own install
+        # command might not honour DESTDIR
+        if type(self).install.im_func is not self.btype.install.im_func:
+            return False
+        return getattr(self, 'make_install', None) == \
+            getattr(self.btype, 'make_install', None)
+
+    def _staged_install(self, dest):
+        prefix = self.config.prefix
+        # Next to the prefix to move the files without copying them
+        staging = tempfile.mkdtemp(prefix='.%s-staging-' % self.name,
+                                   dir=os.path.dirname(prefix))
+        try:
+            self.destdir = staging
+            try:
+                self.install()
+            finally:
+                self.destdir = None
+            root = os.path.join(staging,
+                                os.path.splitdrive(prefix)[1].lstrip(os.sep))
+            files = []
+            outside = []
+            for f in manifest.list_tree(staging):
+                path = os.path.join(staging, f)
+                if path.startswith(root + os.sep):
+                    files.append(os.path.relpath(path, root))
+                else:
+                    outside.append(f)
+            if outside:
+                m.warning(_("%s installed files outside of the prefix: %s") %
+                          (self.name, ' '.join(sorted(outside))))
+                manifest.merge_tree(staging, os.sep, outside)
+            if not files:
+                m.warning(_("%s did not install any file in the staging "
+                            "directory, its install command might not "
+                            "support DESTDIR") % self.name)
+            result = Manifest.from_dir(root, files)
+            manifest.merge_tree(root, dest, files)
+            return result
+        finally:
+            shutil.rmtree(staging)
+
 
 class MetaUniversalRecipe(type):
     '''
@@ -320,6 +412,35 @@ class UniversalRecipe(object):
             for o in self._recipes.values():
                 setattr(o, name, value)
 
+    def run_recorded_step(self, step, snapshot=False):
+        '''
+        Runs a step that installs files for each architecture, recording
+        the files it installs
+
+        @param step: name of the step
+        @type step: str
+        @param snapshot: compare the prefix if the files can't be staged
+        @type snapshot: bool
+        @return: the installed files
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        result = Manifest()
+        for arch, recipe in self._recipes.iteritems():
+            result.update(self._run_arch(arch, recipe.run_recorded_step,
+                                         step, None, (), snapshot))
+        return result
+
+    def _run_arch(self, arch, func, *args):
+        '''
+        Runs a function of the recipe of an architecture with the commands
+        using the environment of the architecture
+        '''
+        shell.set_call_env(self._config.arch_config[arch].get_build_env())
+        try:
+            return func(*args)
+        finally:
+            shell.set_call_env(None)
+
     def _do_step(self, step):
         if step in BuildSteps.FETCH:
             # No, really, let's not download a million times...
@@ -328,12 +449,10 @@ class UniversalRecipe(object):
             return
 
         for arch, recipe in self._recipes.iteritems():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
             stepfunc = getattr(recipe, step)
 
             # Call the step function
-            stepfunc()
+            self._run_arch(arch, stepfunc)
 
 
 class UniversalFlatRecipe(UniversalRecipe):
@@ -375,61 +494,24 @@ class UniversalFlatRecipe(UniversalRecipe):
             generator = OSXUniversalGenerator(output)
             generator.merge_files(ainputs,
                     [os.path.join(self._config.prefix, arch)])
-
-    def _do_step(self, step):
-        if step in BuildSteps.FETCH:
-            # No, really, let's not download a million times...
-            stepfunc = getattr(self._recipes.values()[0], step)
-            stepfunc()
-            return
-
-        # For the universal build we need to configure both architectures with
-        # with the same final prefix, but we want to install each architecture
-        # on a different path (eg: /path/to/prefix/x86).
-
-        archs_prefix = self._recipes.keys()
-
+        return reduce(lambda x, y: x | y, arch_inputs.values())
+
+    def run_recorded_step(self, step, snapshot=False):
+        if step == BuildSteps.MERGE[1]:
+            return Manifest.from_dir(self._config.prefix, self.merge())
+        # For the universal build we need to configure both architectures
+        # with the same final prefix, but we want to install each
+        # architecture on a different path (eg: /path/to/prefix/x86).
+        ignore = self._recipes.keys() + ['Libraries']
+        result = Manifest()
         for arch, recipe in self._recipes.iteritems():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
-            stepfunc = getattr(recipe, step)
-
-            # Create a stamp file to list installed files based on the
-            # modification time of this file
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                time.sleep(2) #wait 2 seconds to make sure new files get the
-                              #proper time difference, this fixes an issue of
-                              #the next recipe to be built listing the previous
-                              #recipe files as their own
-                tmp = tempfile.NamedTemporaryFile()
-                # the modification time resolution depends on the filesystem,
-                # where FAT32 has a resolution of 2 seconds and ext4 1 second
-                t = time.time() - 2
-                os.utime(tmp.name, (t, t))
-
-            # Call the step function
-            stepfunc()
+            dest = os.path.join(self._config.prefix, arch)
+            result.update(self._run_arch(arch, recipe.run_recorded_step,
+                                         step, dest, ignore).prefixed(arch))
+        return result
 
-            # Move installed files to the architecture prefix
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                installed_files = shell.find_newer_files(self._config.prefix,
-                                                         tmp.name, True)
-                tmp.close()
-                for f in installed_files:
-
-                    def not_in_prefix(src):
-                        for p in archs_prefix + ['Libraries']:
-                            if src.startswith(p):
-                                return True
-                        return False
-
-                    # skip files that are installed in the arch prefix
-                    if not_in_prefix(f):
-                        continue
-                    src = os.path.join(self._config.prefix, f)
-
-                    dest = os.path.join(self._config.prefix,
-                                        recipe.config.target_arch, f)
-                    if not os.path.exists(os.path.dirname(dest)):
-                        os.makedirs(os.path.dirname(dest))
-                    shutil.move(src, dest)
+    def _do_step(self, step):
+        if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
+            self.run_recorded_step(step)
+        else:
+            UniversalRecipe._do_step(self, step)
@@ -0,0 +1,203 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import pickle
+import tempfile
+
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+# Bump it when the metadata stored in the index changes
+INDEX_VERSION = 2
+
+
+class RecipeMetadata(object):
+    '''
+    Lightweight description of a recipe, with the attributes needed to list
+    the recipes and resolve their dependencies without loading the recipe
+    file
+
+    @ivar name: name of the recipe
+    @type name: str
+    @ivar version: version of the recipe
+    @type version: str
+    @ivar deps: dependencies of the recipe
+    @type deps: list
+    @ivar platform_deps: platform conditional dependencies
+    @type platform_deps: dict
+    @ivar runtime_dep: runtime dep common to all recipes
+    @type runtime_dep: bool
+    @ivar stype: name of the source type
+    @type stype: str
+    @ivar btype: name of the build type
+    @type btype: str
+    @ivar categories: files categories of the recipe
+    @type categories: list
+    @ivar invalid: reason why the recipe is invalid for one of the
+                   architectures of a universal build, or None
+    @type invalid: str
+    '''
+
+    def __init__(self, recipe, invalid=None):
+        self.name = recipe.name
+        self.version = recipe.version
+        self.deps = list(recipe.deps)
+        self.platform_deps = dict(recipe.platform_deps)
+        self.runtime_dep = recipe.runtime_dep
+        self.stype = recipe.stype.__name__
+        self.btype = recipe.btype.__name__
+        self.categories = list(recipe._files_categories())
+        self.__file__ = recipe.__file__
+        self.invalid = invalid
+        self._deps = recipe.list_deps()
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "<RecipeMetadata %s>" % self.name
+
+    def list_deps(self):
+        '''
+        List all dependencies including conditional dependencies, as
+        computed for the configuration used to create the index
+        '''
+        return self._deps[:]
+
+
+class RecipeIndex(object):
+    '''
+    Persistent index with the L{RecipeMetadata} of the recipes files, so
+    that they don't need to be executed again while the recipe file, the
+    repository's custom.py and the configuration remain the same
+
+    @ivar path: path of the index file
+    @type path: str
+    '''
+
+    EXT = '.index'
+
+    def __init__(self, path, config):
+        self.path = path
+        self._config_key = self._get_config_key(config)
+        self._changed = False
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self._entries = pickle.load(f)
+            except Exception, ex:
+                m.warning(_("Could not load the recipes index %s: %s") %
+                          (path, ex))
+
+    @staticmethod
+    def index_path(cache_file):
+        '''
+        Gets the path of the index for a cache file
+
+        @param cache_file: path of the cache file
+        @type cache_file: str
+        @return: path of the index
+        @rtype: str
+        '''
+        return cache_file + RecipeIndex.EXT
+
+    def get(self, filepath, custom_hash):
+        '''
+        Gets the metadata of a recipe file if it's still valid
+
+        @param filepath: path of the recipe file
+        @type filepath: str
+        @param custom_hash: hash of the custom.py of the repository
+        @type custom_hash: str
+        @return: the metadata or None
+        @rtype: L{cerbero.build.recipeindex.RecipeMetadata}
+        '''
+        entry = self._entries.get(filepath)
+        if entry is None or entry['config'] != self._config_key or \
+                entry['custom'] != custom_hash:
+            return None
+        stat = self._stat(filepath)
+        if entry['stat'] != stat:
+            # Only hash the file when it looks modified
+            if entry['hash'] != shell.file_hash(filepath):
+                return None
+            entry['stat'] = stat
+            self._changed = True
+        return entry['metadata']
+
+    def add(self, filepath, custom_hash, metadata):
+        '''
+        Adds the metadata of a recipe file to the index
+
+        @param filepath: path of the recipe file
+        @type filepath: str
+        @param custom_hash: hash of the custom.py of the repository
+        @type custom_hash: str
+        @param metadata: metadata of the recipe
+        @type metadata: L{cerbero.build.recipeindex.RecipeMetadata}
+        '''
+        self._entries[filepath] = {'config': self._config_key,
+                                   'custom': custom_hash,
+                                   'stat': self._stat(filepath),
+                                   'hash': shell.file_hash(filepath),
+                                   'metadata': metadata}
+        self._changed = True
+
+    def save(self):
+        '''
+        Saves the index if it was modified
+        '''
+        if not self._changed:
+            return
+        try:
+            dirname = os.path.dirname(self.path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            # Write it atomically, other instances could be reading it
+            fd, tmp = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self._entries, f, pickle.HIGHEST_PROTOCOL)
+            if os.name == 'nt' and os.path.exists(self.path):
+                # rename doesn't replace existing files on Windows
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+            self._changed = False
+        except (IOError, OSError), ex:
+            m.warning(_("Could not save the recipes index %s: %s") %
+                      (self.path, ex))
+
+    def _stat(self, filepath):
+        st = os.stat(filepath)
+        return (st.st_mtime, st.st_size)
+
+    def _get_config_key(self, config):
+        variants = sorted(config.variants.__dict__.items())
+        # The config files can set any property read by the recipes
+        files = set(config.config_files)
+        for c in config.arch_config.values():
+            files.update(c.config_files)
+        files_hashes = [(f, os.path.exists(f) and shell.file_hash(f))
+                        for f in sorted(files)]
+        return (INDEX_VERSION, config.platform, config.target_platform,
+                config.arch, config.target_arch, config.distro,
+                config.target_distro, config.distro_version,
+                config.target_distro_version, config.prefix,
+                sorted(config.arch_config.keys()), variants, files_hashes)
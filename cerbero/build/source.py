@@ -20,7 +20,9 @@ import os
 import shutil
 
 from cerbero.config import Platform
-from cerbero.utils import git, svn, shell, _
+from cerbero.build.sourcestore import SourceStore
+from cerbero.build.sourcetreecache import SourceTreeCache
+from cerbero.utils import git, svn, shell, downloader, _
 from cerbero.errors import FatalError, InvalidRecipeError
 import cerbero.utils.messages as m
 
@@ -76,11 +78,15 @@ class Tarball (Source):
 
     @cvar url: dowload URL for the tarball
     @type url: str
+    @cvar tarball_checksum: sha256 checksum of the tarball, verified after
+                            downloading it
+    @type tarball_checksum: str
     '''
 
     url = None
     tarball_name = None
     tarball_dirname = None
+    tarball_checksum = None
 
     def __init__(self):
         Source.__init__(self)
@@ -103,24 +109,40 @@ class Tarball (Source):
                  (self.url, self.download_path))
         if not os.path.exists(self.repo_dir):
             os.makedirs(self.repo_dir)
-        shell.download(self.url, self.download_path, check_cert=False)
+        store = SourceStore.from_config(self.config)
+        if store is not None:
+            store.fetch_tarball(self.url, self.download_path,
+                                self.tarball_checksum, check_cert=False)
+        else:
+            shell.download(self.url, self.download_path, check_cert=False,
+                           sha256=self.tarball_checksum)
 
     def extract(self):
         m.action(_('Extracting tarball to %s') % self.build_dir)
         if os.path.exists(self.build_dir):
             shutil.rmtree(self.build_dir)
-        shell.unpack(self.download_path, self.config.sources)
+        patches = [p if os.path.isabs(p) else self.relative_path(p) for p in
+                   self.patches]
+        cache = SourceTreeCache.from_config(self.config)
+        if cache is not None:
+            key = cache.tree_key(self.download_path, patches, self.strip,
+                                 self.tarball_checksum)
+            if cache.restore(key, self.build_dir):
+                m.action(_('Restored the patched sources from the cache'))
+                return
+        rename = None
         if self.tarball_dirname is not None:
-            os.rename(os.path.join(self.config.sources, self.tarball_dirname),
-                    self.build_dir)
+            rename = (self.tarball_dirname,
+                      os.path.relpath(self.build_dir, self.config.sources))
+        shell.unpack(self.download_path, self.config.sources, rename)
         git.init_directory(self.build_dir)
-        for patch in self.patches:
-            if not os.path.isabs(patch):
-                patch = self.relative_path(patch)
+        for patch in patches:
             if self.strip == 1:
                 git.apply_patch(patch, self.build_dir)
             else:
                 shell.apply_patch(patch, self.build_dir, self.strip)
+        if cache is not None:
+            cache.store(key, self.build_dir)
 
 
 class GitCache (Source):
@@ -145,8 +167,20 @@ class GitCache (Source):
             git.init(self.repo_dir)
         for remote, url in self.remotes.iteritems():
             git.add_remote(self.repo_dir, remote, url)
-        # fetch remote branches
-        git.fetch(self.repo_dir, fail=False)
+        store = SourceStore.from_config(self.config)
+        if store is not None:
+            # Fetch the remotes into their mirrors in the store and from
+            # there, sharing their objects
+            for remote, url in self.remotes.iteritems():
+                mirror = store.update_git_mirror(url)
+                git.add_alternate(self.repo_dir,
+                                  os.path.join(mirror, 'objects'))
+                git.fetch_url(self.repo_dir, mirror,
+                              '+refs/heads/*:refs/remotes/%s/*' % remote,
+                              fail=False)
+        else:
+            # fetch remote branches
+            git.fetch(self.repo_dir, fail=False)
         if checkout:
             commit = self.config.recipe_commit(self.name) or self.commit
             git.checkout(self.repo_dir, commit)
@@ -220,29 +254,35 @@ class Git (GitCache):
             # fix read-only permissions
             if self.config.platform == Platform.WINDOWS:
                 shell.call('chmod -R +w .git/', self.build_dir, fail=False)
-            try:
-                commit_hash = git.get_hash(self.repo_dir, self.commit)
-                checkout_hash = git.get_hash(self.build_dir, 'HEAD')
-                if commit_hash == checkout_hash and not self.patches:
-                    return False
-            except Exception:
-                pass
-            shutil.rmtree(self.build_dir)
-        if not os.path.exists(self.build_dir):
-            os.mkdir(self.build_dir)
-
-        # checkout the current version
-        git.local_checkout(self.build_dir, self.repo_dir, self.commit)
+        commit_hash = git.get_hash(self.repo_dir, self.commit).strip()
+        if not commit_hash:
+            raise FatalError(_("Commit %s not found in %s") %
+                             (self.commit, self.repo_dir))
+        patches = [p if os.path.isabs(p) else self.relative_path(p) for p in
+                   self.patches]
+        checkout_id = '\n'.join([commit_hash, str(self.strip)] +
+                                [downloader.file_sha256(p) for p in patches])
+        if git.get_checkout_id(self.build_dir) == checkout_id:
+            return False
 
-        for patch in self.patches:
-            if not os.path.isabs(patch):
-                patch = self.relative_path(patch)
+        # Update the checkout to the current version, rewriting only the
+        # files that changed so that the build is incremental
+        git.set_checkout_id(self.build_dir, None)
+        try:
+            git.local_update(self.build_dir, self.repo_dir, commit_hash)
+        except FatalError:
+            # Not a checkout that can be updated, start from scratch
+            if os.path.exists(self.build_dir):
+                shutil.rmtree(self.build_dir)
+            git.local_update(self.build_dir, self.repo_dir, commit_hash)
 
+        for patch in patches:
             if self.strip == 1:
                 git.apply_patch(patch, self.build_dir)
             else:
                 shell.apply_patch(patch, self.build_dir, self.strip)
 
+        git.set_checkout_id(self.build_dir, checkout_id)
         return True
 
 
@@ -0,0 +1,241 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import stat
+import errno
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cerbero.utils import git, downloader
+
+
+class SourceStore(object):
+    '''
+    Source store shared by all the configurations, even the ones using
+    different home directories, so that each tarball and git object is only
+    downloaded and stored once.
+
+    Tarballs are stored by their sha256 checksum and hard linked into the
+    repo_dir of the recipes. Git remotes are mirrored in bare repositories
+    keyed by their url, which the repositories of the recipes use as
+    alternates for their objects and fetch from locally.
+
+    @ivar path: directory of the store
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Gets the store of a configuration
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @return: the store, or None if it's not enabled
+        @rtype: L{cerbero.build.sourcestore.SourceStore}
+        '''
+        if not config.source_store:
+            return None
+        return SourceStore(config.source_store)
+
+    def tarball_path(self, sha256):
+        '''
+        Gets the path of a tarball in the store
+
+        @param sha256: checksum of the tarball
+        @type sha256: str
+        @return: path of the tarball
+        @rtype: str
+        '''
+        return os.path.join(self.path, 'tarballs', sha256[:2], sha256)
+
+    def download_path(self, url):
+        '''
+        Gets the path where a tarball is downloaded before it's added to
+        the store
+
+        @param url: url of the tarball
+        @type url: str
+        @return: path of the download
+        @rtype: str
+        '''
+        return os.path.join(self.path, 'downloads', _url_key(url),
+                            os.path.basename(url))
+
+    def lookup_tarball(self, url, sha256=None):
+        '''
+        Finds a tarball in the store
+
+        @param url: url of the tarball
+        @type url: str
+        @param sha256: checksum of the tarball, if known
+        @type sha256: str
+        @return: path of the tarball, or None if it's not in the store
+        @rtype: str
+        '''
+        if sha256 is None:
+            index = self._url_index(url)
+            if not os.path.exists(index):
+                return None
+            with open(index, 'r') as f:
+                sha256 = f.read().strip()
+        path = self.tarball_path(sha256)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def fetch_tarball(self, url, destination, sha256=None, check_cert=True):
+        '''
+        Downloads a tarball into the store, unless it's already there, and
+        links it to a destination
+
+        @param url: url of the tarball
+        @type url: str
+        @param destination: path where the tarball is linked
+        @type destination: str
+        @param sha256: expected checksum of the tarball
+        @type sha256: str
+        @param check_cert: verify the certificate of https servers
+        @type check_cert: bool
+        '''
+        path = self.lookup_tarball(url, sha256)
+        if path is None:
+            tmp = self.download_path(url)
+            with _locked(os.path.dirname(tmp)):
+                path = self.lookup_tarball(url, sha256)
+                if path is None:
+                    path = self._add_download(url, tmp, sha256, check_cert)
+        _link(path, destination)
+
+    def git_mirror(self, url):
+        '''
+        Gets the path of the mirror of a git remote in the store
+
+        @param url: url of the remote
+        @type url: str
+        @return: path of the bare repository
+        @rtype: str
+        '''
+        name = os.path.basename(url.rstrip('/'))
+        if not name.endswith('.git'):
+            name += '.git'
+        return os.path.join(self.path, 'git', '%s-%s' % (_url_key(url), name))
+
+    def update_git_mirror(self, url):
+        '''
+        Fetches the branches and tags of a git remote into its mirror
+
+        @param url: url of the remote
+        @type url: str
+        @return: path of the bare repository
+        @rtype: str
+        '''
+        mirror = self.git_mirror(url)
+        if not os.path.exists(os.path.dirname(mirror)):
+            os.makedirs(os.path.dirname(mirror))
+        with _locked(mirror):
+            if not os.path.exists(mirror):
+                git.init_mirror(mirror)
+            git.fetch_url(mirror, url, '+refs/heads/*:refs/heads/*',
+                          fail=False)
+        return mirror
+
+    def _add_download(self, url, tmp, sha256, check_cert):
+        downloader.download(url, tmp, sha256, check_cert)
+        if sha256 is None:
+            sha256 = downloader.file_sha256(tmp)
+        path = self.tarball_path(sha256)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Tarballs are shared through hard links, keep them read-only
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        if os.path.exists(path):
+            # Same contents downloaded from a different url
+            os.remove(tmp)
+        else:
+            os.rename(tmp, path)
+        index = self._url_index(url)
+        if not os.path.exists(os.path.dirname(index)):
+            os.makedirs(os.path.dirname(index))
+        with open(index + '.tmp', 'w') as f:
+            f.write(sha256)
+        os.rename(index + '.tmp', index)
+        return path
+
+    def _url_index(self, url):
+        return os.path.join(self.path, 'urls', _url_key(url))
+
+
+def _url_key(url):
+    return hashlib.sha256(url).hexdigest()[:16]
+
+
+def _link(path, destination):
+    '''
+    Hard links a file of the store, or copies it if the destination is in a
+    different file system
+    '''
+    if os.path.exists(destination):
+        if hasattr(os.path, 'samefile') and \
+                os.path.samefile(path, destination):
+            return
+        os.remove(destination)
+    dirname = os.path.dirname(destination)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    tmp = destination + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        if not hasattr(os, 'link'):
+            raise OSError(errno.EXDEV, 'Hard links are not supported')
+        os.link(path, tmp)
+    except OSError, ex:
+        if ex.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+            raise
+        shutil.copy(path, tmp)
+    os.rename(tmp, destination)
+
+
+@contextmanager
+def _locked(path):
+    '''
+    Serializes the updates of a path made from different processes
+    '''
+    if fcntl is None:
+        yield
+        return
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open('%s.lock' % path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,308 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+from cerbero.utils import _, downloader
+from cerbero.utils import messages as m
+
+
+# Bump it when the way the trees are extracted or patched changes
+CACHE_VERSION = 1
+
+_gnu_cp = None
+
+
+class SourceTreeCache(object):
+    '''
+    Cache of the source trees of the tarballs, extracted and patched, so
+    that extracting them again, for each architecture of a universal build
+    or when the build is retried, doesn't need to unpack them, initialize
+    their git repository and apply the patches.
+
+    The trees are stored under a key that hashes the tarball and its
+    patches. They are restored with copy-on-write clones of their files
+    where the file system supports them, since the build modifies the
+    sources in place, and with hard links for the git objects, which are
+    never modified. The least recently used trees are removed when the
+    cache grows over its maximum size.
+
+    @ivar path: directory of the cache
+    @type path: str
+    @ivar max_size: maximum size of the cache in bytes
+    @type max_size: int
+    '''
+
+    SIZE_EXT = '.size'
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def from_config(config):
+        '''
+        Gets the cache of a configuration
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @return: the cache, or None if it's not enabled
+        @rtype: L{cerbero.build.sourcetreecache.SourceTreeCache}
+        '''
+        if not config.source_tree_cache:
+            return None
+        return SourceTreeCache(config.source_tree_cache,
+                               config.source_tree_cache_size * 1024 * 1024)
+
+    def tree_key(self, tarball, patches, strip=1, sha256=None):
+        '''
+        Computes the key of a source tree
+
+        @param tarball: path of the tarball
+        @type tarball: str
+        @param patches: paths of the patches in the order they are applied
+        @type patches: list
+        @param strip: number passed to the --strip 'patch' option
+        @type strip: int
+        @param sha256: checksum of the tarball, if known
+        @type sha256: str
+        @return: the key
+        @rtype: str
+        '''
+        h = hashlib.sha256()
+        h.update('%s\0%s\0' % (CACHE_VERSION, strip))
+        h.update('%s\0' % (sha256 or downloader.file_sha256(tarball)))
+        for patch in patches:
+            h.update('%s\0' % downloader.file_sha256(patch))
+        return h.hexdigest()
+
+    def lookup(self, key):
+        '''
+        Checks if there is a tree for a key
+
+        @param key: key of the tree
+        @type key: str
+        @return: whether the tree is in the cache
+        @rtype: bool
+        '''
+        return os.path.isdir(self._tree_path(key))
+
+    def restore(self, key, dest):
+        '''
+        Materializes the tree of a key in a directory
+
+        @param key: key of the tree
+        @type key: str
+        @param dest: directory where the tree is restored, which must not
+                     exist
+        @type dest: str
+        @return: whether the tree was restored
+        @rtype: bool
+        '''
+        path = self._tree_path(key)
+        if not os.path.isdir(path):
+            return False
+        try:
+            copy_tree(path, dest)
+            # Refresh it for the LRU eviction
+            os.utime(path, None)
+        except (IOError, OSError, subprocess.CalledProcessError), ex:
+            m.warning(_("Could not restore %s from the source tree cache: "
+                        "%s") % (path, ex))
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            return False
+        return True
+
+    def store(self, key, src):
+        '''
+        Stores the tree of a key
+
+        @param key: key of the tree
+        @type key: str
+        @param src: directory with the tree
+        @type src: str
+        '''
+        path = self._tree_path(key)
+        if os.path.isdir(path):
+            return
+        tmp = None
+        try:
+            dirname = os.path.dirname(path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            # Copy it to a temporary directory renamed atomically, other
+            # processes sharing the cache could be restoring it
+            tmp = tempfile.mkdtemp(dir=dirname, suffix='.tmp')
+            os.rmdir(tmp)
+            copy_tree(src, tmp)
+            size = _tree_size(tmp)
+            os.rename(tmp, path)
+            tmp = None
+            with open(path + self.SIZE_EXT, 'w') as f:
+                f.write(str(size))
+        except (IOError, OSError, subprocess.CalledProcessError), ex:
+            m.warning(_("Could not store %s in the source tree cache: %s") %
+                      (path, ex))
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used trees until the cache is smaller
+        than its maximum size
+        '''
+        trees = []
+        total = 0
+        if not os.path.isdir(self.path):
+            return
+        for d in os.listdir(self.path):
+            dirpath = os.path.join(self.path, d)
+            if not os.path.isdir(dirpath):
+                continue
+            for f in os.listdir(dirpath):
+                if not f.endswith(self.SIZE_EXT):
+                    continue
+                path = os.path.join(dirpath, f[:-len(self.SIZE_EXT)])
+                try:
+                    with open(path + self.SIZE_EXT, 'r') as sf:
+                        size = int(sf.read())
+                    mtime = os.stat(path).st_mtime
+                except (IOError, OSError, ValueError):
+                    # Removed by another process
+                    continue
+                trees.append((mtime, size, path))
+                total += size
+        trees.sort()
+        while trees and total > self.max_size:
+            mtime, size, path = trees.pop(0)
+            try:
+                os.remove(path + self.SIZE_EXT)
+                shutil.rmtree(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _tree_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+
+def copy_tree(src, dest):
+    '''
+    Copies a directory with copy-on-write clones of its files where the
+    file system supports them, hard linking the git objects
+
+    @param src: source directory
+    @type src: str
+    @param dest: destination directory, which must not exist
+    @type dest: str
+    '''
+    os.makedirs(dest)
+    entries = [os.path.join(src, x) for x in os.listdir(src)]
+    files = [x for x in entries if os.path.basename(x) != '.git']
+    cp = gnu_cp()
+    if cp is not None and files:
+        subprocess.check_call([cp, '-a', '--reflink=auto', '-t', dest] +
+                              files)
+    else:
+        for path in files:
+            target = os.path.join(dest, os.path.basename(path))
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.copytree(path, target, symlinks=True)
+            elif os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            else:
+                shutil.copy2(path, target)
+    gitdir = os.path.join(src, '.git')
+    if os.path.isdir(gitdir):
+        # Git objects are immutable and can be shared, but the index, the
+        # refs, the logs and the config are rewritten in place
+        objects = os.path.join(gitdir, 'objects')
+        link = os.path.isdir(objects) and not os.path.islink(objects)
+
+        def ignore(dirpath, names):
+            return ['objects'] if link and dirpath == gitdir else []
+        shutil.copytree(gitdir, os.path.join(dest, '.git'), symlinks=True,
+                        ignore=ignore)
+        if link:
+            _link_tree(objects, os.path.join(dest, '.git', 'objects'))
+
+
+def gnu_cp():
+    '''
+    Finds GNU cp, which clones the files on copy-on-write file systems
+
+    @return: path of GNU cp, or None if it's not available
+    @rtype: str
+    '''
+    global _gnu_cp
+    if _gnu_cp is None:
+        _gnu_cp = ''
+        path = find_executable('cp')
+        if path is not None and not sys.platform.startswith('win'):
+            try:
+                version = subprocess.Popen([path, '--version'],
+                        stdout=subprocess.PIPE).communicate()[0]
+            except OSError:
+                version = ''
+            if 'GNU coreutils' in version:
+                _gnu_cp = path
+    return _gnu_cp or None
+
+
+def _link_tree(src, dest):
+    for dirpath, dirnames, filenames in os.walk(src):
+        destdir = os.path.join(dest, os.path.relpath(dirpath, src))
+        os.makedirs(destdir)
+        for name in filenames + [x for x in dirnames if
+                                 os.path.islink(os.path.join(dirpath, x))]:
+            path = os.path.join(dirpath, name)
+            target = os.path.join(destdir, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+                continue
+            try:
+                if not hasattr(os, 'link'):
+                    raise OSError(errno.EXDEV, 'Hard links are not supported')
+                os.link(path, target)
+            except OSError, ex:
+                if ex.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+                shutil.copy2(path, target)
+        dirnames[:] = [x for x in dirnames if
+                       not os.path.islink(os.path.join(dirpath, x))]
+
+
+def _tree_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                pass
+    return size
@@ -0,0 +1,233 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import pickle
+import sqlite3
+from contextlib import contextmanager
+
+from cerbero.build.manifest import Manifest
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+class StatusStore(object):
+    '''
+    Stores the build status of the recipes in an SQLite database, with one
+    row per recipe so that each status update is a small transaction that
+    doesn't rewrite the status of the other recipes. Several cerbero
+    processes can use the same database at the same time.
+
+    @ivar path: path of the database
+    @type path: str
+    '''
+
+    # Seconds to wait for other processes holding the database lock
+    TIMEOUT = 60
+    EXT = '.sqlite'
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS status '
+              '(recipe TEXT PRIMARY KEY, data BLOB)',
+              'CREATE TABLE IF NOT EXISTS meta '
+              '(key TEXT PRIMARY KEY, value TEXT)',
+              'CREATE TABLE IF NOT EXISTS files '
+              '(recipe TEXT, path TEXT, size INTEGER, sha256 TEXT, '
+              'link TEXT, exact INTEGER NOT NULL DEFAULT 0, '
+              'PRIMARY KEY (recipe, path))',
+              'CREATE INDEX IF NOT EXISTS files_path ON files (path)']
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(path, timeout=self.TIMEOUT,
+                                     isolation_level=None)
+        self._conn.text_factory = str
+        with self._transaction() as c:
+            for sql in self.SCHEMA:
+                c.execute(sql)
+            # 'exact' was added afterwards, the files recorded before are
+            # not trusted
+            columns = [r[1] for r in c.execute('PRAGMA table_info(files)')]
+            if 'exact' not in columns:
+                c.execute('ALTER TABLE files ADD COLUMN '
+                          'exact INTEGER NOT NULL DEFAULT 0')
+
+    @staticmethod
+    def db_path(cache_file):
+        '''
+        Gets the path of the database replacing a pickle cache file
+
+        @param cache_file: path of the pickle cache file
+        @type cache_file: str
+        @return: path of the database
+        @rtype: str
+        '''
+        return cache_file + StatusStore.EXT
+
+    def load(self):
+        '''
+        Loads the status of all the recipes, skipping the ones that can't
+        be read
+
+        @return: dictionary with the status of each recipe
+        @rtype: dict
+        '''
+        status = {}
+        for recipe, data in self._conn.execute(
+                'SELECT recipe, data FROM status'):
+            try:
+                status[recipe] = pickle.loads(str(data))
+            except Exception, ex:
+                m.warning(_("Could not recover the status of %s: %s") %
+                          (recipe, ex))
+        return status
+
+    def save(self, recipe_name, status):
+        '''
+        Saves the status of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param status: status of the recipe or None to remove it
+        @type status: L{cerbero.build.cookbook.RecipeStatus}
+        '''
+        with self._transaction() as c:
+            self._save(c, recipe_name, status)
+
+    def save_all(self, status):
+        '''
+        Saves the status of several recipes in a single transaction
+
+        @param status: dictionary with the status of each recipe
+        @type status: dict
+        '''
+        with self._transaction() as c:
+            for recipe_name, st in status.iteritems():
+                self._save(c, recipe_name, st)
+
+    def import_pickle(self, filename):
+        '''
+        Imports the status saved in the old pickle cache file, only the
+        first time the database is used
+
+        @param filename: path of the pickle cache file
+        @type filename: str
+        '''
+        if not os.path.exists(filename):
+            return
+        with self._transaction() as c:
+            c.execute("SELECT value FROM meta WHERE key = 'pickle_imported'")
+            if c.fetchone() is not None:
+                return
+            try:
+                with open(filename, 'rb') as f:
+                    status = pickle.load(f)
+                for recipe_name, st in status.iteritems():
+                    self._save(c, recipe_name, st)
+            except Exception, ex:
+                m.warning(_("Could not import the status from %s: %s") %
+                          (filename, ex))
+            c.execute("INSERT INTO meta VALUES ('pickle_imported', ?)",
+                      (filename,))
+
+    def save_manifest(self, recipe_name, manifest, replace=True):
+        '''
+        Saves the files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param manifest: the installed files
+        @type manifest: L{cerbero.build.manifest.Manifest}
+        @param replace: replace the files saved previously instead of
+                        adding them to the new ones
+        @type replace: bool
+        '''
+        with self._transaction() as c:
+            if replace:
+                c.execute('DELETE FROM files WHERE recipe = ?',
+                          (recipe_name,))
+            c.executemany('INSERT OR REPLACE INTO files (recipe, path, '
+                          'size, sha256, link, exact) VALUES '
+                          '(?, ?, ?, ?, ?, ?)',
+                          [(recipe_name, path) + v + (int(manifest.exact),)
+                           for path, v in manifest.files.iteritems()])
+
+    def load_manifest(self, recipe_name, shared=True):
+        '''
+        Loads the files installed by a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param shared: include the files installed by other recipes too
+        @type shared: bool
+        @return: the installed files or None if they were not saved
+        @rtype: L{cerbero.build.manifest.Manifest}
+        '''
+        rows = self._conn.execute('SELECT path, size, sha256, link, exact '
+                                  'FROM files WHERE recipe = ?',
+                                  (recipe_name,)).fetchall()
+        files = dict([(r[0], tuple(r[1:4])) for r in rows])
+        if not files:
+            return None
+        exact = all([r[4] for r in rows])
+        if not shared:
+            for r in self._conn.execute(
+                    'SELECT a.path FROM files a JOIN files b ON '
+                    'a.path = b.path WHERE a.recipe = ? AND b.recipe != ?',
+                    (recipe_name, recipe_name)):
+                files.pop(r[0], None)
+        return Manifest(files, exact)
+
+    def file_recipes(self, path):
+        '''
+        Lists the recipes that installed a file
+
+        @param path: path of the file relative to the prefix
+        @type path: str
+        @return: names of the recipes
+        @rtype: list
+        '''
+        return [r[0] for r in self._conn.execute(
+                'SELECT recipe FROM files WHERE path = ?', (path,))]
+
+    def close(self):
+        self._conn.close()
+
+    def _save(self, cursor, recipe_name, status):
+        if status is None:
+            cursor.execute('DELETE FROM status WHERE recipe = ?',
+                           (recipe_name,))
+        else:
+            data = pickle.dumps(status, pickle.HIGHEST_PROTOCOL)
+            cursor.execute('INSERT OR REPLACE INTO status VALUES (?, ?)',
+                           (recipe_name, sqlite3.Binary(data)))
+
+    @contextmanager
+    def _transaction(self):
+        cursor = self._conn.cursor()
+        # Take the write lock right away to avoid deadlocks between
+        # processes upgrading a read lock
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+        else:
+            cursor.execute('COMMIT')
@@ -38,7 +38,20 @@ class Build(Command):
                            'listed in the recipe')),
                 ArgparseArgument('--dry-run', action='store_true',
                     default=False,
-                    help=_('only print commands instead of running them '))]
+                    help=_('only print commands instead of running them ')),
+                ArgparseArgument('-j', '--jobs', type=int, default=1,
+                    help=_('number of recipes to build in parallel')),
+                ArgparseArgument('--fetch-jobs', type=int, default=2,
+                    help=_('number of recipes to fetch in the background '
+                           'while building (0 to disable)')),
+                ArgparseArgument('--keep-going', action='store_true',
+                    default=False,
+                    help=_('keep building the recipes that do not depend '
+                           'on a failed one')),
+                ArgparseArgument('--clean-install', action='store_true',
+                    default=False,
+                    help=_('remove the files installed by the previous '
+                           'build of a recipe before installing it'))]
             if force is None:
                 args.append(
                     ArgparseArgument('--force', action='store_true',
@@ -61,16 +74,20 @@ class Build(Command):
         if self.no_deps is None:
             self.no_deps = args.no_deps
         self.runargs(config, args.recipe, args.missing_files, self.force,
-                     self.no_deps, dry_run=args.dry_run)
+                     self.no_deps, dry_run=args.dry_run, jobs=args.jobs,
+                     fetch_jobs=args.fetch_jobs, keep_going=args.keep_going,
+                     clean_install=args.clean_install)
 
     def runargs(self, config, recipes, missing_files=False, force=False,
-                no_deps=False, cookbook=None, dry_run=False):
+                no_deps=False, cookbook=None, dry_run=False, jobs=1,
+                fetch_jobs=2, keep_going=False, clean_install=False):
         if cookbook is None:
             cookbook = CookBook(config)
 
         oven = Oven(recipes, cookbook, force=self.force,
                     no_deps=self.no_deps, missing_files=missing_files,
-                    dry_run=dry_run)
+                    dry_run=dry_run, jobs=jobs, fetch_jobs=fetch_jobs,
+                    keep_going=keep_going, clean_install=clean_install)
         oven.start_cooking()
 
 
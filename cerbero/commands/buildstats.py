@@ -0,0 +1,141 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.commands import Command, register_command
+from cerbero.build.cookbook import CookBook
+from cerbero.utils import _, N_, ArgparseArgument, remove_list_duplicates
+from cerbero.utils import messages as m
+
+
+class BuildStats(Command):
+    doc = N_('Show the time spent building the recipes')
+    name = 'build-stats'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('recipes', nargs='*',
+                help=_('only show the recipes needed to build these ones')),
+            ArgparseArgument('--limit', type=int, default=10,
+                help=_('number of entries to show in each list')),
+            ])
+
+    def run(self, config, args):
+        cookbook = CookBook(config, metadata_only=True)
+        if args.recipes:
+            recipes = []
+            for recipe in args.recipes:
+                recipes += [r.name for r in cookbook.list_recipe_deps(recipe)]
+            recipes = remove_list_duplicates(recipes)
+        else:
+            recipes = [r.name for r in cookbook.get_recipes_list()]
+
+        timings = dict([(r, cookbook.recipe_timings(r)) for r in recipes])
+        timings = dict([(r, t) for r, t in timings.iteritems() if t])
+        if not timings:
+            m.message(_("No build statistics recorded yet"))
+            return
+
+        # Time spent in the last run of each step
+        last = {}
+        for recipe, steps in timings.iteritems():
+            last[recipe] = dict([(s, h[-1]) for s, h in steps.iteritems()])
+
+        self._print_slowest_recipes(last, args.limit)
+        self._print_slowest_steps(last, args.limit)
+        self._print_trends(timings, args.limit)
+        self._print_critical_path(cookbook, recipes, last)
+
+    def _print_slowest_recipes(self, last, limit):
+        totals = [(self._total(steps), r) for r, steps in last.iteritems()]
+        totals.sort(reverse=True)
+        m.message(_("Slowest recipes:"))
+        for total, recipe in totals[:limit]:
+            m.message("  %s  %s" % (self._format_time(total), recipe))
+
+    def _print_slowest_steps(self, last, limit):
+        steps = []
+        for recipe, rsteps in last.iteritems():
+            for step, timing in rsteps.iteritems():
+                steps.append((timing['wall'], recipe, step, timing))
+        steps.sort(reverse=True)
+        m.message(_("Slowest steps:"))
+        for wall, recipe, step, timing in steps[:limit]:
+            cpu = '-'
+            if timing.get('user') is not None:
+                cpu = self._format_time(timing['user'] + timing['sys'])
+            rss = '-'
+            if timing.get('maxrss') is not None:
+                rss = '%dMB' % (timing['maxrss'] / 1024)
+            m.message("  %s  %s %s (cpu: %s, peak rss: %s)" %
+                      (self._format_time(wall), recipe, step, cpu.strip(),
+                       rss))
+
+    def _print_trends(self, timings, limit):
+        trends = []
+        for recipe, steps in timings.iteritems():
+            for step, history in steps.iteritems():
+                if len(history) < 2:
+                    continue
+                previous = [t['wall'] for t in history[:-1]]
+                mean = sum(previous) / len(previous)
+                trends.append((history[-1]['wall'] - mean, recipe, step,
+                               mean, history[-1]['wall'], len(history)))
+        if not trends:
+            return
+        trends.sort(key=lambda x: abs(x[0]), reverse=True)
+        m.message(_("Biggest changes (last run against the average of the "
+                    "previous ones):"))
+        for diff, recipe, step, mean, wall, runs in trends[:limit]:
+            percent = ''
+            if mean:
+                percent = ' (%+d%%)' % (diff * 100 / mean)
+            m.message("  %+.1fs%s  %s %s (%s -> %s, %d runs)" %
+                      (diff, percent, recipe, step,
+                       self._format_time(mean).strip(),
+                       self._format_time(wall).strip(), runs))
+
+    def _print_critical_path(self, cookbook, recipes, last):
+        # Longest chain of dependencies, weighted with the last build times
+        recipes = set(recipes)
+        paths = {}
+
+        def longest_path(name):
+            if name not in paths:
+                paths[name] = (0, [])
+                deps = [d for d in cookbook.list_recipe_build_deps(name)
+                        if d in recipes]
+                best = max([longest_path(d) for d in deps] or [(0, [])])
+                total = self._total(last.get(name, {}))
+                paths[name] = (best[0] + total, best[1] + [name])
+            return paths[name]
+
+        total, path = max([longest_path(r) for r in recipes])
+        m.message(_("Critical path (%s):") % self._format_time(total).strip())
+        for recipe in path:
+            m.message("  %s  %s" %
+                      (self._format_time(self._total(last.get(recipe, {}))),
+                       recipe))
+
+    def _total(self, steps):
+        return sum([t['wall'] for t in steps.values()])
+
+    def _format_time(self, seconds):
+        return '%8.1fs' % seconds
+
+
+register_command(BuildStats)
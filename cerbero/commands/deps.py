@@ -39,7 +39,7 @@ class Deps(Command):
             ])
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, metadata_only=True)
         recipe_name = args.recipe[0]
         all_deps = args.all
         graph = args.graph
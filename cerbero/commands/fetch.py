@@ -19,6 +19,8 @@
 
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
+from cerbero.build.fetcher import BackgroundFetcher
+from cerbero.errors import FatalError
 from cerbero.packages.packagesstore import PackagesStore
 from cerbero.utils import _, N_, ArgparseArgument, remove_list_duplicates
 from cerbero.utils import messages as m
@@ -30,11 +32,20 @@ class Fetch(Command):
         args.append(ArgparseArgument('--reset-rdeps', action='store_true',
                     default=False, help=_('reset the status of reverse '
                     'dependencies too')))
+        args.append(ArgparseArgument('--reset-all-rdeps', action='store_true',
+                    default=False, help=_('reset the status of the recipes '
+                    'depending directly or indirectly on the updated ones')))
         args.append(ArgparseArgument('--full-reset', action='store_true',
                     default=False, help=_('reset to extract step if rebuild is needed')))
+        args.append(ArgparseArgument('-j', '--jobs', type=int, default=4,
+                    help=_('number of recipes to fetch in parallel')))
+        args.append(ArgparseArgument('--host-jobs', type=int, default=2,
+                    help=_('number of recipes to fetch in parallel from the '
+                           'same host')))
         Command.__init__(self, args)
 
-    def fetch(self, cookbook, recipes, no_deps, reset_rdeps, full_reset):
+    def fetch(self, cookbook, recipes, no_deps, reset_rdeps, full_reset,
+              jobs=4, host_jobs=2, reset_all_rdeps=False):
         fetch_recipes = []
         if not recipes:
             fetch_recipes = cookbook.get_recipes_list()
@@ -46,13 +57,40 @@ class Fetch(Command):
             fetch_recipes = remove_list_duplicates (fetch_recipes)
         m.message(_("Fetching the following recipes: %s") %
                   ' '.join([x.name for x in fetch_recipes]))
+        # Fetch the recipes in background threads, logging the output of
+        # each one to its own file, and the ones that failed again in the
+        # foreground to show the error. The built versions are computed in
+        # the background too.
+        fetcher = BackgroundFetcher(fetch_recipes, jobs, host_jobs,
+                                    versions=True)
+        fetcher.start()
+        versions = {}
+        failed = []
+        try:
+            for i in range(len(fetch_recipes)):
+                recipe = fetch_recipes[i]
+                fetched = fetcher.wait(recipe.name)
+                m.build_step(i + 1, len(fetch_recipes), recipe, 'Fetch')
+                if fetched:
+                    versions[recipe.name] = fetcher.versions[recipe.name]
+                    continue
+                try:
+                    recipe.fetch()
+                except FatalError, ex:
+                    m.warning(_("Could not fetch %s: %s") %
+                              (recipe.name, ex))
+                    failed.append(recipe.name)
+                    continue
+                versions[recipe.name] = recipe.built_version()
+        finally:
+            fetcher.stop()
+
         to_rebuild = []
-        for i in range(len(fetch_recipes)):
-            recipe = fetch_recipes[i]
-            m.build_step(i + 1, len(fetch_recipes), recipe, 'Fetch')
-            recipe.fetch()
+        for recipe in fetch_recipes:
+            if recipe.name not in versions:
+                continue
             bv = cookbook.recipe_built_version(recipe.name)
-            cv = recipe.built_version()
+            cv = versions[recipe.name]
             if bv != cv:
                 # On different versions, only reset recipe if:
                 #  * forced
@@ -60,16 +98,25 @@ class Fetch(Command):
                 if full_reset or not cookbook.recipe_needs_build(recipe.name):
                     to_rebuild.append(recipe)
                     cookbook.reset_recipe_status(recipe.name)
-                    if reset_rdeps:
-                        for r in cookbook.list_recipe_reverse_deps(recipe.name):
-                            to_rebuild.append(r)
-                            cookbook.reset_recipe_status(r.name)
+        rdeps = []
+        if reset_all_rdeps and to_rebuild:
+            rdeps = cookbook.list_recipes_reverse_deps(
+                    [x.name for x in to_rebuild])
+        elif reset_rdeps:
+            for recipe in to_rebuild:
+                rdeps += cookbook.list_recipe_reverse_deps(recipe.name)
+        for r in rdeps:
+            to_rebuild.append(r)
+            cookbook.reset_recipe_status(r.name)
 
         if to_rebuild:
             to_rebuild = sorted(list(set(to_rebuild)), key=lambda r:r.name)
             m.message(_("These recipes have been updated and will "
                         "be rebuilt:\n%s") %
                         '\n'.join([x.name for x in to_rebuild]))
+        if failed:
+            raise FatalError(_("Could not fetch the following recipes: %s") %
+                             ' '.join(failed))
 
 
 class FetchRecipes(Fetch):
@@ -89,7 +136,8 @@ class FetchRecipes(Fetch):
     def run(self, config, args):
         cookbook = CookBook(config)
         return self.fetch(cookbook, args.recipes, args.no_deps,
-                          args.reset_rdeps, args.full_reset)
+                          args.reset_rdeps, args.full_reset, args.jobs,
+                          args.host_jobs, args.reset_all_rdeps)
 
 
 class FetchPackage(Fetch):
@@ -107,7 +155,8 @@ class FetchPackage(Fetch):
         store = PackagesStore(config)
         package = store.get_package(args.package[0])
         return self.fetch(store.cookbook, package.recipes_dependencies(),
-                          True, args.reset_rdeps, args.full_reset)
+                          True, args.reset_rdeps, args.full_reset, args.jobs,
+                          args.host_jobs, args.reset_all_rdeps)
 
 
 register_command(FetchRecipes)
@@ -32,7 +32,7 @@ class List(Command):
         Command.__init__(self, [])
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, metadata_only=True)
         recipes = cookbook.get_recipes_list()
         if len(recipes) == 0:
             m.message(_("No recipes found"))
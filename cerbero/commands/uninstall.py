@@ -0,0 +1,69 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.commands import Command, register_command
+from cerbero.build.cookbook import CookBook
+from cerbero.build.manifest import Manifest, remove_files
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+class Uninstall(Command):
+    doc = N_('Remove the files installed by a recipe from the prefix')
+    name = 'uninstall'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('recipe', nargs='+',
+                             help=_('name of the recipes to uninstall')),
+            ])
+
+    def run(self, config, args):
+        cookbook = CookBook(config)
+        for recipe_name in args.recipe:
+            # Check that the recipe exists
+            cookbook.get_recipe(recipe_name)
+            manifest = cookbook.get_install_manifest(recipe_name,
+                                                     shared=False)
+            if manifest is None:
+                m.warning(_("No files installed by %s were recorded") %
+                          recipe_name)
+                continue
+            if not manifest.exact:
+                m.warning(_("The files installed by %s were not recorded "
+                            "exactly, they could belong to other recipes. "
+                            "Rebuild it with 'staged_install' enabled to "
+                            "uninstall it.") % recipe_name)
+                continue
+            m.message(_("Uninstalling %s") % recipe_name)
+            modified = remove_files(config.prefix, manifest)
+            if modified:
+                m.warning(_("These files were modified after being "
+                            "installed and were not removed: %s") %
+                          ' '.join(modified))
+            cookbook.update_install_manifest(recipe_name, Manifest())
+            cookbook.reset_recipe_status(recipe_name)
+            rdeps = [r.name for r in
+                     cookbook.list_recipe_reverse_deps(recipe_name) if
+                     cookbook.recipe_built_version(r.name) is not None]
+            if rdeps:
+                m.warning(_("These recipes depend on %s: %s") %
+                          (recipe_name, ' '.join(rdeps)))
+
+
+register_command(Uninstall)
@@ -21,6 +21,8 @@ import stat
 import shutil
 
 from cerbero.commands import Command, register_command
+from cerbero.build.statusstore import StatusStore
+from cerbero.build.recipeindex import RecipeIndex
 from cerbero.utils import _, N_, shell, ArgparseArgument
 import cerbero.utils.messages as m
 
@@ -44,13 +46,14 @@ class Wipe(Command):
                 ])
 
     def run(self, config, args):
-        to_remove = [os.path.join(config.home_dir, config.cache_file)]
+        to_remove = self._cache_files(config, config.cache_file)
         to_remove.append(config.prefix)
         to_remove.append(config.logs)
         if not args.keep_sources:
             to_remove.append(config.sources)
         if args.build_tools:
-            to_remove.append(os.path.join(config.home_dir, config.build_tools_cache))
+            to_remove.extend(self._cache_files(config,
+                                               config.build_tools_cache))
             to_remove.append(config.build_tools_prefix)
             to_remove.append(config.build_tools_sources)
 
@@ -76,6 +79,11 @@ class Wipe(Command):
                 # Start with the Apocalypse
                 self.wipe(to_remove)
 
+    def _cache_files(self, config, cache_file):
+        cache_file = os.path.join(config.home_dir, cache_file)
+        return [cache_file, StatusStore.db_path(cache_file),
+                RecipeIndex.index_path(cache_file)]
+
     def wipe(self, paths):
 
         def _onerror(func, path, exc_info):
@@ -19,12 +19,15 @@
 import os
 import sys
 import copy
+import getpass
+import tempfile
 
 from cerbero import enums
 from cerbero.errors import FatalError, ConfigurationError
 from cerbero.utils import _, system_info, validate_packager, to_unixpath,\
     shell, parse_file
 from cerbero.utils import messages as m
+from cerbero.utils.env import Environment
 
 
 CONFIG_DIR = os.path.expanduser('~/.cerbero')
@@ -35,6 +38,8 @@ DEFAULT_CONFIG_FILE = os.path.join(CONFIG_DIR, DEFAULT_CONFIG_FILENAME)
 DEFAULT_GIT_ROOT = 'git://anongit.freedesktop.org/gstreamer-sdk'
 DEFAULT_ALLOW_PARALLEL_BUILD = False
 DEFAULT_PACKAGER = "Default <default@change.me>"
+DEFAULT_BINARY_CACHE_SIZE = 20 * 1024  # MB
+DEFAULT_SOURCE_TREE_CACHE_SIZE = 20 * 1024  # MB
 CERBERO_UNINSTALLED = 'CERBERO_UNINSTALLED'
 CERBERO_PREFIX = 'CERBERO_PREFIX'
 
@@ -92,7 +97,10 @@ class Config (object):
                    'ios_platform', 'extra_build_tools',
                    'distro_packages_install', 'interactive',
                    'target_arch_flags', 'sysroot', 'isysroot',
-                   'extra_lib_path']
+                   'extra_lib_path', 'make_jobserver', 'jobserver_slots',
+                   'jobserver_fifo', 'binary_cache', 'binary_cache_size',
+                   'staged_install', 'source_store', 'source_tree_cache',
+                   'source_tree_cache_size']
 
     def __init__(self):
         self._check_uninstalled()
@@ -101,11 +109,16 @@ class Config (object):
             setattr(self, a, None)
 
         self.arch_config = {self.target_arch: self}
+        # Configuration files parsed, in order
+        self.config_files = []
         # Store raw os.environ data
         self._raw_environ = os.environ.copy()
         self._pre_environ = os.environ.copy()
+        self._build_env = None
+        self._build_env_key = None
 
     def load(self, filename=None):
+        self._build_env = None
 
         # First load the default configuration
         self.load_defaults()
@@ -171,7 +184,25 @@ class Config (object):
             self._create_path(c.logs)
 
     def do_setup_env(self):
-        self._restore_environment()
+        '''
+        Sets the build environment of this configuration in the process
+        environment, for the code that still reads os.environ
+        '''
+        self.get_build_env().apply()
+
+    def get_build_env(self):
+        '''
+        Gets the environment used to run the build commands with this
+        configuration, computed only once and without modifying the process
+        environment
+
+        @return: the build environment
+        @rtype: L{cerbero.utils.env.Environment}
+        '''
+        if self._build_env is not None and \
+                self._build_env_key == self._get_build_env_key():
+            return self._build_env
+
         self._create_path(self.prefix)
         self._create_path(os.path.join(self.prefix, 'share', 'aclocal'))
         self._create_path(os.path.join(
@@ -179,12 +210,13 @@ class Config (object):
 
         libdir = os.path.join(self.prefix, 'lib%s' % self.lib_suffix)
         self.libdir = libdir
-        os.environ[CERBERO_PREFIX] = self.prefix
-
         self.env = self.get_env(self.prefix, libdir, self.py_prefix)
-        # set all the variables
-        for e, v in self.env.iteritems():
-            os.environ[e] = v
+        variables = self._raw_environ.copy()
+        variables[CERBERO_PREFIX] = self.prefix
+        variables.update(self.env)
+        self._build_env = Environment(variables)
+        self._build_env_key = self._get_build_env_key()
+        return self._build_env
 
     def get_env(self, prefix, libdir, py_prefix):
         # Get paths for environment variables
@@ -226,10 +258,10 @@ class Config (object):
             xdgdatadir += ":/usr/share:/usr/local/share"
 
         ldflags = '-L%s ' % libdir
-        if ldflags not in os.environ.get('LDFLAGS', ''):
-            ldflags += os.environ.get('LDFLAGS', '')
+        if ldflags not in self._raw_environ.get('LDFLAGS', ''):
+            ldflags += self._raw_environ.get('LDFLAGS', '')
 
-        path = os.environ.get('PATH', '')
+        path = self._raw_environ.get('PATH', '')
         if bindir not in path and self.prefix_is_executable():
             path = self._join_path(bindir, path)
         path = self._join_path(
@@ -326,6 +358,14 @@ class Config (object):
         self.set_property('extra_build_tools', {})
         self.set_property('distro_packages_install', True)
         self.set_property('interactive', True)
+        self.set_property('make_jobserver', False)
+        self.set_property('binary_cache', None)
+        self.set_property('binary_cache_size', DEFAULT_BINARY_CACHE_SIZE)
+        self.set_property('staged_install', True)
+        self.set_property('source_store', None)
+        self.set_property('source_tree_cache', None)
+        self.set_property('source_tree_cache_size',
+                          DEFAULT_SOURCE_TREE_CACHE_SIZE)
 
     def set_property(self, name, value, force=False):
         if name not in self._properties:
@@ -380,10 +420,18 @@ class Config (object):
         except:
             raise ConfigurationError(_('Could not include config file (%s)') %
                              filename)
+        if filename not in self.config_files:
+            self.config_files.append(filename)
         for key in self._properties:
             if key in config:
                 self.set_property(key, config[key], True)
 
+    def _get_build_env_key(self):
+        # Properties that can change the environment after loading the config
+        return (self.prefix, self.lib_suffix, self.py_prefix,
+                self.build_tools_prefix,
+                getattr(self.variants, 'python3', False))
+
     def _restore_environment(self):
         os.environ.clear()
         os.environ.update(self._raw_environ)
@@ -458,6 +506,9 @@ class Config (object):
         self.set_property('build_tools_sources',
                 os.path.join(self.home_dir, 'sources', 'build-tools'))
         self.set_property('build_tools_cache', 'build-tools.cache')
+        self.set_property('jobserver_slots', self.num_of_cpus)
+        self.set_property('jobserver_fifo', os.path.join(
+            tempfile.gettempdir(), 'cerbero-jobserver-%s' % getpass.getuser()))
 
     def _find_data_dir(self):
         if self.uninstalled:
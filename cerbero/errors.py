@@ -82,8 +82,12 @@ class MissingPackageFilesError(CerberoException):
 
 
 class InvalidRecipeError(CerberoException):
+    recipe = ''
+    reason = ''
 
     def __init__(self, recipe, message=''):
+        self.recipe = recipe
+        self.reason = message
         CerberoException.__init__(self,
                 _("Recipe %s is invalid:\n%s") % (recipe, message))
 
@@ -136,14 +136,3 @@ def rmtree(path, onerror=None):
 
 
 shutil.rmtree = rmtree
-
-
-
-### OS X Hacks ###
-
-# use cURL to download instead of wget
-
-if sys.platform.startswith('darwin'):
-    import cerbero.utils.shell as cshell
-    del cshell.download
-    cshell.download = cshell.download_curl
@@ -281,11 +281,17 @@ def get_wix_prefix():
         raise FatalError("The required packaging tool 'WiX' was not found")
     return escape_path(to_unixpath(wix_prefix))
 
-def add_system_libs(config, new_env):
+def add_system_libs(config, new_env, env=None):
     '''
     Add /usr/lib/pkgconfig to PKG_CONFIG_PATH so the system's .pc file
     can be found.
+
+    @param env: environment with the configured PKG_CONFIG_LIBDIR,
+                defaults to os.environ
+    @type env: dict
     '''
+    if env is None:
+        env = os.environ
     arch = config.target_arch
     libdir = 'lib'
     if arch == Architecture.X86:
@@ -293,7 +299,7 @@ def add_system_libs(config, new_env):
     else:
         if config.distro == Distro.REDHAT:
             libdir = 'lib64'
-    search_paths = [os.environ['PKG_CONFIG_LIBDIR'],
+    search_paths = [env['PKG_CONFIG_LIBDIR'],
         '/usr/%s/pkgconfig' % libdir, '/usr/share/pkgconfig',
         '/usr/lib/%s-linux-gnu/pkgconfig' % arch]
     new_env['PKG_CONFIG_PATH'] = ':'.join(search_paths)
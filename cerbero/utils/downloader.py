@@ -0,0 +1,162 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import ssl
+import socket
+import hashlib
+import logging
+import urllib2
+import httplib
+import threading
+
+from cerbero.errors import FatalError
+from cerbero.utils import _
+
+
+PARTIAL_EXT = '.partial'
+BUFFER_SIZE = 64 * 1024
+TIMEOUT = 60
+RETRIES = 3
+
+# Serializes the downloads to the same destination made from different
+# threads, like the background fetcher and the ones of 'cerbero fetch'
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def download(url, destination, sha256=None, check_cert=True,
+             retries=RETRIES):
+    '''
+    Downloads a file in-process. The data is written to a '.partial' file
+    next to the destination, which is resumed with an HTTP range request if
+    the download is interrupted, and renamed to the destination once it's
+    complete and verified.
+
+    @param url: url to download
+    @type url: str
+    @param destination: destination where the file will be saved
+    @type destination: str
+    @param sha256: expected sha256 hex digest of the file, or None to skip
+                   the verification
+    @type sha256: str
+    @param check_cert: verify the certificate of https servers
+    @type check_cert: bool
+    @param retries: number of times the download is resumed after a
+                    network error
+    @type retries: int
+    '''
+    with _lock(destination):
+        if os.path.exists(destination):
+            if sha256 is None or file_sha256(destination) == sha256:
+                return
+            logging.info("Removing %s, its checksum doesn't match" %
+                         destination)
+            os.remove(destination)
+        dirname = os.path.dirname(destination)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        partial = destination + PARTIAL_EXT
+        attempt = 0
+        while True:
+            try:
+                _fetch(url, partial, check_cert)
+                break
+            except (urllib2.URLError, httplib.HTTPException, socket.error), ex:
+                # Keep the partial file to resume it, unless the server
+                # refused the download
+                if isinstance(ex, urllib2.HTTPError) or attempt >= retries:
+                    raise FatalError(_("Error downloading %s: %s") %
+                                     (url, ex))
+                attempt += 1
+                logging.info("Resuming download of %s after error: %s",
+                             url, ex)
+        if sha256 is not None:
+            checksum = file_sha256(partial)
+            if checksum != sha256:
+                os.remove(partial)
+                raise FatalError(_("Checksum of %s doesn't match, expected "
+                                   "%s but got %s") % (url, sha256, checksum))
+        os.rename(partial, destination)
+
+
+def file_sha256(filepath):
+    '''
+    Computes the sha256 checksum of a file
+
+    @param filepath: path of the file
+    @type filepath: str
+    @return: hex digest of the file
+    @rtype: str
+    '''
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while True:
+            data = f.read(BUFFER_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def _fetch(url, partial, check_cert):
+    offset = 0
+    if os.path.exists(partial):
+        offset = os.path.getsize(partial)
+    req = urllib2.Request(url, headers={'User-Agent': 'cerbero'})
+    if offset:
+        req.add_header('Range', 'bytes=%d-' % offset)
+    try:
+        resp = _urlopen(req, check_cert)
+    except urllib2.HTTPError, ex:
+        if ex.code != 416 or not offset:
+            raise
+        # The partial file can't be resumed, start it again
+        os.remove(partial)
+        return _fetch(url, partial, check_cert)
+    try:
+        mode = 'ab'
+        if resp.getcode() != 206:
+            # The server ignored the range, it's sending the whole file
+            mode = 'wb'
+        length = resp.info().getheader('Content-Length')
+        received = 0
+        with open(partial, mode) as f:
+            while True:
+                data = resp.read(BUFFER_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                received += len(data)
+        if length is not None and received < int(length):
+            raise httplib.IncompleteRead('', int(length) - received)
+    finally:
+        resp.close()
+
+
+def _urlopen(req, check_cert):
+    if not check_cert and hasattr(ssl, '_create_unverified_context'):
+        return urllib2.urlopen(req, timeout=TIMEOUT,
+                               context=ssl._create_unverified_context())
+    return urllib2.urlopen(req, timeout=TIMEOUT)
+
+
+def _lock(destination):
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(destination),
+                                 threading.Lock())
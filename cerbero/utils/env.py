@@ -0,0 +1,82 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import collections
+
+
+class Environment(collections.Mapping):
+    '''
+    Immutable set of environment variables passed to the commands run by
+    the build steps, instead of modifying the process environment
+
+    @param variables: environment variables
+    @type variables: dict
+    '''
+
+    def __init__(self, variables=None):
+        self._vars = dict(variables or {})
+
+    def __getitem__(self, key):
+        return self._vars[key]
+
+    def __iter__(self):
+        return iter(self._vars)
+
+    def __len__(self):
+        return len(self._vars)
+
+    def __repr__(self):
+        return 'Environment(%r)' % self._vars
+
+    def derive(self, append_env=None, new_env=None):
+        '''
+        Creates a new environment appending the values in append_env and
+        replacing the values in new_env, where None removes the variable
+
+        @param append_env: values appended to the existing variables
+        @type append_env: dict
+        @param new_env: values replacing the existing variables
+        @type new_env: dict
+        @return: the new environment
+        @rtype: L{cerbero.utils.env.Environment}
+        '''
+        if not append_env and not new_env:
+            return self
+        variables = self._vars.copy()
+        for var, val in (append_env or {}).iteritems():
+            variables[var] = '%s %s' % (variables.get(var, ''), val)
+        for var, val in (new_env or {}).iteritems():
+            if val is None:
+                variables.pop(var, None)
+            else:
+                variables[var] = val
+        return Environment(variables)
+
+    def apply(self):
+        '''
+        Replaces the process environment with this one, for the code that
+        still reads os.environ
+        '''
+        # Only update the variables that changed, setting them is expensive
+        for var in os.environ.keys():
+            if var not in self._vars:
+                del os.environ[var]
+        for var, val in self._vars.iteritems():
+            if os.environ.get(var) != val:
+                os.environ[var] = val
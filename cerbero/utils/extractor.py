@@ -0,0 +1,222 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import shutil
+import logging
+import tarfile
+import zipfile
+import subprocess
+from distutils.spawn import find_executable
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+from cerbero.errors import FatalError
+from cerbero.utils import _, rusage
+
+
+BUFFER_SIZE = 1024 * 1024
+
+# Extensions of the tarballs and their compression
+COMPRESSIONS = [('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'),
+                ('.tbz2', 'bz2'), ('.tar.xz', 'xz'), ('.txz', 'xz'),
+                ('.tar.zst', 'zst'), ('.tar', None)]
+
+# External decompressors writing to stdout, fastest first. The parallel
+# ones, and xz since 5.4, use several cores for files with several
+# compressed blocks.
+DECOMPRESSORS = {
+    'gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'xz': [['xz', '-T0', '-dc']],
+    'zst': [['zstd', '-dc']],
+}
+
+# Compressions that can be decompressed in-process by tarfile
+TARFILE_COMPRESSIONS = ['gz', 'bz2']
+
+_gnu_tar = None
+
+
+def extract(filepath, output_dir, rename=None):
+    '''
+    Extracts a tarball or a zip file in a single streaming pass. Tarballs
+    are decompressed with the fastest decompressor available and written
+    with GNU tar, or with tarfile where it's not available.
+
+    @param filepath: path of the tarball
+    @type filepath: str
+    @param output_dir: output directory
+    @type output_dir: str
+    @param rename: top-level directory of the tarball and the path
+                   relative to output_dir where it's extracted instead
+    @type rename: tuple
+    '''
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if filepath.endswith('.zip'):
+        _extract_zip(filepath, output_dir, rename)
+        return
+    for ext, compression in COMPRESSIONS:
+        if filepath.endswith(ext):
+            break
+    else:
+        raise FatalError(_("Unknown tarball format %s") % filepath)
+
+    cmd = _find_decompressor(compression)
+    tar = gnu_tar()
+    if cmd is not None:
+        proc = subprocess.Popen(cmd + [filepath], stdout=subprocess.PIPE,
+                                bufsize=BUFFER_SIZE)
+        try:
+            if tar is not None:
+                _run_tar(tar, proc.stdout, output_dir, rename, filepath)
+            else:
+                _extract_tar(proc.stdout, output_dir, rename)
+            # Drain the padding after the end of the archive
+            while proc.stdout.read(BUFFER_SIZE):
+                pass
+        except:
+            proc.kill()
+            proc.wait()
+            raise
+        if rusage.wait(proc) != 0:
+            raise FatalError(_("Error decompressing %s with %s") %
+                             (filepath, cmd[0]))
+    elif compression is None or compression in TARFILE_COMPRESSIONS:
+        with open(filepath, 'rb') as f:
+            if tar is not None and compression is None:
+                _run_tar(tar, f, output_dir, rename, filepath)
+            else:
+                _extract_tar(f, output_dir, rename, compression)
+    elif compression == 'xz' and lzma is not None:
+        f = lzma.LZMAFile(filepath)
+        try:
+            _extract_tar(f, output_dir, rename)
+        finally:
+            f.close()
+    else:
+        raise FatalError(_("No decompressor found for %s") % filepath)
+
+
+def gnu_tar():
+    '''
+    Finds GNU tar, which writes files faster than tarfile
+
+    @return: path of GNU tar, or None if it's not available
+    @rtype: str
+    '''
+    global _gnu_tar
+    if _gnu_tar is None:
+        _gnu_tar = ''
+        path = find_executable('tar')
+        if path is not None and not sys.platform.startswith('win'):
+            try:
+                version = subprocess.Popen([path, '--version'],
+                        stdout=subprocess.PIPE).communicate()[0]
+            except OSError:
+                version = ''
+            if 'GNU tar' in version:
+                _gnu_tar = path
+    return _gnu_tar or None
+
+
+def _find_decompressor(compression):
+    for cmd in DECOMPRESSORS.get(compression, []):
+        path = find_executable(cmd[0])
+        if path is not None:
+            return [path] + cmd[1:]
+    return None
+
+
+def _run_tar(tar, fileobj, output_dir, rename, filepath):
+    cmd = [tar, '-x', '-f', '-', '-C', output_dir]
+    if rename is not None:
+        # Applied to the targets of hard links but not of symbolic links
+        cmd.append('--transform=s,^\\(\\./\\)*%s\\(/\\|$\\),%s\\2,S' %
+                   (_escape(rename[0], '.[]*^$\\,'),
+                    _escape(rename[1], '&\\,')))
+    proc = subprocess.Popen(cmd, stdin=fileobj)
+    if rusage.wait(proc) != 0:
+        raise FatalError(_("Error extracting %s") % filepath)
+
+
+def _escape(string, chars):
+    return ''.join([c in chars and '\\' + c or c for c in string])
+
+
+def _rename(name, rename):
+    if rename is None:
+        return name
+    if name.startswith('./'):
+        name = name[2:]
+    old, new = rename
+    if name == old or name.startswith(old + '/'):
+        name = new + name[len(old):]
+    return name
+
+
+def _extract_tar(fileobj, output_dir, rename, compression=None):
+    mode = 'r|%s' % (compression or '')
+    tf = _TarFile.open(fileobj=fileobj, mode=mode)
+    try:
+        tf.extractall(path=output_dir, members=_members(tf, rename))
+    finally:
+        tf.close()
+
+
+def _members(tf, rename):
+    count = 0
+    for tarinfo in tf:
+        tarinfo.name = _rename(tarinfo.name, rename)
+        if tarinfo.islnk():
+            tarinfo.linkname = _rename(tarinfo.linkname, rename)
+        count += 1
+        yield tarinfo
+    logging.info("Unpacked %d files" % count)
+
+
+def _extract_zip(filepath, output_dir, rename):
+    zf = zipfile.ZipFile(filepath, 'r')
+    try:
+        for zipinfo in zf.infolist():
+            zipinfo.filename = _rename(zipinfo.filename, rename)
+            zf.extract(zipinfo, output_dir)
+    finally:
+        zf.close()
+
+
+class _TarFile(tarfile.TarFile):
+    '''
+    TarFile writing the extracted files with large buffers
+    '''
+
+    def makefile(self, tarinfo, targetpath):
+        source = self.extractfile(tarinfo)
+        try:
+            with open(targetpath, 'wb', BUFFER_SIZE) as target:
+                shutil.copyfileobj(source, target, BUFFER_SIZE)
+        finally:
+            source.close()
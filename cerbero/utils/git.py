@@ -37,6 +37,43 @@ def init(git_dir):
     shell.call('%s init' % GIT, git_dir)
 
 
+def init_mirror(git_dir):
+    '''
+    Initialize a bare repository used to share the objects of a remote.
+    Its objects are never pruned, other repositories might need them.
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    '''
+    shell.call('mkdir -p %s' % git_dir)
+    shell.call('%s init --bare' % GIT, git_dir)
+    shell.call('%s config gc.auto 0' % GIT, git_dir)
+    shell.call('%s config gc.pruneExpire never' % GIT, git_dir)
+
+
+def add_alternate(git_dir, objects_dir):
+    '''
+    Adds a directory of objects shared with another repository to the
+    alternates of a repository
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param objects_dir: path of the objects directory to share
+    @type objects_dir: str
+    '''
+    info = os.path.join(git_dir, '.git', 'objects', 'info')
+    if not os.path.exists(info):
+        os.makedirs(info)
+    alternates = os.path.join(info, 'alternates')
+    lines = []
+    if os.path.exists(alternates):
+        with open(alternates, 'r') as f:
+            lines = f.read().splitlines()
+    if objects_dir not in lines:
+        with open(alternates, 'a') as f:
+            f.write('%s\n' % objects_dir)
+
+
 def clean(git_dir):
     '''
     Clean a git respository with clean -dfx
@@ -112,6 +149,23 @@ def fetch(git_dir, fail=True):
     return shell.call('%s fetch --all' % GIT, git_dir, fail=fail)
 
 
+def fetch_url(git_dir, url, refspec, fail=True):
+    '''
+    Fetch refs and tags from a url
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param url: url or path of the repository to fetch from
+    @type url: str
+    @param refspec: refspec mapping the remote refs to the local ones
+    @type refspec: str
+    @param fail: raise an error if the command failed
+    @type fail: false
+    '''
+    return shell.call("%s fetch --tags %s '%s'" % (GIT, url, refspec),
+                      git_dir, fail=fail)
+
+
 def checkout(git_dir, commit):
     '''
     Reset a git repository to a given commit
@@ -138,29 +192,66 @@ def get_hash(git_dir, commit):
                             (GIT, commit), git_dir)
 
 
-def local_checkout(git_dir, local_git_dir, commit):
+def local_update(git_dir, local_git_dir, commit):
     '''
-    Clone a repository for a given commit in a different location
+    Checks out a commit of a repository in a different location, sharing
+    its objects and without modifying its HEAD. If the location already has
+    a checkout, only the files that changed are rewritten and the untracked
+    files are kept.
 
     @param git_dir: destination path of the git repository
     @type git_dir: str
     @param local_git_dir: path of the source git repository
     @type local_git_dir: str
-    @param commit: the commit to checkout
-    @type commit: false
-    '''
-    # reset to a commit in case it's the first checkout and the masterbranch is
-    # missing
-    branch_name = 'cerbero_build'
-    shell.call('%s reset --hard %s' % (GIT, commit), local_git_dir)
-    shell.call('%s branch %s' % (GIT, branch_name), local_git_dir, fail=False)
-    shell.call('%s checkout %s' % (GIT, branch_name), local_git_dir)
-    shell.call('%s reset --hard %s' % (GIT, commit), local_git_dir)
-    return shell.call('%s clone %s -s -b %s .' % (GIT, local_git_dir,
-                                                  branch_name),
+    @param commit: hash of the commit to checkout
+    @type commit: str
+    '''
+    if not os.path.exists(os.path.join(git_dir, '.git')):
+        shell.call('mkdir -p %s' % git_dir)
+        shell.call('%s clone -s -n %s .' % (GIT, local_git_dir), git_dir)
+    elif os.path.exists(os.path.join(git_dir, '.git', 'rebase-apply')):
+        # The patches failed to apply the last time
+        shell.call('%s am --abort' % GIT, git_dir, fail=False)
+    # Files touched but not modified would be rewritten too otherwise
+    shell.call('%s update-index -q --refresh' % GIT, git_dir, fail=False)
+    return shell.call('%s checkout -f -q --detach %s' % (GIT, commit),
                       git_dir)
 
 
+def get_checkout_id(git_dir):
+    '''
+    Gets the id saved with L{set_checkout_id} for a checkout
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @return: the id, or None if the checkout doesn't have one
+    @rtype: str
+    '''
+    path = os.path.join(git_dir, '.git', 'cerbero-checkout')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def set_checkout_id(git_dir, checkout_id):
+    '''
+    Saves an id identifying the commit and the patches of a checkout
+
+    @param git_dir: path of the git repository
+    @type git_dir: str
+    @param checkout_id: the id, or None to remove it
+    @type checkout_id: str
+    '''
+    path = os.path.join(git_dir, '.git', 'cerbero-checkout')
+    if checkout_id is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'w') as f:
+        f.write(checkout_id)
+
+
 def add_remote(git_dir, name, url):
     '''
     Add a remote to a git repository
@@ -0,0 +1,172 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+Host-wide GNU make jobserver shared by all the running cerbero instances.
+
+The jobserver is a named FIFO filled with one token per build slot. The
+first cerbero instance creates and fills it, the next ones join it and the
+last one leaving removes it. Every make started by cerbero is told to use
+it through MAKEFLAGS, so all of them share the same slots budget instead of
+running with -j<cores> each.
+'''
+
+import os
+import errno
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+TOKEN = '+'
+
+_fds = None
+_path = None
+
+
+def supported():
+    ''' Whether the jobserver can be used on this platform '''
+    return fcntl is not None and hasattr(os, 'mkfifo')
+
+
+def start(path, slots):
+    '''
+    Creates or joins the host-wide jobserver
+
+    @param path: path of the jobserver FIFO
+    @type path: str
+    @param slots: number of jobs allowed when creating the jobserver
+    @type slots: int
+    @return: whether the jobserver could be started
+    @rtype: bool
+    '''
+    global _fds, _path
+    if _fds is not None:
+        return True
+    if not supported():
+        return False
+    try:
+        with _locked(path):
+            pids = [p for p in _read_pids(path) if _pid_alive(p)]
+            create = not pids or not os.path.exists(path)
+            if create:
+                if os.path.exists(path):
+                    os.remove(path)
+                os.mkfifo(path, 0600)
+            # Open it read-write so that it doesn't block without readers
+            # and tokens are not lost while there is at least one instance
+            fd_r = os.open(path, os.O_RDWR)
+            fd_w = os.open(path, os.O_RDWR)
+            if create:
+                # Every make already owns an implicit slot
+                os.write(fd_w, TOKEN * max(slots - 1, 0))
+            pids.append(os.getpid())
+            _write_pids(path, pids)
+    except (IOError, OSError), ex:
+        m.warning(_("Could not start the make jobserver %s: %s") %
+                  (path, ex))
+        return False
+    _fds = (fd_r, fd_w)
+    _path = path
+    if create:
+        m.message(_("Created make jobserver %s with %d slots") %
+                  (path, slots))
+    else:
+        m.message(_("Joined make jobserver %s") % path)
+    return True
+
+
+def stop():
+    '''
+    Leaves the jobserver, removing it if this was the last instance using it
+    '''
+    global _fds, _path
+    if _fds is None:
+        return
+    try:
+        with _locked(_path):
+            pids = [p for p in _read_pids(_path) if _pid_alive(p) and
+                    p != os.getpid()]
+            if pids:
+                _write_pids(_path, pids)
+            else:
+                for f in [_path, _pids_file(_path)]:
+                    if os.path.exists(f):
+                        os.remove(f)
+    except (IOError, OSError), ex:
+        m.warning(_("Could not leave the make jobserver %s: %s") %
+                  (_path, ex))
+    for fd in _fds:
+        os.close(fd)
+    _fds = None
+    _path = None
+
+
+def makeflags(jobs):
+    '''
+    Gets the MAKEFLAGS needed to use the jobserver, falling back to a fixed
+    number of jobs when it's not running
+
+    @param jobs: number of jobs to use without a jobserver
+    @type jobs: int
+    @return: the make flags
+    @rtype: str
+    '''
+    if _fds is None:
+        return '-j%d' % jobs
+    return '-j --jobserver-fds=%d,%d' % _fds
+
+
+def _pids_file(path):
+    return '%s.pids' % path
+
+
+def _read_pids(path):
+    try:
+        with open(_pids_file(path), 'r') as f:
+            return [int(x) for x in f.read().split()]
+    except (IOError, ValueError):
+        return []
+
+
+def _write_pids(path, pids):
+    with open(_pids_file(path), 'w') as f:
+        f.write(' '.join([str(x) for x in pids]))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+@contextmanager
+def _locked(path):
+    with open('%s.lock' % path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
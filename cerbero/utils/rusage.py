@@ -0,0 +1,96 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+Resources used by the commands run by each thread.
+
+The usage of the process children can't be split per step: RUSAGE_CHILDREN
+adds up the commands of all the threads, and its peak resident set size is
+a high-water mark over the whole life of the process. Instead, each command
+is waited for with wait4(), which reports the resources used by that child
+and the descendants it waited for, and they are added to the recording of
+the thread that ran it.
+'''
+
+import os
+import sys
+import errno
+import threading
+
+
+_recording = threading.local()
+
+
+def start_recording():
+    '''
+    Starts recording the resources used by the commands run by this thread
+    '''
+    if hasattr(os, 'wait4'):
+        _recording.usage = {'user': 0.0, 'sys': 0.0, 'maxrss': None}
+    else:
+        _recording.usage = None
+
+
+def stop_recording():
+    '''
+    Stops recording the resources used by the commands run by this thread
+
+    @return: the 'user' and 'sys' CPU times in seconds and the peak resident
+             set size in KB ('maxrss', None if no command was run) of the
+             commands run since the recording started, or None if it was not
+             started or the platform doesn't support it
+    @rtype: dict
+    '''
+    usage = getattr(_recording, 'usage', None)
+    _recording.usage = None
+    return usage
+
+
+def wait(process):
+    '''
+    Waits for a process started with subprocess.Popen, adding the resources
+    it used to the recording of this thread
+
+    @param process: the process
+    @type process: L{subprocess.Popen}
+    @return: the return code of the process
+    @rtype: int
+    '''
+    if not hasattr(os, 'wait4') or process.returncode is not None:
+        return process.wait()
+    while True:
+        try:
+            pid, status, ru = os.wait4(process.pid, 0)
+            break
+        except OSError, ex:
+            if ex.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    usage = getattr(_recording, 'usage', None)
+    if usage is not None:
+        maxrss = ru.ru_maxrss
+        if sys.platform == 'darwin':
+            # reported in bytes instead of KB
+            maxrss /= 1024
+        usage['user'] += ru.ru_utime
+        usage['sys'] += ru.ru_stime
+        usage['maxrss'] = max(usage['maxrss'], maxrss)
+    return process.returncode
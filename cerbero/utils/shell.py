@@ -21,17 +21,17 @@ import subprocess
 import shlex
 import sys
 import os
-import tarfile
-import zipfile
 import tempfile
 import time
 import glob
 import shutil
 import hashlib
+import threading
 
 from cerbero.enums import Platform
 from cerbero.utils import _, system_info, to_unixpath
 from cerbero.utils import messages as m
+from cerbero.utils import downloader, extractor, rusage
 from cerbero.errors import FatalError
 
 
@@ -40,9 +40,28 @@ TAR = 'tar'
 
 
 PLATFORM = system_info()[0]
-LOGFILE = None  # open('/tmp/cerbero.log', 'w+')
 DRY_RUN = False
 
+# Log files are per-thread so that background jobs log to their own file
+_LOG = threading.local()
+# Environment of the commands run without an explicit one, per-thread too
+_ENV = threading.local()
+
+
+def _logfile():
+    return getattr(_LOG, 'file', None)
+
+
+def set_call_env(env):
+    '''
+    Sets the environment of the commands run by this thread without an
+    explicit one
+
+    @param env: the environment, or None to use os.environ
+    @type env: L{cerbero.utils.env.Environment}
+    '''
+    _ENV.env = env
+
 
 def set_logfile_output(location):
     '''
@@ -54,11 +73,10 @@ def set_logfile_output(location):
     if PLATFORM == Platform.WINDOWS:
         # silently return.
         return
-    global LOGFILE
-    if not LOGFILE is None:
+    if not _logfile() is None:
         raise Exception("Logfile was already open. Forgot to call "
                         "close_logfile_output() ?")
-    LOGFILE = open(location, "w+")
+    _LOG.file = open(location, "w+")
 
 
 def close_logfile_output(dump=False):
@@ -71,23 +89,23 @@ def close_logfile_output(dump=False):
     if PLATFORM == Platform.WINDOWS:
         # silently return.
         return
-    global LOGFILE
-    if LOGFILE is None:
+    logfile = _logfile()
+    if logfile is None:
         raise Exception("No logfile was open")
     if dump:
-        LOGFILE.seek(0)
+        logfile.seek(0)
         while True:
-            data = LOGFILE.read()
+            data = logfile.read()
             if data:
                 print data
             else:
                 break
     # if logfile is empty, remove it
-    pos = LOGFILE.tell()
-    LOGFILE.close()
+    pos = logfile.tell()
+    logfile.close()
     if pos == 0:
-        os.remove(LOGFILE.name)
-    LOGFILE = None
+        os.remove(logfile.name)
+    _LOG.file = None
 
 
 class StdOut:
@@ -113,7 +131,7 @@ def _fix_mingw_cmd(path):
     return ''.join(l_path)
 
 
-def call(cmd, cmd_dir='.', fail=True):
+def call(cmd, cmd_dir='.', fail=True, env=None):
     '''
     Run a shell command
 
@@ -123,10 +141,18 @@ def call(cmd, cmd_dir='.', fail=True):
     @param cmd_dir: str
     @param fail: wheter to raise an exception if the command failed or not
     @type fail: bool
+    @param env: environment for the command, defaults to the one set with
+                L{set_call_env} or os.environ
+    @type env: dict or L{cerbero.utils.env.Environment}
     '''
+    if env is None:
+        env = getattr(_ENV, 'env', None)
+    if env is None:
+        env = os.environ
+    logfile = _logfile()
     try:
-        if not LOGFILE is None:
-            LOGFILE.write("Running command '%s'\n" % cmd)
+        if not logfile is None:
+            logfile.write("Running command '%s'\n" % cmd)
         else:
             m.message("Running command '%s'" % cmd)
         shell = True
@@ -140,16 +166,20 @@ def call(cmd, cmd_dir='.', fail=True):
             cmd = _fix_mingw_cmd(cmd)
             # Disable shell which uses cmd.exe
             shell = False
-        stream = LOGFILE or sys.stdout
+        stream = logfile or sys.stdout
         if DRY_RUN:
             # write to sdterr so it's filtered more easilly
             m.error("cd %s && %s && cd %s" % (cmd_dir, cmd, os.getcwd()))
             ret = 0
         else:
-            ret = subprocess.check_call(cmd, cwd=cmd_dir,
+            process = subprocess.Popen(cmd, cwd=cmd_dir,
                                        stderr=subprocess.STDOUT,
                                        stdout=StdOut(stream),
-                                       env=os.environ.copy(), shell=shell)
+                                       env=dict(env),
+                                       shell=shell)
+            ret = rusage.wait(process)
+            if ret != 0:
+                raise subprocess.CalledProcessError(ret, cmd)
     except subprocess.CalledProcessError:
         if fail:
             raise FatalError(_("Error running command: %s") % cmd)
@@ -189,7 +219,7 @@ def apply_patch(patch, directory, strip=1):
     call('%s -p%s -f -i %s' % (PATCH, strip, patch), directory)
 
 
-def unpack(filepath, output_dir):
+def unpack(filepath, output_dir, rename=None):
     '''
     Extracts a tarball
 
@@ -197,55 +227,51 @@ def unpack(filepath, output_dir):
     @type filepath: str
     @param output_dir: output directory
     @type output_dir: str
+    @param rename: top-level directory of the tarball and the path
+                   relative to output_dir where it's extracted instead
+    @type rename: tuple
     '''
     logging.info("Unpacking %s in %s" % (filepath, output_dir))
-    if filepath.endswith('tar.gz') or filepath.endswith('tar.bz2') \
-       or filepath.endswith('tbz2') or filepath.endswith('tgz'):
-        tf = tarfile.open(filepath, mode='r:*')
-        tf.extractall(path=output_dir)
-    elif filepath.endswith('tar.xz'):
-        call("%s -Jxf %s" % (TAR, to_unixpath(filepath)), output_dir)
-    elif filepath.endswith('.zip'):
-        zf = zipfile.ZipFile(filepath, "r")
-        zf.extractall(path=output_dir)
-    else:
-        raise FatalError("Unknown tarball format %s" % filepath)
+    extractor.extract(filepath, output_dir, rename)
 
 
-def download(url, destination=None, recursive=False, check_cert=True):
+def download(url, destination=None, recursive=False, check_cert=True,
+             sha256=None):
     '''
-    Downloads a file with wget
+    Downloads a file in-process, or with wget for recursive downloads
 
     @param url: url to download
     @type: str
     @param destination: destination where the file will be saved
     @type destination: str
+    @param sha256: expected sha256 checksum of the file
+    @type sha256: str
     '''
-    cmd = "wget %s " % url
-    path = None
-    if recursive:
-        cmd += "-r "
-        path = destination
-    else:
-        if destination is not None:
-            cmd += "-O %s " % destination
+    if not recursive:
+        if destination is None:
+            destination = os.path.basename(url)
+        logfile = _logfile()
+        if os.path.exists(destination) and (sha256 is None or
+                downloader.file_sha256(destination) == sha256):
+            if logfile is None:
+                m.action(_("File %s already downloaded.") % destination)
+            return
+        if logfile:
+            logfile.write("Downloading %s\n" % url)
+        else:
+            m.action(_("Downloading %s") % url)
+        downloader.download(url, destination, sha256, check_cert)
+        return
 
+    cmd = "wget %s -r " % url
     if not check_cert:
         cmd += " --no-check-certificate"
-
-    if not recursive and os.path.exists(destination):
-        if LOGFILE is None:
-            logging.info("File %s already downloaded." % destination)
+    logfile = _logfile()
+    if logfile:
+        logfile.write("Downloading %s\n" % url)
     else:
-        if LOGFILE:
-            LOGFILE.write("Downloading %s\n" % url)
-        else:
-            logging.info("Downloading %s", url)
-        try:
-            call(cmd, path)
-        except FatalError, e:
-            os.remove(destination)
-            raise e
+        logging.info("Downloading %s", url)
+    call(cmd, destination)
 
 
 def download_curl(url, destination=None, recursive=False, check_cert=True):
@@ -0,0 +1,162 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.config import Variants
+from cerbero.build.binarycache import BinaryCache
+from cerbero.utils.env import Environment
+from test.test_common import DummyConfig
+from test.test_build_common import Recipe1
+
+
+class Config(DummyConfig):
+
+    def __init__(self):
+        self.variants = Variants([])
+        self.config_files = []
+        self.prefix = '/opt/cerbero'
+        self.build_tools_prefix = '/opt/cerbero-build-tools'
+        self.env = {'CFLAGS': '-O2', 'PWD': '/', 'HOME': '/home/user',
+                    'PATH': '/opt/cerbero-build-tools/bin:/usr/bin:/bin'}
+
+    def get_build_env(self):
+        return Environment(self.env)
+
+
+class BinaryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'prefix')
+        os.makedirs(os.path.join(self.prefix, 'lib'))
+        self.cache = BinaryCache(os.path.join(self.tmp, 'cache'), 1024 * 1024)
+        self.config = Config()
+        self.recipe = Recipe1(self.config)
+        self.recipe.__file__ = os.path.join(self.tmp, 'recipe1.recipe')
+        self.recipe.built_version = lambda: '1.0'
+        with open(self.recipe.__file__, 'w') as f:
+            f.write('recipe1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, filename, size):
+        with open(os.path.join(self.prefix, filename), 'w') as f:
+            f.write('a' * size)
+
+    def testKey(self):
+        key = self.cache.recipe_key(self.recipe, self.config, ['dep'])
+        self.assertEquals(key, self.cache.recipe_key(self.recipe, self.config,
+                                                     ['dep']))
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, ['dep2']))
+        self.config.variants.gi = True
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, ['dep']))
+        self.config.variants.gi = False
+        with open(self.recipe.__file__, 'w') as f:
+            f.write('recipe1 modified')
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, ['dep']))
+        key = self.cache.recipe_key(self.recipe, self.config, ['dep'])
+        custom = os.path.join(self.tmp, 'custom.py')
+        with open(custom, 'w') as f:
+            f.write('custom')
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, ['dep'], custom))
+
+    def testKeyConfigFilesAndEnv(self):
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        config_file = os.path.join(self.tmp, 'local.cbc')
+        with open(config_file, 'w') as f:
+            f.write("prefix = '/opt'")
+        self.config.config_files.append(config_file)
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        with open(config_file, 'w') as f:
+            f.write("prefix = '/opt'\nallow_parallel_build = True")
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        self.config.env['CFLAGS'] = '-O0'
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        self.config.env['ac_cv_func_malloc_0_nonnull'] = 'yes'
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        self.config.env['PATH'] = '/opt/cerbero/bin:' + self.config.env['PATH']
+        self.assertNotEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+        # The variables of the user, the machine or the session are ignored
+        key = self.cache.recipe_key(self.recipe, self.config, [])
+        self.config.env['PWD'] = '/tmp'
+        self.config.env['HOME'] = '/home/builder'
+        self.config.env['BUILD_ID'] = '42'
+        self.config.env['PATH'] = self.config.env['PATH'].replace('/usr/bin',
+                '/home/builder/bin:/usr/local/bin')
+        self.assertEquals(key, self.cache.recipe_key(self.recipe,
+                self.config, []))
+
+    def testStoreRestore(self):
+        self._write('lib/libfoo.so.1', 10)
+        os.symlink('libfoo.so.1', os.path.join(self.prefix, 'lib/libfoo.so'))
+        self.assertFalse(self.cache.lookup('abcd'))
+        self.cache.store('abcd', self.prefix, ['lib/libfoo.so.1',
+                                               'lib/libfoo.so'])
+        self.assertTrue(self.cache.lookup('abcd'))
+        shutil.rmtree(self.prefix)
+        self.assertEquals(sorted(self.cache.restore('abcd', self.prefix)),
+                          ['lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertTrue(os.path.islink(
+            os.path.join(self.prefix, 'lib/libfoo.so')))
+        with open(os.path.join(self.prefix, 'lib/libfoo.so')) as f:
+            self.assertEquals(f.read(), 'a' * 10)
+
+    def testRestoreOutsidePrefix(self):
+        os.symlink('../../outside', os.path.join(self.prefix, 'lib/link'))
+        self.cache.store('abcd', self.prefix, ['lib/link'])
+        shutil.rmtree(self.prefix)
+        self.assertEquals(self.cache.restore('abcd', self.prefix), None)
+        self.assertFalse(os.path.lexists(
+            os.path.join(self.prefix, 'lib/link')))
+
+    def testEviction(self):
+        # Random data that can't be compressed
+        for i, key in enumerate(['aa01', 'bb02', 'cc03']):
+            with open(os.path.join(self.prefix, 'file'), 'wb') as f:
+                f.write(os.urandom(400 * 1024))
+            self.cache.store(key, self.prefix, ['file'])
+            path = self.cache._archive_path(key)
+            os.utime(path, (i, i))
+            if key == 'bb02':
+                # Restoring it refreshes it
+                self.cache.restore('aa01', self.prefix)
+        # Archives are only evicted when requested, once per build
+        for key in ['aa01', 'bb02', 'cc03']:
+            self.assertTrue(self.cache.lookup(key))
+        self.cache.evict()
+        self.assertTrue(self.cache.lookup('aa01'))
+        self.assertFalse(self.cache.lookup('bb02'))
+        self.assertTrue(self.cache.lookup('cc03'))
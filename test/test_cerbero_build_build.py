@@ -34,14 +34,18 @@ class MakefilesBase(build.MakefilesBase):
 
     @build.modify_environment
     def get_env_var(self, var):
-        if var not in os.environ:
+        if var not in self.env:
             return None
-        return os.environ[var]
+        return self.env[var]
 
     @build.modify_environment
     def get_env_var_nested(self, var):
         return self.get_env_var(var)
 
+    @build.modify_environment
+    def get_make_env_var(self, var):
+        return self._make_env().get(var)
+
 
 class ModifyEnvTest(unittest.TestCase):
 
@@ -95,3 +99,19 @@ class ModifyEnvTest(unittest.TestCase):
         self.assertEquals(val, "%s %s" % (self.val1, self.val2))
         val = self.mk.get_env_var_nested(self.var)
         self.assertEquals(val, "%s %s" % (self.val1, self.val2))
+
+    def testEnvironNotModified(self):
+        os.environ[self.var] = self.val1
+        self.mk.append_env = {self.var: self.val2}
+        self.mk.get_env_var(self.var)
+        self.assertEquals(os.environ[self.var], self.val1)
+        self.assertIsNone(self.mk.env)
+
+    def testMakeflags(self):
+        os.environ['MAKEFLAGS'] = '-k'
+        self.mk._use_jobserver = True
+        try:
+            self.assertEquals(self.mk.get_make_env_var('MAKEFLAGS'),
+                              '-k -j%d' % self.mk.config.num_of_cpus)
+        finally:
+            del os.environ['MAKEFLAGS']
@@ -16,23 +16,34 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
 import unittest
 import tempfile
 import pickle
+import shutil
 
-from cerbero.build.cookbook import CookBook
-from cerbero.errors import RecipeNotFoundError
+from cerbero.config import Architecture, Variants
+from cerbero.build.cookbook import CookBook, RecipeStatus
+from cerbero.build.recipe import Recipe
+from cerbero.build.manifest import Manifest
+from cerbero.build.statusstore import StatusStore
+from cerbero.errors import RecipeNotFoundError, FatalError, \
+    InvalidRecipeError
 from test.test_common import DummyConfig as Config
-from test.test_build_common import Recipe1
+from test.test_build_common import Recipe1, Recipe2, Recipe3, Recipe4
 
 
 class PackageTest(unittest.TestCase):
 
     def setUp(self):
         self.config = Config()
-        self.config.cache_file = '/dev/null'
+        self.config.home_dir = tempfile.mkdtemp()
+        self.config.cache_file = 'cache'
         self.cookbook = CookBook(self.config, False)
 
+    def tearDown(self):
+        shutil.rmtree(self.config.home_dir)
+
     def testSetGetConfig(self):
         self.assertEquals(self.config, self.cookbook.get_config())
         self.cookbook.set_config(None)
@@ -45,23 +56,28 @@ class PackageTest(unittest.TestCase):
         self.assertEquals(self.cookbook.status, {})
 
     def testSaveCache(self):
-        tmp = tempfile.NamedTemporaryFile()
         status = {'test': 'test'}
         self.cookbook.set_status(status)
-        self.cookbook.get_config().cache_file = tmp.name
         self.cookbook.save()
-        with open(self.cookbook._cache_file(self.config), 'rb') as f:
-            loaded_status = pickle.load(f)
-            self.assertEquals(status, loaded_status)
+        cache_file = self.cookbook._cache_file(self.config)
+        store = StatusStore(StatusStore.db_path(cache_file))
+        self.assertEquals(status, store.load())
 
     def testLoad(self):
-        tmp = tempfile.NamedTemporaryFile()
         status = {'test': 'test'}
-        self.cookbook.get_config().cache_file = tmp.name
-        with open(tmp.name, 'wb') as f:
+        cache_file = self.cookbook._cache_file(self.config)
+        with open(cache_file, 'wb') as f:
             pickle.dump(status, f)
         self.cookbook._restore_cache()
         self.assertEquals(status, self.cookbook.status)
+        # The old pickle cache is imported only once
+        with open(cache_file, 'wb') as f:
+            pickle.dump({'test2': 'test2'}, f)
+        self.cookbook._store.save('test3', 'test3')
+        cookbook = CookBook(self.config, False)
+        cookbook._restore_cache()
+        self.assertEquals({'test': 'test', 'test3': 'test3'},
+                          cookbook.status)
 
     def testAddGetRecipe(self):
         recipe = Recipe1(self.config)
@@ -121,3 +137,274 @@ class PackageTest(unittest.TestCase):
         status = self.cookbook._recipe_status(recipe.name)
         self.assertEquals(status.steps, [])
         self.assertTrue(self.cookbook.status[recipe.name].needs_build)
+
+    def testTimingsHistory(self):
+        status = RecipeStatus('/dev/null', steps=[])
+        for i in range(RecipeStatus.TIMINGS_HISTORY + 2):
+            status.add_timing('compile', {'wall': i})
+        history = status.timings['compile']
+        self.assertEquals(len(history), RecipeStatus.TIMINGS_HISTORY)
+        self.assertEquals(history[0]['wall'], 2)
+        self.assertEquals(history[-1]['wall'],
+                          RecipeStatus.TIMINGS_HISTORY + 1)
+
+    def testRecentActivity(self):
+        recipe = Recipe1(self.config)
+        recipe.__file__ = '/dev/null'
+        self.cookbook.add_recipe(recipe)
+        self.cookbook._restore_cache()
+        self.assertEquals(self.cookbook.recipe_recent_activity(recipe.name), 0)
+        self.cookbook.update_failure_status(recipe.name)
+        last = self.cookbook.recipe_recent_activity(recipe.name)
+        self.assertTrue(last > 0)
+        # The failure is kept when the status is reset
+        self.cookbook.reset_recipe_status(recipe.name)
+        self.assertEquals(self.cookbook.recipe_recent_activity(recipe.name),
+                          last)
+        self.cookbook.status[recipe.name].last_failure -= \
+            CookBook.RECENT_PERIOD + 1
+        self.assertEquals(self.cookbook.recipe_recent_activity(recipe.name), 0)
+
+    def _add_recipes(self, deps):
+        self.config.variants = Variants([])
+        recipes = [Recipe1, Recipe2, Recipe3, Recipe4]
+        for recipe_class in recipes:
+            recipe = recipe_class(self.config)
+            recipe.deps = deps.get(recipe.name, [])
+            recipe.__file__ = '/dev/null'
+            self.cookbook.add_recipe(recipe)
+
+    def testDepsGraph(self):
+        self._add_recipes({'recipe1': ['recipe3', 'recipe2'],
+                           'recipe2': ['recipe4'],
+                           'recipe3': ['recipe4']})
+        deps = [r.name for r in self.cookbook.list_recipe_deps('recipe1')]
+        self.assertEquals(deps, ['recipe4', 'recipe3', 'recipe2', 'recipe1'])
+        self.assertEquals(self.cookbook.list_recipe_build_deps('recipe1'),
+                          ['recipe3', 'recipe2'])
+        rdeps = self.cookbook.list_recipe_reverse_deps('recipe4')
+        self.assertEquals(sorted([r.name for r in rdeps]),
+                          ['recipe2', 'recipe3'])
+        rdeps = self.cookbook.list_recipe_reverse_deps('recipe4',
+                                                       recursive=True)
+        self.assertEquals([r.name for r in rdeps][-1], 'recipe1')
+        self.assertEquals(len(rdeps), 3)
+        rdeps = self.cookbook.list_recipes_reverse_deps(['recipe3',
+                                                         'recipe4'])
+        self.assertEquals(sorted([r.name for r in rdeps]),
+                          ['recipe1', 'recipe2'])
+        # The graph is updated when a recipe is added
+        recipe = Recipe4(self.config)
+        recipe.deps = ['recipe5']
+        self.cookbook.add_recipe(recipe)
+        self.failUnlessRaises(FatalError, self.cookbook.list_recipe_deps,
+                              'recipe1')
+
+    def testBuildRdeps(self):
+        self._add_recipes({'recipe1': ['recipe2'],
+                           'recipe2': ['recipe3']})
+        self.assertEquals(self.cookbook.list_recipe_build_rdeps('recipe3'),
+                          ['recipe2', 'recipe1'])
+        self.assertEquals(self.cookbook.list_recipe_build_rdeps('recipe1'),
+                          [])
+        # All the recipes depend on the runtime dependencies
+        self.cookbook.get_recipe('recipe4').runtime_dep = True
+        self.cookbook._graph = None
+        self.assertEquals(
+            sorted(self.cookbook.list_recipe_build_rdeps('recipe4')),
+            ['recipe1', 'recipe2', 'recipe3'])
+
+    def testDepsCycle(self):
+        self._add_recipes({'recipe1': ['recipe2'],
+                           'recipe2': ['recipe3'],
+                           'recipe3': ['recipe2']})
+        self.failUnlessRaises(FatalError, self.cookbook.list_recipe_deps,
+                              'recipe1')
+        self.assertEquals(self.cookbook._get_graph().cycles,
+                          set(['recipe2', 'recipe3']))
+        deps = [r.name for r in self.cookbook.list_recipe_deps('recipe4')]
+        self.assertEquals(deps, ['recipe4'])
+
+    def testDepsFingerprints(self):
+        self._add_recipes({'recipe1': ['recipe2'],
+                           'recipe2': ['recipe3']})
+        self.cookbook._restore_cache()
+        for name in ['recipe3', 'recipe2', 'recipe1']:
+            self.cookbook.update_build_status(name, '1.0')
+        self.assertFalse(self.cookbook.recipe_needs_build('recipe1'))
+        # Rebuilding the same version doesn't change the fingerprint
+        self.cookbook.reset_recipe_status('recipe2')
+        self.cookbook.update_build_status('recipe2', '1.0')
+        self.assertFalse(self.cookbook.recipe_needs_build('recipe1'))
+        # A new version of recipe3 invalidates the recipes depending on it
+        self.cookbook.update_build_status('recipe3', '2.0')
+        self.assertEquals(self.cookbook.recipe_deps_changed('recipe2'),
+                          ['recipe3'])
+        self.assertTrue(self.cookbook.recipe_needs_build('recipe2'))
+        self.assertFalse(self.cookbook.recipe_needs_build('recipe1'))
+        self.cookbook.update_build_status('recipe2', '1.0')
+        self.assertFalse(self.cookbook.recipe_needs_build('recipe2'))
+        self.assertTrue(self.cookbook.recipe_needs_build('recipe1'))
+
+    def testNewRecipeIsolated(self):
+        self.config.variants = Variants([])
+        recipe1 = self.cookbook._new_recipe(Recipe1, self.config, True)
+        recipe2 = self.cookbook._new_recipe(Recipe1, self.config, True)
+        recipe1.files_libs.append('libfoo')
+        recipe1.platform_files_libs.values()[0].append('libfoo')
+        self.assertEquals(recipe2.files_libs, Recipe1.files_libs)
+        self.assertEquals(recipe2.platform_files_libs,
+                          Recipe1.platform_files_libs)
+        self.assertFalse('libfoo' in Recipe1.files_libs)
+
+    def testInstallManifest(self):
+        self.assertIsNone(self.cookbook.get_install_manifest('recipe1'))
+        self.cookbook.update_install_manifest('recipe1',
+                Manifest({'lib/libfoo.so': (None, None, 'libfoo.so.1'),
+                          'lib/libfoo.so.1': (3, 'abcd', None)}))
+        self.cookbook.update_install_manifest('recipe1',
+                Manifest({'lib/foo.cache': (1, 'ef', None)}), replace=False)
+        self.assertEquals(self.cookbook.list_file_recipes('lib/libfoo.so.1'),
+                          ['recipe1'])
+        self.cookbook.update_install_manifest('recipe2',
+                Manifest({'lib/foo.cache': (1, 'ef', None)}))
+        manifest = self.cookbook.get_install_manifest('recipe1')
+        self.assertEquals(manifest.files['lib/libfoo.so.1'], (3, 'abcd', None))
+        self.assertEquals(self.cookbook.get_install_manifest('recipe1',
+                shared=False).files_list(), ['lib/libfoo.so',
+                'lib/libfoo.so.1'])
+        self.assertEquals(manifest.files_list(), ['lib/foo.cache',
+                          'lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertTrue(manifest.exact)
+        self.cookbook.update_install_manifest('recipe2',
+                Manifest({'lib/foo.cache': (1, 'ef', None)}, exact=False))
+        self.assertFalse(self.cookbook.get_install_manifest('recipe2').exact)
+        self.cookbook.update_install_manifest('recipe1',
+                Manifest({'lib/foo.cache': (1, 'ef', None)}))
+        self.assertEquals(self.cookbook.list_file_recipes('lib/libfoo.so.1'),
+                          [])
+
+
+RECIPE_TPL = '''
+with open(%(log)r, 'a') as f:
+    f.write('%(name)s\\n')
+
+class Recipe(recipe.Recipe):
+    name = '%(name)s'
+    version = '%(version)s'
+    deps = %(deps)r
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+'''
+
+
+class LoadConfig(Config):
+
+    arch = None
+    distro = None
+    distro_version = None
+    cache_file = 'cache'
+
+    def __init__(self, tmp):
+        self.home_dir = tmp
+        self.recipes_dir = os.path.join(tmp, 'recipes')
+        self.variants = Variants([])
+        self.arch_config = {self.target_arch: self}
+
+    def get_recipes_repos(self):
+        return {'default': (self.recipes_dir, 0)}
+
+
+class UniversalLoadConfig(LoadConfig):
+
+    target_arch = Architecture.UNIVERSAL
+
+    def __init__(self, tmp):
+        LoadConfig.__init__(self, tmp)
+        self.arch_config = {}
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            self.arch_config[arch] = LoadConfig(tmp)
+            self.arch_config[arch].target_arch = arch
+
+
+INVALID_ARCH_TPL = RECIPE_TPL + '''
+    def prepare(self):
+        if self.config.target_arch == Architecture.X86:
+            raise InvalidRecipeError(self.name, 'x86 is not supported')
+'''
+
+
+class LazyLoadTest(unittest.TestCase):
+
+    RECIPES = [('a', '1.0', ['b', 'c']), ('b', '2.0', ['c']),
+               ('c', '3.0', [])]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = LoadConfig(self.tmp)
+        self.log = os.path.join(self.tmp, 'loaded')
+        os.makedirs(self.config.recipes_dir)
+        for name, version, deps in self.RECIPES:
+            path = os.path.join(self.config.recipes_dir, '%s.recipe' % name)
+            with open(path, 'w') as f:
+                f.write(RECIPE_TPL % {'log': self.log, 'name': name,
+                                      'version': version, 'deps': deps})
+        # The first load executes all the recipe files to create the index
+        CookBook(self.config)
+        self.assertEquals(self.loaded(), ['a', 'b', 'c'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def loaded(self):
+        '''
+        Gets the recipe files executed since the last call
+        '''
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            loaded = f.read().split()
+        os.remove(self.log)
+        return sorted(loaded)
+
+    def testMetadataOnly(self):
+        cookbook = CookBook(self.config, metadata_only=True)
+        recipes = cookbook.get_recipes_list()
+        self.assertEquals([(r.name, r.version) for r in recipes],
+                          [('a', '1.0'), ('b', '2.0'), ('c', '3.0')])
+        self.assertEquals([r.name for r in cookbook.list_recipe_deps('a')],
+                          ['c', 'b', 'a'])
+        self.assertEquals(cookbook.list_recipe_build_deps('b'), ['c'])
+        self.assertEquals(cookbook.get_recipe('a').list_deps(), ['b', 'c'])
+        self.assertEquals(self.loaded(), [])
+
+    def testLoadOnFirstAccess(self):
+        cookbook = CookBook(self.config)
+        self.assertEquals(self.loaded(), [])
+        self.assertEquals([r.name for r in cookbook.list_recipe_deps('b')],
+                          ['c', 'b'])
+        self.assertEquals(self.loaded(), ['b', 'c'])
+        recipe = cookbook.get_recipe('a')
+        self.assertTrue(isinstance(recipe, Recipe))
+        self.assertEquals(recipe.version, '1.0')
+        self.assertEquals(self.loaded(), ['a'])
+        self.assertTrue(cookbook.get_recipe('a') is recipe)
+        self.assertEquals(self.loaded(), [])
+
+    def testInvalidArch(self):
+        config = UniversalLoadConfig(self.tmp)
+        path = os.path.join(config.recipes_dir, 'd.recipe')
+        with open(path, 'w') as f:
+            f.write(INVALID_ARCH_TPL % {'log': self.log, 'name': 'd',
+                                        'version': '1.0', 'deps': []})
+        # The recipe is still invalid when its metadata comes from the index
+        for loaded in [['a', 'b', 'c', 'd'], []]:
+            cookbook = CookBook(config, metadata_only=True)
+            self.assertEquals(self.loaded(), loaded)
+            try:
+                cookbook.get_recipe('d')
+                self.fail('The recipe is not invalid')
+            except InvalidRecipeError, e:
+                self.assertTrue('x86 is not supported' in str(e))
+            self.assertEquals([r.name for r in cookbook.get_recipes_list()],
+                              ['a', 'b', 'c'])
@@ -0,0 +1,133 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cerbero.build.fetcher import BackgroundFetcher, recipe_host
+
+
+class Config(object):
+
+    def __init__(self, logs):
+        self.logs = logs
+
+
+class Recipe(object):
+
+    def __init__(self, name, url, config, counter):
+        self.name = name
+        self.url = url
+        self.config = config
+        self.counter = counter
+
+    def __str__(self):
+        return self.name
+
+    def fetch(self):
+        self.counter.enter(recipe_host(self))
+        time.sleep(0.05)
+        self.counter.leave(recipe_host(self))
+        if self.name == 'fail':
+            raise Exception('fail')
+
+    def built_version(self):
+        self.version_thread = threading.current_thread()
+        return '%s-1.0' % self.name
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def enter(self, host):
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.max_running[host] = max(self.max_running.get(host, 0),
+                                         self.running[host])
+
+    def leave(self, host):
+        with self.lock:
+            self.running[host] -= 1
+
+
+class BackgroundFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config(self.tmp)
+        self.counter = Counter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _recipe(self, name, url):
+        return Recipe(name, url, self.config, self.counter)
+
+    def testHostJobs(self):
+        recipes = [self._recipe('a%d' % i, 'http://a.org/%d.tar.xz' % i)
+                   for i in range(4)]
+        recipes += [self._recipe('b%d' % i, 'http://b.org/%d.tar.xz' % i)
+                    for i in range(2)]
+        recipes.append(self._recipe('fail', 'http://b.org/fail.tar.xz'))
+        fetcher = BackgroundFetcher(recipes, 4, 1)
+        fetcher.start()
+        for recipe in recipes[:-1]:
+            self.assertTrue(fetcher.wait(recipe.name))
+        self.assertFalse(fetcher.wait('fail'))
+        fetcher.stop()
+        self.assertEquals(self.counter.max_running,
+                          {'a.org': 1, 'b.org': 1})
+
+    def testVersions(self):
+        recipes = [self._recipe('a', 'http://a.org/a.tar.xz'),
+                   self._recipe('b', 'http://b.org/b.tar.xz'),
+                   self._recipe('fail', 'http://b.org/fail.tar.xz')]
+        fetcher = BackgroundFetcher(recipes, 3, versions=True)
+        fetcher.start()
+        # Waiting claims the recipes that were not started yet
+        time.sleep(0.1)
+        for recipe in recipes:
+            fetcher.wait(recipe.name)
+        fetcher.stop()
+        self.assertEquals(fetcher.versions, {'a': 'a-1.0', 'b': 'b-1.0'})
+        for recipe in recipes[:2]:
+            self.assertNotEquals(recipe.version_thread,
+                                 threading.current_thread())
+
+        fetcher = BackgroundFetcher(recipes[:1])
+        fetcher.start()
+        time.sleep(0.1)
+        self.assertTrue(fetcher.wait('a'))
+        fetcher.stop()
+        self.assertEquals(fetcher.versions, {})
+
+    def testRecipeHost(self):
+        self.assertEquals(recipe_host(self._recipe('a',
+                          'https://ftp.gnome.org/pub/a.tar.xz')),
+                          'ftp.gnome.org')
+        self.assertEquals(recipe_host(self._recipe('a',
+                          'git@github.com:GStreamer/gstreamer.git')),
+                          'github.com')
+        self.assertEquals(recipe_host(self._recipe('a', None)), None)
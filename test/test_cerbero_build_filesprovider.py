@@ -20,7 +20,7 @@ import shutil
 import unittest
 import tempfile
 
-from cerbero.build import filesprovider
+from cerbero.build import filesprovider, prefixindex
 from cerbero.config import Platform, License
 from test.test_build_common import add_files
 from test.test_common import DummyConfig
@@ -115,3 +115,23 @@ class PackageTest(unittest.TestCase):
         add_files(self.tmp)
         self.assertEquals(self.win32recipe.files_list(), sorted(win32files))
         self.assertEquals(self.linuxrecipe.files_list(), sorted(linuxfiles))
+
+    def testFilesCache(self):
+        self.assertEquals(self.linuxrecipe.files_list_by_category('libs'), [])
+        add_files(self.tmp)
+        # Cached until new files are installed in the prefix
+        self.assertEquals(self.linuxrecipe.files_list_by_category('libs'), [])
+        prefixindex.invalidate()
+        self.assertEquals(self.linuxrecipe.files_list_by_category('libs'),
+                sorted(self.linuxlib))
+
+    def testCategoryAttributes(self):
+        self.linuxrecipe.files_plugins_libs = ['lib/gstreamer-0.10/libgstfoo']
+        self.assertEquals(sorted(['bins', 'libs', 'misc', 'devel',
+                                  'plugins_libs']),
+                          self.linuxrecipe._files_categories())
+        self.assertEquals(self.linuxrecipe._get_category_files_list('libs'),
+                          ['libgstreamer-0.10', 'lib/gstreamer-0.10/libgstfoo',
+                           'libgstreamer-x11'])
+        self.assertEquals(sorted(['bins', 'libs', 'misc', 'devel']),
+                          self.win32recipe._files_categories())
@@ -0,0 +1,105 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from cerbero.build import manifest
+from cerbero.build.manifest import Manifest
+from cerbero.errors import FatalError
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'prefix')
+        self._write(self.prefix, 'lib/libfoo.so.1', 'foo')
+        os.symlink('libfoo.so.1', os.path.join(self.prefix, 'lib/libfoo.so'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, root, filename, content):
+        path = os.path.join(root, filename)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def testFromDir(self):
+        m = Manifest.from_dir(self.prefix)
+        self.assertEquals(m.files_list(), ['lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertEquals(m.files['lib/libfoo.so.1'],
+                          (3, hashlib.sha256('foo').hexdigest(), None))
+        self.assertEquals(m.files['lib/libfoo.so'],
+                          (None, None, 'libfoo.so.1'))
+        m = Manifest.from_dir(self.prefix, ['lib/libfoo.so.1', 'missing'])
+        self.assertEquals(m.files_list(), ['lib/libfoo.so.1'])
+        self.assertEquals(m.prefixed('x86').files_list(),
+                          ['x86/lib/libfoo.so.1'])
+
+    def testChangedFiles(self):
+        self._write(self.prefix, 'x86/lib/libfoo.so.1', 'foo')
+        before = manifest.snapshot(self.prefix, ['x86'])
+        self.assertEquals(manifest.changed_files(self.prefix, before,
+                                                 ['x86']), [])
+        self._write(self.prefix, 'bin/foo', 'foo')
+        self._write(self.prefix, 'lib/libfoo.so.1', 'foo2')
+        self._write(self.prefix, 'x86/bin/foo', 'foo')
+        self.assertEquals(sorted(manifest.changed_files(self.prefix, before,
+                                                        ['x86'])),
+                          ['bin/foo', 'lib/libfoo.so.1'])
+
+    def testMergeTree(self):
+        staging = os.path.join(self.tmp, 'staging')
+        self._write(staging, 'lib/libfoo.so.1', 'foo2')
+        self._write(staging, 'share/foo/foo.txt', 'foo')
+        files = manifest.list_tree(staging)
+        manifest.merge_tree(staging, self.prefix, files)
+        self.assertEquals(manifest.list_tree(staging), [])
+        self.assertEquals(sorted(manifest.list_tree(self.prefix)),
+                          ['lib/libfoo.so', 'lib/libfoo.so.1',
+                           'share/foo/foo.txt'])
+        with open(os.path.join(self.prefix, 'lib/libfoo.so')) as f:
+            self.assertEquals(f.read(), 'foo2')
+
+    def testRemoveFiles(self):
+        self._write(self.prefix, 'share/foo/foo.txt', 'foo')
+        m = Manifest.from_dir(self.prefix)
+        self._write(self.prefix, 'lib/libfoo.so.1', 'modified')
+        self.assertEquals(manifest.remove_files(self.prefix, m),
+                          ['lib/libfoo.so.1'])
+        self.assertEquals(manifest.list_tree(self.prefix),
+                          ['lib/libfoo.so.1'])
+        self.assertFalse(os.path.exists(os.path.join(self.prefix, 'share')))
+        m = Manifest.from_dir(self.prefix)
+        m.exact = False
+        self.assertRaises(FatalError, manifest.remove_files, self.prefix, m)
+        self.assertEquals(manifest.list_tree(self.prefix),
+                          ['lib/libfoo.so.1'])
+
+    def testExact(self):
+        m = Manifest.from_dir(self.prefix)
+        self.assertTrue(m.exact)
+        m.update(Manifest(exact=False))
+        self.assertFalse(m.exact)
+        self.assertFalse(m.prefixed('x86').exact)
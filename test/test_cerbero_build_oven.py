@@ -0,0 +1,429 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+from cerbero.config import Architecture, Platform, Variants
+from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import _DepsGraph
+from cerbero.build.oven import Oven
+from cerbero.build.recipe import BuildSteps
+from cerbero.build.source import SourceType
+from cerbero.errors import BuildStepError, FatalError
+from cerbero.utils.env import Environment
+
+
+class Config(object):
+
+    interactive = False
+    binary_cache = None
+    make_jobserver = False
+    target_arch = Architecture.X86_64
+    target_platform = Platform.LINUX
+
+    def __init__(self, logs):
+        self.logs = logs
+
+
+class InstallConfig(Config):
+
+    platform = Platform.LINUX
+    py_prefix = 'lib/python2.7'
+    allow_parallel_build = False
+    num_of_cpus = 1
+    staged_install = True
+    variants = Variants([])
+
+    def __init__(self, tmp):
+        Config.__init__(self, tmp)
+        self.prefix = os.path.join(tmp, 'prefix')
+        self.sources = tmp
+        self.local_sources = tmp
+
+    def get_build_env(self):
+        return Environment(os.environ)
+
+
+MAKEFILE = '''
+install:
+\tmkdir -p $(DESTDIR)%(prefix)s/share/foo
+\techo foo > $(DESTDIR)%(prefix)s/share/foo/foo.txt
+'''
+
+
+def install_recipe(config):
+    '''
+    Creates a real recipe with a single install step running 'make install'
+    '''
+
+    # Only the classes named Recipe get the source and build types as bases
+    class Recipe(recipe.Recipe):
+
+        name = 'foo'
+        version = '1.0'
+        stype = SourceType.CUSTOM
+        btype = BuildType.MAKEFILE
+        files_misc = ['share/foo/foo.txt']
+        _default_steps = [BuildSteps.INSTALL]
+
+    r = Recipe(config)
+    os.makedirs(r.build_dir)
+    with open(os.path.join(r.build_dir, 'Makefile'), 'w') as f:
+        f.write(MAKEFILE % {'prefix': config.prefix})
+    return r
+
+
+class Recipe(object):
+    '''
+    Recipe with a single compile step, logging when it starts and finishes
+    in a file shared by all the build workers
+    '''
+
+    runtime_dep = False
+
+    def __init__(self, config, name, deps=[], duration=0, fail=False,
+                 crash=False):
+        self.config = config
+        self.name = name
+        self.deps = deps
+        self.duration = duration
+        self.fail = fail
+        self.crash = crash
+        self.steps = [('Compile', 'compile')]
+
+    def __str__(self):
+        return self.name
+
+    def list_deps(self):
+        return self.deps
+
+    def built_version(self):
+        return '1.0'
+
+    def compile(self):
+        self._log('start')
+        time.sleep(self.duration)
+        if self.crash:
+            os._exit(1)
+        if self.fail:
+            raise FatalError('%s failed' % self.name)
+        self._log('end')
+
+    def _log(self, event):
+        with open(os.path.join(self.config.logs, 'events'), 'a') as f:
+            f.write('%s %s %f\n' % (event, self.name, time.time()))
+
+
+class RuntimeRecipe(Recipe):
+
+    runtime_dep = True
+
+
+class CookBook(object):
+    '''
+    Cookbook resolving the dependencies with the same graph as the real
+    one, which adds the runtime dependencies to the other recipes
+    '''
+
+    def __init__(self, config, recipes):
+        self.config = config
+        self.recipes = dict([(r.name, r) for r in recipes])
+        self.graph = _DepsGraph(self.recipes, {})
+        self.steps = {}
+        self.built = {}
+        self.failures = []
+        self.activity = {}
+        self.manifests = {}
+
+    def get_config(self):
+        return self.config
+
+    def get_recipe(self, name):
+        return self.recipes[name]
+
+    def list_recipe_deps(self, name):
+        return [self.recipes[x] for x in self.graph.closure(name)]
+
+    def list_recipe_build_deps(self, name):
+        return self.graph.deps[name][:]
+
+    def list_recipe_build_rdeps(self, name):
+        return self.graph.reverse_closure(name)
+
+    def recipe_needs_build(self, name):
+        return name not in self.built
+
+    def step_done(self, name, step):
+        return step in self.steps.get(name, [])
+
+    def recipe_deps_changed(self, name):
+        return []
+
+    def recipe_recent_activity(self, name):
+        return self.activity.get(name, 0)
+
+    def update_step_status(self, name, step, timing=None):
+        self.steps.setdefault(name, []).append(step)
+
+    def update_build_status(self, name, built_version):
+        self.built[name] = built_version
+
+    def update_failure_status(self, name):
+        self.failures.append(name)
+
+    def reset_recipe_status(self, name):
+        self.steps.pop(name, None)
+        self.built.pop(name, None)
+
+    def update_install_manifest(self, name, manifest, replace=True):
+        self.manifests[name] = manifest
+
+
+class OvenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config(self.tmp)
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+        shutil.rmtree(self.tmp)
+
+    def cook(self, recipes, targets, jobs=4, **kwargs):
+        self.cookbook = CookBook(self.config, recipes)
+        oven = Oven(targets, self.cookbook, jobs=jobs, **kwargs)
+        oven.start_cooking()
+
+    def events(self):
+        '''
+        Gets the time each recipe started and finished
+        '''
+        events = {}
+        path = os.path.join(self.tmp, 'events')
+        if not os.path.exists(path):
+            return events
+        with open(path, 'r') as f:
+            for line in f:
+                event, name, t = line.split()
+                events.setdefault(name, {})[event] = float(t)
+        return events
+
+    def testDepsBuiltFirst(self):
+        c = self.config
+        recipes = [RuntimeRecipe(c, 'runtime', duration=0.2),
+                   Recipe(c, 'a', duration=0.2),
+                   Recipe(c, 'b', ['a'], duration=0.3),
+                   Recipe(c, 'c', ['a'], duration=0.1),
+                   Recipe(c, 'd', ['b', 'c'])]
+        self.cook(recipes, ['d'])
+        events = self.events()
+        self.assertEquals(sorted(events.keys()),
+                          ['a', 'b', 'c', 'd', 'runtime'])
+        self.assertEquals(sorted(self.cookbook.built.keys()),
+                          ['a', 'b', 'c', 'd', 'runtime'])
+        for r in recipes:
+            deps = self.cookbook.list_recipe_build_deps(r.name)
+            if r.name != 'runtime':
+                self.assertTrue('runtime' in deps)
+            for dep in deps:
+                self.assertTrue(events[dep]['end'] <=
+                                events[r.name]['start'],
+                                '%s started before %s finished' %
+                                (r.name, dep))
+
+    def testIndependentBranchesInParallel(self):
+        c = self.config
+        recipes = [Recipe(c, 'a', duration=0.5),
+                   Recipe(c, 'b', duration=0.5),
+                   Recipe(c, 'c', ['a', 'b'])]
+        self.cook(recipes, ['c'])
+        events = self.events()
+        self.assertTrue(events['a']['start'] < events['b']['end'])
+        self.assertTrue(events['b']['start'] < events['a']['end'])
+        self.assertTrue(events['c']['start'] >=
+                        max(events['a']['end'], events['b']['end']))
+
+    def testJobsLimit(self):
+        c = self.config
+        recipes = [Recipe(c, x, duration=0.3) for x in ['a', 'b', 'c']]
+        self.cook(recipes, ['a', 'b', 'c'], jobs=2)
+        events = self.events()
+        for name, e in events.iteritems():
+            running = [x for x in events.values() if
+                       x['start'] <= e['start'] < x['end']]
+            self.assertTrue(len(running) <= 2)
+
+    def testWorkerDied(self):
+        c = self.config
+        recipes = [Recipe(c, 'a', crash=True),
+                   Recipe(c, 'b', ['a'])]
+        try:
+            self.cook(recipes, ['b'])
+            self.fail('The build did not fail')
+        except BuildStepError, be:
+            self.assertEquals(be.recipe.name, 'a')
+            self.assertTrue('died unexpectedly' in be.msg)
+        self.assertEquals(self.cookbook.failures, ['a'])
+        self.assertEquals(self.cookbook.built, {})
+        self.assertFalse('b' in self.events())
+
+    def _testKeepGoing(self, jobs):
+        c = self.config
+        recipes = [Recipe(c, 'a', fail=True),
+                   Recipe(c, 'b', ['a']),
+                   Recipe(c, 'c', ['b']),
+                   Recipe(c, 'd', duration=0.2),
+                   Recipe(c, 'e', ['d']),
+                   Recipe(c, 'f', ['c', 'e'])]
+        try:
+            self.cook(recipes, ['f'], jobs=jobs, keep_going=True)
+            self.fail('The build did not fail')
+        except BuildStepError, be:
+            self.assertEquals(be.recipe.name, 'a')
+        self.assertEquals(self.cookbook.failures, ['a'])
+        # The branch not depending on the failed recipe is built
+        self.assertEquals(sorted(self.cookbook.built.keys()), ['d', 'e'])
+        self.assertEquals(sorted(self.events().keys()), ['a', 'd', 'e'])
+        output = sys.stdout.getvalue()
+        for name in ['b', 'c', 'f']:
+            self.assertTrue('%s -> blocked by a' % name in output)
+        summary = sys.stderr.getvalue()
+        summary = summary[summary.index('The following recipes failed'):]
+        self.assertEquals(summary.splitlines(), [
+            'The following recipes failed to build:',
+            '  a (compile)',
+            'The following recipes were not built because they depend on '
+                'a failed recipe:',
+            '  b (a)',
+            '  c (a)',
+            '  f (a)'])
+
+    def testKeepGoingSerial(self):
+        self._testKeepGoing(1)
+
+    def testKeepGoingParallel(self):
+        self._testKeepGoing(4)
+
+    def _build_order(self, activity):
+        c = self.config
+        recipes = [Recipe(c, 'a'),
+                   Recipe(c, 'b', ['a']),
+                   Recipe(c, 'c', ['b']),
+                   Recipe(c, 'd'),
+                   Recipe(c, 'e', ['d']),
+                   Recipe(c, 'f', ['c', 'e'])]
+        cookbook = CookBook(self.config, recipes)
+        cookbook.activity = activity
+        oven = Oven(['f'], cookbook)
+        ordered = [cookbook.get_recipe(x) for x in
+                   cookbook.graph.closure('f')]
+        self.assertEquals([r.name for r in ordered],
+                          ['a', 'b', 'c', 'd', 'e', 'f'])
+        ordered = [r.name for r in oven._fail_fast_order(ordered)]
+        self.assertEquals(sorted(ordered), ['a', 'b', 'c', 'd', 'e', 'f'])
+        for r in recipes:
+            for dep in r.deps:
+                self.assertTrue(ordered.index(dep) < ordered.index(r.name))
+        return ordered
+
+    def testFailFastOrder(self):
+        self.assertEquals(self._build_order({}),
+                          ['a', 'b', 'c', 'd', 'e', 'f'])
+        # The recently failed leaf goes first, after its dependencies
+        self.assertEquals(self._build_order({'e': 100}),
+                          ['d', 'e', 'a', 'b', 'c', 'f'])
+        # Most recent first
+        self.assertEquals(self._build_order({'b': 100, 'e': 200}),
+                          ['d', 'e', 'a', 'b', 'c', 'f'])
+        self.assertEquals(self._build_order({'b': 200, 'e': 100}),
+                          ['a', 'b', 'd', 'e', 'c', 'f'])
+        # The dependencies can't be moved after the recipe
+        self.assertEquals(self._build_order({'f': 100}),
+                          ['a', 'b', 'c', 'd', 'e', 'f'])
+
+    def testFailFastOrderBuilt(self):
+        # Recipes that are already built are not moved
+        c = self.config
+        recipes = [Recipe(c, 'a'), Recipe(c, 'b')]
+        cookbook = CookBook(self.config, recipes)
+        cookbook.activity = {'b': 100}
+        cookbook.built['b'] = '1.0'
+        oven = Oven(['a', 'b'], cookbook)
+        self.assertEquals(oven._fail_fast_order(recipes), recipes)
+        oven.force = True
+        self.assertEquals(oven._fail_fast_order(recipes),
+                          [recipes[1], recipes[0]])
+
+    def testFailFastBuild(self):
+        c = self.config
+        recipes = [Recipe(c, 'a'),
+                   Recipe(c, 'b', ['a']),
+                   Recipe(c, 'c', fail=True),
+                   Recipe(c, 'd', ['b', 'c'])]
+        cookbook = CookBook(self.config, recipes)
+        cookbook.activity = {'c': 100}
+        oven = Oven(['d'], cookbook)
+        self.failUnlessRaises(BuildStepError, oven.start_cooking)
+        # The recently failed recipe fails before building the others
+        self.assertEquals(self.events().keys(), ['c'])
+
+    def _testInstall(self, staged, missing_files, jobs=1):
+        self.config = InstallConfig(self.tmp)
+        self.config.staged_install = staged
+        self.cook([install_recipe(self.config)], ['foo'], jobs=jobs,
+                  missing_files=missing_files)
+        self.assertEquals(self.cookbook.built, {'foo': '1.0'})
+        self.assertEquals(self.cookbook.steps, {'foo': ['install']})
+        path = os.path.join(self.config.prefix, 'share', 'foo', 'foo.txt')
+        self.assertTrue(os.path.isfile(path))
+        manifest = self.cookbook.manifests['foo']
+        if staged:
+            self.assertTrue(manifest.exact)
+            self.assertEquals(manifest.files_list(), ['share/foo/foo.txt'])
+        else:
+            # The files installed in the prefix are not recorded exactly
+            self.assertEquals(manifest.files_list(), [])
+        if missing_files:
+            self.assertFalse('where not installed' in sys.stdout.getvalue())
+
+    def testInstallStaged(self):
+        self._testInstall(True, False)
+
+    def testInstallStagedParallel(self):
+        self._testInstall(True, False, jobs=2)
+
+    def testInstallStagedMissingFiles(self):
+        self._testInstall(True, True)
+
+    def testInstallInPrefix(self):
+        self._testInstall(False, False)
+
+    def testInstallInPrefixMissingFiles(self):
+        self._testInstall(False, True)
@@ -0,0 +1,68 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build import prefixindex
+
+
+class PrefixIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for f in ['bin/.hidden', 'bin/gst-launch', 'lib/libfoo.so.1',
+                  'lib/libfoo.a', 'lib/gstreamer-1.0/libgstcore.so',
+                  'share/locale/es/LC_MESSAGES/foo.mo',
+                  'share/locale/fr/LC_MESSAGES/foo.mo']:
+            self._touch(f)
+        os.symlink('libfoo.so.1', os.path.join(self.tmp, 'lib/libfoo.so'))
+        self.index = prefixindex.get_index(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _touch(self, filename):
+        path = os.path.join(self.tmp, filename)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def _ls(self, patterns):
+        return sorted(self.index.ls_files(patterns))
+
+    def testPatterns(self):
+        self.assertEquals(self._ls(['bin/*']), ['bin/gst-launch'])
+        self.assertEquals(self._ls(['lib/libfoo.so*']),
+                          ['lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertEquals(self._ls(['lib/*']), ['lib/libfoo.a',
+                          'lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertEquals(self._ls(['share/locale/*/LC_MESSAGES/foo.mo']),
+                          ['share/locale/es/LC_MESSAGES/foo.mo',
+                           'share/locale/fr/LC_MESSAGES/foo.mo'])
+        self.assertEquals(self._ls(['lib/libfoo.a lib/libfoo.la', 'nothing']),
+                          ['lib/libfoo.a'])
+
+    def testInvalidate(self):
+        self.assertEquals(self._ls(['bin/*']), ['bin/gst-launch'])
+        self._touch('bin/gst-inspect')
+        prefixindex.invalidate()
+        self.assertEquals(self._ls(['bin/*']),
+                          ['bin/gst-inspect', 'bin/gst-launch'])
@@ -0,0 +1,90 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.config import Variants
+from cerbero.build.recipeindex import RecipeIndex, RecipeMetadata
+from test.test_common import DummyConfig
+from test.test_build_common import Recipe1
+
+
+class Config(DummyConfig):
+
+    arch = None
+    distro = None
+    distro_version = None
+
+    def __init__(self):
+        self.variants = Variants([])
+        self.arch_config = {self.target_arch: self}
+
+
+class RecipeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config()
+        self.index_path = os.path.join(self.tmp, 'cache.index')
+        self.recipe_file = os.path.join(self.tmp, 'recipe1.recipe')
+        with open(self.recipe_file, 'w') as f:
+            f.write('recipe1')
+        self.recipe = Recipe1(self.config)
+        self.recipe.deps = ['recipe2']
+        self.recipe.__file__ = self.recipe_file
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _saved_index(self):
+        index = RecipeIndex(self.index_path, self.config)
+        index.add(self.recipe_file, None, RecipeMetadata(self.recipe))
+        index.save()
+        return RecipeIndex(self.index_path, self.config)
+
+    def testMetadata(self):
+        metadata = self._saved_index().get(self.recipe_file, None)
+        self.assertEquals(metadata.name, 'recipe1')
+        self.assertEquals(metadata.list_deps(), ['recipe2'])
+        self.assertEquals(metadata.__file__, self.recipe_file)
+        self.assertEquals(sorted(metadata.categories),
+                          sorted(self.recipe._files_categories()))
+
+    def testInvalidation(self):
+        index = self._saved_index()
+        self.assertIsNone(index.get(self.recipe_file, 'custom'))
+        self.config.variants.gi = True
+        self.assertIsNone(RecipeIndex(self.index_path, self.config).get(
+            self.recipe_file, None))
+        self.config.variants.gi = False
+        config_file = os.path.join(self.tmp, 'local.cbc')
+        with open(config_file, 'w') as f:
+            f.write('prefix = "/opt"')
+        self.config.config_files = [config_file]
+        index = self._saved_index()
+        self.assertIsNotNone(index.get(self.recipe_file, None))
+        with open(config_file, 'w') as f:
+            f.write('prefix = "/usr"')
+        self.assertIsNone(RecipeIndex(self.index_path, self.config).get(
+            self.recipe_file, None))
+        with open(self.recipe_file, 'w') as f:
+            f.write('recipe1 modified')
+        self.assertIsNone(index.get(self.recipe_file, None))
@@ -0,0 +1,82 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from cerbero.build.sourcestore import SourceStore
+from cerbero.errors import FatalError
+from cerbero.utils import git, shell
+
+
+class SourceStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = SourceStore(os.path.join(self.tmp, 'store'))
+        self.tarball = os.path.join(self.tmp, 'foo-1.0.tar.gz')
+        with open(self.tarball, 'wb') as f:
+            f.write('foo' * 1000)
+        self.url = 'file://' + self.tarball
+        self.sha256 = hashlib.sha256('foo' * 1000).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testFetchTarball(self):
+        dest1 = os.path.join(self.tmp, 'home1', 'foo-1.0.tar.gz')
+        dest2 = os.path.join(self.tmp, 'home2', 'foo-1.0.tar.gz')
+        self.store.fetch_tarball(self.url, dest1)
+        self.assertEquals(self.store.lookup_tarball(self.url),
+                          self.store.tarball_path(self.sha256))
+        # The second configuration doesn't download it again
+        os.remove(self.tarball)
+        self.store.fetch_tarball(self.url, dest2, self.sha256)
+        self.assertTrue(os.path.samefile(dest1, dest2))
+        self.assertTrue(os.path.samefile(dest1,
+                        self.store.tarball_path(self.sha256)))
+
+    def testChecksum(self):
+        dest = os.path.join(self.tmp, 'home', 'foo-1.0.tar.gz')
+        self.assertRaises(FatalError, self.store.fetch_tarball, self.url,
+                          dest, '0' * 64)
+        self.assertFalse(os.path.exists(dest))
+        self.assertEquals(self.store.lookup_tarball(self.url), None)
+
+    def testGitMirror(self):
+        remote = os.path.join(self.tmp, 'remote')
+        git.init(remote)
+        shell.call('touch foo && git add foo && '
+                   'git -c user.name=a -c user.email=a@a commit -q -m foo '
+                   '&& git branch sdk-1.0', remote)
+        commit = git.get_hash(remote, 'sdk-1.0')
+        mirror = self.store.update_git_mirror(remote)
+        self.assertEquals(mirror, self.store.git_mirror(remote))
+        self.assertEquals(git.get_hash(mirror, 'sdk-1.0'), commit)
+        repo = os.path.join(self.tmp, 'repo')
+        git.init(repo)
+        git.add_alternate(repo, os.path.join(mirror, 'objects'))
+        git.add_alternate(repo, os.path.join(mirror, 'objects'))
+        with open(os.path.join(repo, '.git/objects/info/alternates')) as f:
+            self.assertEquals(f.read().splitlines(),
+                              [os.path.join(mirror, 'objects')])
+        git.fetch_url(repo, mirror, '+refs/heads/*:refs/remotes/origin/*')
+        self.assertEquals(git.get_hash(repo, 'origin/sdk-1.0'), commit)
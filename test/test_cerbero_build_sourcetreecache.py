@@ -0,0 +1,102 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.sourcetreecache import SourceTreeCache
+
+
+class SourceTreeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = SourceTreeCache(os.path.join(self.tmp, 'cache'),
+                                     1024 * 1024)
+        self.tree = os.path.join(self.tmp, 'tree')
+        self._write('tree/configure', 'configure')
+        self._write('tree/src/foo.c', 'int foo;')
+        self._write('tree/.git/objects/ab/cdef', 'object')
+        self._write('tree/.git/logs/HEAD', 'log')
+        os.symlink('foo.c', os.path.join(self.tree, 'src', 'link.c'))
+        self.tarball = self._write('foo-1.0.tar.gz', 'tarball')
+        self.patch = self._write('0001-foo.patch', 'patch')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.tmp, filename)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _read(self, filename):
+        with open(os.path.join(self.tmp, filename)) as f:
+            return f.read()
+
+    def testKey(self):
+        key = self.cache.tree_key(self.tarball, [self.patch])
+        self.assertEquals(key, self.cache.tree_key(self.tarball,
+                                                   [self.patch]))
+        self.assertNotEquals(key, self.cache.tree_key(self.tarball, []))
+        self.assertNotEquals(key, self.cache.tree_key(self.tarball,
+                                                      [self.patch], 2))
+        self._write('0001-foo.patch', 'patch2')
+        self.assertNotEquals(key, self.cache.tree_key(self.tarball,
+                                                      [self.patch]))
+
+    def testStoreRestore(self):
+        key = self.cache.tree_key(self.tarball, [self.patch])
+        self.assertFalse(self.cache.lookup(key))
+        self.assertFalse(self.cache.restore(key,
+                         os.path.join(self.tmp, 'build')))
+        self.cache.store(key, self.tree)
+        self.assertTrue(self.cache.lookup(key))
+        self.assertTrue(self.cache.restore(key,
+                        os.path.join(self.tmp, 'build')))
+        self.assertEquals(self._read('build/configure'), 'configure')
+        self.assertEquals(self._read('build/src/foo.c'), 'int foo;')
+        self.assertEquals(os.readlink(os.path.join(self.tmp, 'build', 'src',
+                                                   'link.c')), 'foo.c')
+        # The git objects are shared, the sources are not
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.tmp, 'build', '.git', 'objects', 'ab', 'cdef'),
+            os.path.join(self.tree, '.git', 'objects', 'ab', 'cdef')))
+        self.assertEquals(self._read('build/.git/logs/HEAD'), 'log')
+        self.assertFalse(os.path.samefile(
+            os.path.join(self.tmp, 'build', '.git', 'logs', 'HEAD'),
+            os.path.join(self.tree, '.git', 'logs', 'HEAD')))
+        self._write('build/src/foo.c', 'int bar;')
+        self.assertTrue(self.cache.restore(key,
+                        os.path.join(self.tmp, 'build2')))
+        self.assertEquals(self._read('build2/src/foo.c'), 'int foo;')
+
+    def testEvict(self):
+        self.cache.max_size = 40
+        key1 = self.cache.tree_key(self.tarball, [])
+        key2 = self.cache.tree_key(self.tarball, [self.patch])
+        self.cache.store(key1, self.tree)
+        os.utime(os.path.join(self.cache.path, key1[:2], key1), (0, 0))
+        self.cache.store(key2, self.tree)
+        self.assertFalse(self.cache.lookup(key1))
+        self.assertTrue(self.cache.lookup(key2))
@@ -0,0 +1,113 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import sys
+import unittest
+import StringIO
+
+from cerbero.commands.buildstats import BuildStats
+
+
+def timing(wall, user=None, sys=None, maxrss=None):
+    return {'time': 0, 'wall': wall, 'user': user, 'sys': sys,
+            'maxrss': maxrss}
+
+
+class CookBook(object):
+
+    DEPS = {'glib': [], 'gstreamer': ['glib'], 'gst-plugins': ['gstreamer'],
+            'zlib': []}
+
+    def list_recipe_build_deps(self, recipe_name):
+        return self.DEPS[recipe_name]
+
+
+class BuildStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timings = {
+            'glib': {'compile': [timing(10), timing(30, 20, 5, 204800)],
+                     'install': [timing(2)]},
+            'gstreamer': {'compile': [timing(50), timing(40)]},
+            'gst-plugins': {'compile': [timing(5)]},
+            'zlib': {'compile': [timing(60)]},
+            }
+        self.last = {}
+        for recipe, steps in self.timings.iteritems():
+            self.last[recipe] = dict([(s, h[-1]) for s, h in
+                                      steps.iteritems()])
+        self.stats = BuildStats()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def output(self):
+        return sys.stdout.getvalue().splitlines()
+
+    def testSlowestRecipes(self):
+        self.stats._print_slowest_recipes(self.last, 3)
+        self.assertEquals(self.output(), [
+            'Slowest recipes:',
+            '      60.0s  zlib',
+            '      40.0s  gstreamer',
+            '      32.0s  glib'])
+
+    def testSlowestSteps(self):
+        self.stats._print_slowest_steps(self.last, 2)
+        self.assertEquals(self.output(), [
+            'Slowest steps:',
+            '      60.0s  zlib compile (cpu: -, peak rss: -)',
+            '      40.0s  gstreamer compile (cpu: -, peak rss: -)'])
+        sys.stdout = StringIO.StringIO()
+        self.stats._print_slowest_steps({'glib': self.last['glib']}, 1)
+        self.assertEquals(self.output(), [
+            'Slowest steps:',
+            '      30.0s  glib compile (cpu: 25.0s, peak rss: 200MB)'])
+
+    def testTrends(self):
+        self.stats._print_trends(self.timings, 10)
+        self.assertEquals(self.output(), [
+            'Biggest changes (last run against the average of the '
+                'previous ones):',
+            '  +20.0s (+200%)  glib compile (10.0s -> 30.0s, 2 runs)',
+            '  -10.0s (-20%)  gstreamer compile (50.0s -> 40.0s, 2 runs)'])
+
+    def testNoTrends(self):
+        self.stats._print_trends({'zlib': self.timings['zlib']}, 10)
+        self.assertEquals(self.output(), [])
+
+    def testCriticalPath(self):
+        self.stats._print_critical_path(CookBook(), self.timings.keys(),
+                                        self.last)
+        self.assertEquals(self.output(), [
+            'Critical path (77.0s):',
+            '      32.0s  glib',
+            '      40.0s  gstreamer',
+            '       5.0s  gst-plugins'])
+
+    def testCriticalPathSubset(self):
+        # Dependencies outside the listed recipes are not followed
+        self.stats._print_critical_path(CookBook(),
+                                        ['gstreamer', 'gst-plugins'],
+                                        self.last)
+        self.assertEquals(self.output(), [
+            'Critical path (45.0s):',
+            '      40.0s  gstreamer',
+            '       5.0s  gst-plugins'])
@@ -148,6 +148,21 @@ class LinuxPackagesTest(unittest.TestCase):
         for k, v in env.iteritems():
             self.assertEquals(os.environ[k], v)
 
+    def testBuildEnv(self):
+        config = Config()
+        tmpdir = tempfile.mkdtemp()
+        config.prefix = tmpdir
+        config.load_defaults()
+        config.build_tools_prefix = tmpdir
+        config.variants = cconfig.Variants(config.variants)
+        environ = dict(os.environ)
+        env = config.get_build_env()
+        self.assertEquals(dict(os.environ), environ)
+        self.assertEquals(env[cconfig.CERBERO_PREFIX], tmpdir)
+        self.assertEquals(env['PKG_CONFIG_LIBDIR'],
+                          os.path.join(tmpdir, 'lib', 'pkgconfig'))
+        self.assertTrue(config.get_build_env() is env)
+
     def testParseBadConfigFile(self):
         config = Config()
         tmpfile = tempfile.NamedTemporaryFile()
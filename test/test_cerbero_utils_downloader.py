@@ -0,0 +1,110 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+
+from cerbero.errors import FatalError
+from cerbero.utils import downloader
+
+
+DATA = ''.join([chr(i % 256) for i in range(200000)])
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves DATA on any path with support for range requests, keeping the
+    ranges requested in the server
+    '''
+
+    def do_GET(self):
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+        self.server.ranges.append(start)
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if start >= len(DATA):
+            self.send_error(416)
+            return
+        self.send_response(match and 206 or 200)
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.sha256 = hashlib.sha256(DATA).hexdigest()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testDownload(self):
+        dest = os.path.join(self.tmp, 'sub', 'file.tar.gz')
+        downloader.download(self.url + 'file.tar.gz', dest, self.sha256)
+        self.assertEquals(self._read(dest), DATA)
+        self.assertFalse(os.path.exists(dest + downloader.PARTIAL_EXT))
+        # Already downloaded and verified
+        downloader.download(self.url + 'file.tar.gz', dest, self.sha256)
+        self.assertEquals(self.server.ranges, [0])
+
+    def testResume(self):
+        dest = os.path.join(self.tmp, 'file.tar.gz')
+        with open(dest + downloader.PARTIAL_EXT, 'wb') as f:
+            f.write(DATA[:1000])
+        downloader.download(self.url + 'file.tar.gz', dest, self.sha256)
+        self.assertEquals(self._read(dest), DATA)
+        self.assertEquals(self.server.ranges, [1000])
+
+    def testChecksum(self):
+        dest = os.path.join(self.tmp, 'file.tar.gz')
+        self.assertRaises(FatalError, downloader.download,
+                          self.url + 'file.tar.gz', dest, '0' * 64)
+        self.assertFalse(os.path.exists(dest))
+        self.assertFalse(os.path.exists(dest + downloader.PARTIAL_EXT))
+        # A corrupted file is downloaded again
+        with open(dest, 'wb') as f:
+            f.write('corrupted')
+        downloader.download(self.url + 'file.tar.gz', dest, self.sha256)
+        self.assertEquals(self._read(dest), DATA)
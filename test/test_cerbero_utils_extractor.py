@@ -0,0 +1,104 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+import subprocess
+from distutils.spawn import find_executable
+
+from cerbero.errors import FatalError
+from cerbero.utils import extractor
+
+
+class ExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        os.makedirs(os.path.join(self.src, 'foo-1.0', 'src'))
+        with open(os.path.join(self.src, 'foo-1.0', 'src', 'foo.c'), 'w') as f:
+            f.write('int foo;\n' * 10000)
+        os.symlink('src/foo.c', os.path.join(self.src, 'foo-1.0', 'link.c'))
+        os.link(os.path.join(self.src, 'foo-1.0', 'src', 'foo.c'),
+                os.path.join(self.src, 'foo-1.0', 'hardlink.c'))
+        self.out = os.path.join(self.tmp, 'out')
+        os.makedirs(self.out)
+        self._decompressors = extractor.DECOMPRESSORS
+        self._gnu_tar = extractor._gnu_tar
+
+    def tearDown(self):
+        extractor.DECOMPRESSORS = self._decompressors
+        extractor._gnu_tar = self._gnu_tar
+        shutil.rmtree(self.tmp)
+
+    def _tar(self, ext, compression):
+        path = os.path.join(self.tmp, 'foo-1.0' + ext)
+        tf = tarfile.open(path, 'w:%s' % compression)
+        tf.add(os.path.join(self.src, 'foo-1.0'), 'foo-1.0')
+        tf.close()
+        return path
+
+    def _check(self, dirname):
+        path = os.path.join(self.out, dirname)
+        with open(os.path.join(path, 'src', 'foo.c')) as f:
+            self.assertEquals(f.read(), 'int foo;\n' * 10000)
+        self.assertEquals(os.readlink(os.path.join(path, 'link.c')),
+                          'src/foo.c')
+        self.assertTrue(os.path.samefile(os.path.join(path, 'hardlink.c'),
+                        os.path.join(path, 'src', 'foo.c')))
+
+    def testTarGz(self):
+        extractor.extract(self._tar('.tar.gz', 'gz'), self.out)
+        self._check('foo-1.0')
+
+    def testInProcess(self):
+        extractor.DECOMPRESSORS = {}
+        extractor.extract(self._tar('.tar.bz2', 'bz2'), self.out,
+                          ('foo-1.0', 'foo'))
+        self._check('foo')
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'foo-1.0')))
+
+    def testTarXz(self):
+        if find_executable('xz') is None:
+            return
+        path = self._tar('.tar', '')
+        subprocess.check_call(['xz', path])
+        extractor.extract(path + '.xz', self.out, ('foo-1.0', 'foo+1.0'))
+        self._check('foo+1.0')
+        # Without GNU tar
+        extractor._gnu_tar = ''
+        extractor.extract(path + '.xz', self.out, ('foo-1.0', 'foo'))
+        self._check('foo')
+
+    def testZip(self):
+        path = os.path.join(self.tmp, 'foo-1.0.zip')
+        zf = zipfile.ZipFile(path, 'w')
+        zf.write(os.path.join(self.src, 'foo-1.0', 'src', 'foo.c'),
+                 'foo-1.0/src/foo.c')
+        zf.close()
+        extractor.extract(path, self.out, ('foo-1.0', 'foo'))
+        self.assertTrue(os.path.exists(os.path.join(self.out, 'foo', 'src',
+                                                    'foo.c')))
+
+    def testUnknownFormat(self):
+        self.assertRaises(FatalError, extractor.extract,
+                          os.path.join(self.tmp, 'foo.rar'), self.out)
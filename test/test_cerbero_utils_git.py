@@ -0,0 +1,78 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.utils import git, shell
+
+
+class LocalUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp, 'repo')
+        self.build = os.path.join(self.tmp, 'build')
+        git.init(self.repo)
+        self._commit('a.c', 'a1')
+        self._commit('b.c', 'b1')
+        self.first = git.get_hash(self.repo, 'HEAD').strip()
+        self._commit('b.c', 'b2')
+        self.second = git.get_hash(self.repo, 'HEAD').strip()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _commit(self, filename, content):
+        with open(os.path.join(self.repo, filename), 'w') as f:
+            f.write(content)
+        shell.call('git add %s && git -c user.name=a -c user.email=a@a '
+                   'commit -q -m %s' % (filename, content), self.repo)
+
+    def _read(self, filename):
+        with open(os.path.join(self.build, filename)) as f:
+            return f.read()
+
+    def testLocalUpdate(self):
+        git.local_update(self.build, self.repo, self.first)
+        self.assertEquals(self._read('b.c'), 'b1')
+        with open(os.path.join(self.build, 'b.o'), 'w') as f:
+            f.write('object')
+        os.utime(os.path.join(self.build, 'a.c'), (0, 0))
+        git.local_update(self.build, self.repo, self.second)
+        self.assertEquals(self._read('b.c'), 'b2')
+        # Unchanged and untracked files are kept
+        self.assertEquals(os.path.getmtime(os.path.join(self.build, 'a.c')),
+                          0)
+        self.assertEquals(self._read('b.o'), 'object')
+        # The source repository is untouched
+        self.assertEquals(git.get_hash(self.repo, 'HEAD').strip(),
+                          self.second)
+        self.assertFalse(os.path.exists(os.path.join(self.repo, '.git',
+                                                     'refs', 'heads',
+                                                     'cerbero_build')))
+
+    def testCheckoutId(self):
+        git.local_update(self.build, self.repo, self.first)
+        self.assertEquals(git.get_checkout_id(self.build), None)
+        git.set_checkout_id(self.build, self.first)
+        self.assertEquals(git.get_checkout_id(self.build), self.first)
+        git.set_checkout_id(self.build, None)
+        self.assertEquals(git.get_checkout_id(self.build), None)
@@ -0,0 +1,160 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import stat
+import errno
+import shutil
+import tempfile
+import unittest
+import subprocess
+import multiprocessing
+import StringIO
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cerbero.utils import jobserver
+
+
+def other_instance(path, slots, started, stop):
+    # A jobserver started by another cerbero instance
+    jobserver.start(path, slots)
+    started.set()
+    stop.wait()
+    jobserver.stop()
+
+
+@unittest.skipUnless(jobserver.supported(), 'jobserver not supported')
+class JobserverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'jobserver')
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        jobserver.stop()
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+        shutil.rmtree(self.tmp)
+
+    def tokens(self):
+        '''
+        Counts the tokens available in the jobserver
+        '''
+        fd_r, fd_w = jobserver._fds
+        flags = fcntl.fcntl(fd_r, fcntl.F_GETFL)
+        fcntl.fcntl(fd_r, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        tokens = ''
+        try:
+            while True:
+                try:
+                    data = os.read(fd_r, 1024)
+                except OSError, ex:
+                    if ex.errno != errno.EAGAIN:
+                        raise
+                    break
+                if not data:
+                    break
+                tokens += data
+        finally:
+            fcntl.fcntl(fd_r, fcntl.F_SETFL, flags)
+        os.write(fd_w, tokens)
+        return tokens
+
+    def pids(self):
+        return jobserver._read_pids(self.path)
+
+    def start_other_instance(self, slots):
+        started = multiprocessing.Event()
+        stop = multiprocessing.Event()
+        process = multiprocessing.Process(target=other_instance,
+                args=(self.path, slots, started, stop))
+        process.start()
+        started.wait(10)
+        return process, stop
+
+    def testMakeflags(self):
+        self.assertEquals(jobserver.makeflags(4), '-j4')
+        self.assertTrue(jobserver.start(self.path, 4))
+        self.assertEquals(jobserver.makeflags(4),
+                          '-j --jobserver-fds=%d,%d' % jobserver._fds)
+        jobserver.stop()
+        self.assertEquals(jobserver.makeflags(4), '-j4')
+
+    def testCreate(self):
+        self.assertTrue(jobserver.start(self.path, 4))
+        self.assertTrue(stat.S_ISFIFO(os.stat(self.path).st_mode))
+        self.assertEquals(self.pids(), [os.getpid()])
+        # make already owns one implicit slot
+        self.assertEquals(self.tokens(), jobserver.TOKEN * 3)
+        self.assertTrue('Created make jobserver' in sys.stdout.getvalue())
+        # Starting it again in the same instance does nothing
+        self.assertTrue(jobserver.start(self.path, 8))
+        self.assertEquals(self.pids(), [os.getpid()])
+        jobserver.stop()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.pids'))
+
+    def testJoin(self):
+        process, stop = self.start_other_instance(3)
+        try:
+            self.assertTrue(os.path.exists(self.path))
+            self.assertEquals(self.pids(), [process.pid])
+            # The slots of the existing jobserver are kept
+            self.assertTrue(jobserver.start(self.path, 8))
+            self.assertTrue('Joined make jobserver' in sys.stdout.getvalue())
+            self.assertEquals(self.tokens(), jobserver.TOKEN * 2)
+            self.assertEquals(self.pids(), [process.pid, os.getpid()])
+            # The FIFO is left to the other instance
+            jobserver.stop()
+            self.assertTrue(stat.S_ISFIFO(os.stat(self.path).st_mode))
+            self.assertEquals(self.pids(), [process.pid])
+        finally:
+            stop.set()
+            process.join()
+        # The last instance leaving removes it
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.pids'))
+
+    def testOtherInstanceLeaves(self):
+        process, stop = self.start_other_instance(3)
+        self.assertTrue(jobserver.start(self.path, 8))
+        stop.set()
+        process.join()
+        self.assertTrue(stat.S_ISFIFO(os.stat(self.path).st_mode))
+        self.assertEquals(self.pids(), [os.getpid()])
+        self.assertEquals(self.tokens(), jobserver.TOKEN * 2)
+
+    def testRecreateStale(self):
+        # A jobserver left by instances that died, with its tokens lost
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        os.mkfifo(self.path, 0600)
+        with open(self.path + '.pids', 'w') as f:
+            f.write(str(dead.pid))
+        self.assertTrue(jobserver.start(self.path, 4))
+        self.assertTrue('Created make jobserver' in sys.stdout.getvalue())
+        self.assertEquals(self.pids(), [os.getpid()])
+        self.assertEquals(self.tokens(), jobserver.TOKEN * 3)
@@ -0,0 +1,71 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import threading
+import subprocess
+import unittest
+
+from cerbero.utils import rusage
+
+
+def python(code):
+    return subprocess.Popen([sys.executable, '-c', code])
+
+
+# Allocates about 100MB
+BIG = "x = ' ' * (100 * 1024 * 1024)"
+
+
+@unittest.skipUnless(hasattr(os, 'wait4'), 'wait4() not available')
+class RUsageTest(unittest.TestCase):
+
+    def tearDown(self):
+        rusage.stop_recording()
+
+    def testReturnCode(self):
+        self.assertEquals(rusage.wait(python('import sys; sys.exit(3)')), 3)
+        self.assertEquals(rusage.wait(python('import os; os.kill('
+                          'os.getpid(), 9)')), -9)
+
+    def testNotRecording(self):
+        self.assertEquals(rusage.wait(python('pass')), 0)
+        self.assertEquals(rusage.stop_recording(), None)
+
+    def testRecordPerCommand(self):
+        rusage.start_recording()
+        rusage.wait(python(BIG))
+        usage = rusage.stop_recording()
+        self.assertTrue(usage['maxrss'] > 100 * 1024)
+        self.assertTrue(usage['user'] + usage['sys'] > 0)
+
+        # The peak of a previous recording is not carried over
+        rusage.start_recording()
+        rusage.wait(python('pass'))
+        usage = rusage.stop_recording()
+        self.assertTrue(usage['maxrss'] < 100 * 1024)
+
+    def testRecordPerThread(self):
+        rusage.start_recording()
+        t = threading.Thread(target=lambda: rusage.wait(python(BIG)))
+        t.start()
+        t.join()
+        usage = rusage.stop_recording()
+        self.assertEquals(usage['maxrss'], None)
+        self.assertEquals(usage['user'], 0)
@@ -16,7 +16,10 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+
 from cerbero.config import Platform, Distro, Architecture, DEFAULT_PACKAGER
+from cerbero.utils.env import Environment
 
 
 class DummyConfig(object):
@@ -37,6 +40,12 @@ class DummyConfig(object):
     packages_prefix = ''
     packager = DEFAULT_PACKAGER
     install_dir = ''
+    source_store = None
+    source_tree_cache = None
+    config_files = []
+
+    def get_build_env(self):
+        return Environment(os.environ)
 
 
 class XMLMixin():